@@ -0,0 +1,285 @@
+# api/assessment_writer.py
+import fcntl
+import json
+import os
+import queue
+import threading
+import logging
+import time
+
+import psycopg2
+
+from api.persistence import upsert_assessments
+from common.metrics import DB_ERRORS, DECISIONS, Counter
+
+SPILLED = Counter(
+    "fraud_assessment_spilled_total",
+    "Assessments written to the on-disk spill file.",
+)
+DEAD_LETTERED = Counter(
+    "fraud_assessment_dead_letter_total",
+    "Spilled assessments that kept failing on their own and were set aside.",
+)
+
+ASSESSMENT_WRITE_BEHIND = os.getenv("ASSESSMENT_WRITE_BEHIND", "0") == "1"
+ASSESSMENT_QUEUE_MAX = int(os.getenv("ASSESSMENT_QUEUE_MAX", "10000"))
+ASSESSMENT_FLUSH_SIZE = int(os.getenv("ASSESSMENT_FLUSH_SIZE", "500"))
+ASSESSMENT_FLUSH_INTERVAL_MS = float(os.getenv("ASSESSMENT_FLUSH_INTERVAL_MS", "50"))
+ASSESSMENT_PUT_TIMEOUT_MS = float(os.getenv("ASSESSMENT_PUT_TIMEOUT_MS", "100"))
+ASSESSMENT_SPILL_PATH = os.getenv("ASSESSMENT_SPILL_PATH", "/tmp/fraud_assessment_spill.jsonl")
+ASSESSMENT_SPILL_MAX_ATTEMPTS = int(os.getenv("ASSESSMENT_SPILL_MAX_ATTEMPTS", "5"))
+ASSESSMENT_DEAD_LETTER_PATH = os.getenv("ASSESSMENT_DEAD_LETTER_PATH", "/tmp/fraud_assessment_dead.jsonl")
+
+# the database being down or slow, as opposed to something wrong with the rows
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+log = logging.getLogger("fraud.assessment_writer")
+
+
+class AssessmentWriter:
+    """
+    Write-behind persistence for risk_assessments.
+
+    submit() enqueues an assessment row and returns immediately. A background
+    thread flushes the queue with one multi-row upsert whenever flush_size rows
+    are waiting or flush_interval_ms has passed.
+
+    - Backpressure: submit() blocks for up to put_timeout_ms when the queue is full.
+    - Spill: rows that still don't fit, and batches that fail to flush, are appended
+      to an on-disk JSONL file; it is replayed on startup and after the next
+      successful flush, from a .replaying copy that survives a crash mid-replay.
+      Replayed rows never overwrite an assessment written since.
+      A spilled row that fails on its own max_attempts times (connection errors
+      don't count) moves to a dead-letter JSONL file.
+    - Shutdown: close() stops intake, drains the queue and spills whatever the
+      database would not take.
+    """
+
+    def __init__(
+        self,
+        get_conn,
+        max_queue: int = ASSESSMENT_QUEUE_MAX,
+        flush_size: int = ASSESSMENT_FLUSH_SIZE,
+        flush_interval_ms: float = ASSESSMENT_FLUSH_INTERVAL_MS,
+        put_timeout_ms: float = ASSESSMENT_PUT_TIMEOUT_MS,
+        spill_path: str = ASSESSMENT_SPILL_PATH,
+        max_attempts: int = ASSESSMENT_SPILL_MAX_ATTEMPTS,
+        dead_letter_path: str = ASSESSMENT_DEAD_LETTER_PATH,
+    ):
+        self._get_conn = get_conn
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._flush_size = flush_size
+        self._flush_interval_s = flush_interval_ms / 1000.0
+        self._put_timeout_s = put_timeout_ms / 1000.0
+        self._spill_path = spill_path
+        self._max_attempts = max_attempts
+        self._dead_letter_path = dead_letter_path
+        self._spill_pending = (
+            os.path.exists(spill_path) and os.path.getsize(spill_path) > 0
+            or os.path.exists(spill_path + ".replaying")
+        )
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="assessment-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, transaction_id, prob, risk_score, decision, reasons) -> None:
+        row = (transaction_id, float(prob), int(risk_score), decision, reasons)
+        if self._closed.is_set():
+            self._spill([row])
+            return
+        try:
+            self._queue.put(row, timeout=self._put_timeout_s)
+        except queue.Full:
+            self._spill([row])
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def close(self, timeout: float = 10.0) -> None:
+        self._closed.set()
+        self._thread.join(timeout=timeout)
+        # anything the flusher didn't get to goes to disk
+        leftover = self._drain(block=False)
+        if leftover:
+            self._spill(leftover)
+
+    def _drain(self, block: bool) -> list:
+        rows = []
+        deadline = time.monotonic() + self._flush_interval_s
+        while len(rows) < self._flush_size:
+            try:
+                if block:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    rows.append(self._queue.get(timeout=remaining))
+                else:
+                    rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self):
+        while True:
+            closing = self._closed.is_set()
+            rows = self._drain(block=not closing)
+            if rows:
+                if self._flush(rows):
+                    if self._spill_pending:
+                        self._replay_spill()
+                else:
+                    self._spill(rows)
+                    if not closing:
+                        time.sleep(min(1.0, self._flush_interval_s * 10))
+            elif closing:
+                return
+            elif self._spill_pending and not self._replay_spill():
+                time.sleep(min(1.0, self._flush_interval_s * 10))
+
+    def _flush(self, rows) -> bool:
+        return self._write(rows) is None
+
+    def _write(self, rows, replay: bool = False) -> Exception | None:
+        """One upsert and commit; returns the error instead of raising."""
+        # one statement can't upsert the same key twice; last write wins
+        latest = {}
+        for row in rows:
+            latest[row[0]] = row
+        try:
+            conn = self._get_conn()
+            try:
+                with conn.cursor() as cur:
+                    new = upsert_assessments(cur, list(latest.values()), skip_existing=replay)
+                conn.commit()
+            finally:
+                conn.close()
+            for decision in new:
+                DECISIONS.inc(decision=decision)
+            return None
+        except Exception as exc:
+            DB_ERRORS.inc(kind=f"assessment_flush:{type(exc).__name__}")
+            return exc
+
+    def _spill(self, rows, attempts: int = 0) -> None:
+        self._append(self._spill_path, [[*row, attempts] for row in rows])
+        SPILLED.inc(len(rows))
+        self._spill_pending = True
+
+    @staticmethod
+    def _append(path: str, records) -> None:
+        while True:
+            f = open(path, "a")
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                st = os.fstat(f.fileno())
+                try:
+                    current = os.stat(path)
+                except FileNotFoundError:
+                    current = None
+                # a replay renamed the file while we waited for the lock; append to the new one
+                if current is None or (st.st_dev, st.st_ino) != (current.st_dev, current.st_ino):
+                    continue
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                return
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+                f.close()
+
+    def _claim_spill(self) -> str | None:
+        """
+        Path of the file to replay: a .replaying file left by a replay that didn't
+        finish, else the spill file renamed to it under its lock. None when there
+        is nothing to replay.
+        """
+        replaying = self._spill_path + ".replaying"
+        if os.path.exists(replaying):
+            return replaying
+        try:
+            f = open(self._spill_path, "r")
+        except FileNotFoundError:
+            return None
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                os.rename(self._spill_path, replaying)
+                return replaying
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_spill(path: str) -> list:
+        """[(row, attempts)] from a spill file."""
+        with open(path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        # lines spilled before attempts were recorded hold just the row
+        return [(tuple(r[:5]), r[5] if len(r) > 5 else 0) for r in records]
+
+    def _replay_spill(self) -> bool:
+        """
+        Write the spill file back to the database. The file is renamed to
+        <spill>.replaying under its lock and replayed from there without it, so
+        appends from other processes don't wait on the database, and a replay cut
+        short by a crash is picked up again (replays never overwrite, so rows
+        written twice are harmless). Rows that fail are appended back to the spill
+        file before the .replaying file is removed; False when any did.
+        Replays are serialized per host by a lock file next to the spill.
+        """
+        with open(self._spill_path + ".lock", "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False  # another process is replaying
+            try:
+                return self._replay_claimed()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _replay_claimed(self) -> bool:
+        self._spill_pending = False
+        path = self._claim_spill()
+        if path is None:
+            return True
+        items = self._read_spill(path)
+        back = []  # (row, attempts) that go back to the spill file
+        db_down = False
+        for i in range(0, len(items), self._flush_size):
+            chunk = items[i:i + self._flush_size]
+            if db_down:
+                back.extend(chunk)
+                continue
+            exc = self._write([row for row, _ in chunk], replay=True)
+            if exc is None:
+                continue
+            if isinstance(exc, TRANSIENT_ERRORS):
+                db_down = True
+                back.extend(chunk)
+                continue
+            # find the rows at fault; the rest of the chunk goes through
+            for row, attempts in chunk:
+                exc = self._write([row], replay=True)
+                if exc is None:
+                    continue
+                if isinstance(exc, TRANSIENT_ERRORS):
+                    back.append((row, attempts))
+                elif attempts + 1 < self._max_attempts:
+                    back.append((row, attempts + 1))
+                else:
+                    self._dead_letter(row, exc)
+        if back:
+            self._append(self._spill_path, [[*row, attempts] for row, attempts in back])
+            self._spill_pending = True
+        os.unlink(path)
+        # more may have been spilled while this replay ran
+        if os.path.exists(self._spill_path) and os.path.getsize(self._spill_path) > 0:
+            self._spill_pending = True
+        return not back
+
+    def _dead_letter(self, row, exc: Exception) -> None:
+        log.error("assessment for %s failed %d replays, set aside: %s", row[0], self._max_attempts, exc)
+        self._append(self._dead_letter_path, [[*row, repr(exc)]])
+        DEAD_LETTERED.inc()
@@ -0,0 +1,424 @@
+# api/async_main.py
+"""
+Async variant of the API: the scoring, feature and review routes run as coroutines
+on an asyncpg pool (common/async_db.py), so a slow query parks a coroutine instead
+of a threadpool thread.
+
+    uvicorn api.async_main:app --port 8000
+
+Every other route is the sync handler from api.main, registered on this app
+behind the async ones. Request coalescing (SCORE_BATCH_WINDOW_MS) is a
+thread-based mechanism and is not used here; the entity cache, score cache,
+online feature store, write-behind writer and overload controller (with its
+degraded path and deferred writer) are shared with the sync handlers.
+Their in-process work (online store, entity graph, model) runs in the default
+thread pool via asyncio.to_thread so it never holds up the event loop.
+"""
+import asyncio
+import uuid
+from datetime import datetime
+
+import asyncpg
+from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.routing import APIRoute
+
+from api import main as sync_api
+from api.main import (
+    MetricsMiddleware, ReadYourWritesMiddleware, TransactionCreate, ScoreResponse, ScoreWithReasons,
+    ReviewActionIn, FEATURES_BY_ID_SQL, ASSESSMENT_BY_ID_SQL, REVIEW_CASES_SQL, READ_LSN_COOKIE, READ_LSN_COOKIE_MAX_AGE_S, origins, _cached_assessment, _without_keys, _apply_review_label,
+    REVIEW_ACTION_INSERT_SQL, REVIEW_RELABEL_SQL, REVIEW_DECISION_SQL,
+)
+from api.persistence import (
+    ASSESSMENT_INSERT_SQL, ASSESSMENT_CONFLICT_SQL, ASSESSMENT_TEMPLATE,
+    TRANSACTION_ROW_INSERT_SQL,
+)
+from api.responses import FastJSONResponse, CompressionMiddleware
+from common import async_db
+from common.db import REPLICA_ENABLED
+from common.metrics import STAGE_LATENCY, DECISIONS
+from features.online_store import record_rows
+from features.entity_graph import ring_features_for
+from features.realtime_features import (
+    COMPUTE_AND_UPSERT_SQL, RING_UPDATE_SQL, REALTIME_FEATURES_SINGLE_STATEMENT, FEATURE_UPSERT_SQL as _FEATURE_UPSERT_SQL,
+    FEATURE_UPSERT_COLUMNS, FEATURE_UPSERT_TEMPLATE, attach_ring_features, _coerce, _features_from_store,
+)
+from models.score_cache import score_cache
+from models.scoring import score_with_reasons, decide, model_version
+
+app = FastAPI(title="Fraud Detection Platform API (async)", version="0.1.0")
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+if REPLICA_ENABLED:
+    app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[o.strip() for o in origins],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+
+@app.on_event("startup")
+async def startup():
+    await async_db.open_pool()
+    await asyncio.to_thread(sync_api.warm_entity_cache)
+    await asyncio.to_thread(sync_api.warm_entity_graph)
+    sync_api.start_score_cache_listener()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await async_db.close_pool()
+    await asyncio.to_thread(sync_api.drain_background_writers)
+    await asyncio.to_thread(sync_api.save_entity_graph)
+
+
+# ---------------------------------------------------------------------------
+# data access
+
+# Single-row forms of the statements the sync API runs with execute_values
+ASYNC_FEATURE_UPSERT_SQL = async_db.numbered(
+    _FEATURE_UPSERT_SQL.replace("VALUES %s", "VALUES " + FEATURE_UPSERT_TEMPLATE))
+ASSESSMENT_UPSERT_SQL = async_db.numbered(
+    ASSESSMENT_INSERT_SQL.replace("VALUES %s", "VALUES " + ASSESSMENT_TEMPLATE) + ASSESSMENT_CONFLICT_SQL
+    + "\nRETURNING (xmax = 0)")
+_TRANSACTION_INSERT_SQL = async_db.numbered(TRANSACTION_ROW_INSERT_SQL)
+
+# The lookups of features.realtime_features._compute_features, for the per-query
+# path (REALTIME_FEATURES_SINGLE_STATEMENT=0). They run one after another on a
+# single pooled connection; fanning them out over the pool would take ~7
+# connections per request and starve other requests under load.
+_VELOCITY_SQL = """
+SELECT
+  COUNT(*) FILTER (WHERE timestamp >= $1::timestamp - INTERVAL '5 minutes' AND timestamp <= $1)::int AS tx_count_5m,
+  COUNT(*) FILTER (WHERE timestamp >= $1::timestamp - INTERVAL '1 hour' AND timestamp <= $1)::int AS tx_count_1h,
+  COUNT(*) FILTER (WHERE timestamp >= $1::timestamp - INTERVAL '24 hours' AND timestamp <= $1)::int AS tx_count_24h
+FROM transactions
+WHERE user_pk = $2
+"""
+_USER_AVG_SQL = "SELECT COALESCE(AVG(amount), 0)::float FROM transactions WHERE user_pk = $1 AND timestamp <= $2"
+_HOME_COUNTRY_SQL = "SELECT home_country FROM users WHERE user_pk = $1"
+_DEVICE_USERS_SQL = "SELECT COUNT(DISTINCT user_pk)::int FROM transactions WHERE device_pk = $1"
+_FRAUD_RATE_SQL = """
+SELECT CASE WHEN COUNT(*) = 0 THEN 0
+            ELSE (SUM(CASE WHEN is_fraud THEN 1 ELSE 0 END)::float / COUNT(*)::float)
+       END
+FROM transactions
+WHERE {column} = $1
+"""
+
+
+async def _compute_features(transaction_id: str) -> dict:
+    async with async_db.acquire() as conn:
+        tx = await async_db.fetchrow(conn, """
+            SELECT user_pk, device_pk, merchant, merchant_category, amount, country, timestamp,
+                   user_id, device_id, card_id
+            FROM transactions WHERE transaction_id = $1
+        """, transaction_id)
+        if tx is None:
+            raise ValueError("Transaction not found")
+        # the in-memory graph lookup overlaps with the queries
+        ring = asyncio.ensure_future(
+            asyncio.to_thread(ring_features_for, tx["user_id"], tx["device_id"], tx["card_id"]))
+        try:
+            vel = await async_db.fetchrow(conn, _VELOCITY_SQL, tx["timestamp"], tx["user_pk"])
+            user_avg = await async_db.fetchval(conn, _USER_AVG_SQL, tx["user_pk"], tx["timestamp"])
+            home = await async_db.fetchval(conn, _HOME_COUNTRY_SQL, tx["user_pk"])
+            device_users = await async_db.fetchval(conn, _DEVICE_USERS_SQL, tx["device_pk"])
+            merchant_rate = await async_db.fetchval(
+                conn, _FRAUD_RATE_SQL.format(column="merchant"), tx["merchant"])
+            category_rate = await async_db.fetchval(
+                conn, _FRAUD_RATE_SQL.format(column="merchant_category"), tx["merchant_category"])
+        finally:
+            ring = await ring
+    user_avg = float(user_avg)
+    return {
+        "transaction_id": transaction_id,
+        "tx_count_5m": int(vel["tx_count_5m"]),
+        "tx_count_1h": int(vel["tx_count_1h"]),
+        "tx_count_24h": int(vel["tx_count_24h"]),
+        "user_avg_amount": user_avg,
+        "amount_vs_user_avg": float(tx["amount"]) / user_avg if user_avg > 0 else 0.0,
+        "is_foreign_country": home is not None and tx["country"] != home,
+        "device_user_count": int(device_users),
+        "merchant_fraud_rate": float(merchant_rate),
+        "category_fraud_rate": float(category_rate),
+        **ring,
+    }
+
+
+async def _upsert_features(feats: dict) -> None:
+    async with async_db.acquire() as conn:
+        await async_db.execute(conn, ASYNC_FEATURE_UPSERT_SQL, *(feats[c] for c in FEATURE_UPSERT_COLUMNS))
+
+
+async def compute_and_upsert_features(transaction_id: str, tx=None, ts=None) -> dict:
+    """Async features.realtime_features.compute_and_upsert_features."""
+    if score_cache is not None:
+        score_cache.invalidate([transaction_id])
+    with STAGE_LATENCY.time(stage="feature_store_read"):
+        cached = await asyncio.to_thread(_features_from_store, transaction_id, tx, ts)
+    if cached is not None:
+        with STAGE_LATENCY.time(stage="feature_upsert"):
+            await _upsert_features(cached)
+        return cached
+
+    if REALTIME_FEATURES_SINGLE_STATEMENT:
+        with STAGE_LATENCY.time(stage="feature_queries"):
+            async with async_db.acquire() as conn, conn.transaction():
+                rows = [dict(r) for r in await async_db.fetch(conn, COMPUTE_AND_UPSERT_SQL, [transaction_id])]
+                ring_args = await asyncio.to_thread(attach_ring_features, rows)
+                if ring_args is not None:
+                    await async_db.execute(conn, RING_UPDATE_SQL, *ring_args)
+        if not rows:
+            raise ValueError("Transaction not found")
+        return _coerce(rows[0])
+
+    with STAGE_LATENCY.time(stage="feature_queries"):
+        feats = await _compute_features(transaction_id)
+    with STAGE_LATENCY.time(stage="feature_upsert"):
+        await _upsert_features(feats)
+    return feats
+
+
+async def _insert_transaction(conn, transaction_id: str, tx: TransactionCreate, ts: datetime) -> dict:
+    known = sync_api.entity_cache
+    users = known.missing("user", [tx.user_id]) if known else [tx.user_id]
+    cards = known.missing("card", [tx.card_id]) if known else [tx.card_id]
+    devices = known.missing("device", [tx.device_id]) if known else [tx.device_id]
+    async with conn.transaction():
+        if users:
+            await async_db.execute(conn, """
+                INSERT INTO users (user_id, home_country, account_age_days, avg_transaction_amount)
+                VALUES ($1, $2, 30, 100.0) ON CONFLICT (user_id) DO NOTHING
+            """, tx.user_id, tx.country)
+        if cards:
+            await async_db.execute(conn, """
+                INSERT INTO cards (card_id, user_id, issuer, is_stolen)
+                VALUES ($1, $2, 'Visa', false) ON CONFLICT (card_id) DO NOTHING
+            """, tx.card_id, tx.user_id)
+        if devices:
+            await async_db.execute(conn, """
+                INSERT INTO devices (device_id, device_type)
+                VALUES ($1, 'mobile') ON CONFLICT (device_id) DO NOTHING
+            """, tx.device_id)
+        await async_db.execute(conn, _TRANSACTION_INSERT_SQL,
+                               transaction_id, tx.user_id, tx.card_id, tx.device_id, tx.amount, tx.currency,
+                               tx.merchant, tx.merchant_category, tx.country, ts, False, None)
+    return {"user": users, "card": cards, "device": devices}
+
+
+async def write_transaction(transaction_id: str, tx: TransactionCreate, ts: datetime) -> None:
+    """Async api.persistence.write_transactions for one row (same stale-cache retry)."""
+    known = sync_api.entity_cache
+    for attempt in range(2):
+        try:
+            async with async_db.acquire() as conn:
+                written = await _insert_transaction(conn, transaction_id, tx, ts)
+        except asyncpg.ForeignKeyViolationError:
+            if known is None or attempt:
+                raise
+            known.clear()
+            continue
+        if known is not None:
+            for kind, ids in written.items():
+                known.remember(kind, ids)
+        return
+
+
+# ---------------------------------------------------------------------------
+# routes
+
+@app.post("/score/{transaction_id}", response_model=ScoreResponse)
+async def score_transaction(transaction_id: str):
+    async with async_db.acquire() as conn:
+        feats = await async_db.fetchrow(conn, _FEATURES_BY_ID_SQL, transaction_id)
+    if feats is None:
+        raise HTTPException(status_code=404, detail="Features not found for this transaction")
+
+    version = model_version()
+    cached = score_cache.get_score(transaction_id, version, feats["created_at"]) if score_cache else None
+    if cached is not None:
+        return cached
+
+    prob, reasons = await asyncio.to_thread(score_with_reasons, dict(feats), top_k=3)
+    risk_score = int(round(prob * 100))
+    decision = decide(risk_score)
+    if score_cache is not None:
+        score_cache.put(transaction_id, prob, risk_score, decision, reasons,
+                        model_version=version, features_created_at=feats["created_at"])
+    return {
+        "transaction_id": transaction_id,
+        "fraud_probability": prob,
+        "risk_score": risk_score,
+        "decision": decision,
+    }
+
+
+@app.post("/transactions/score", response_model=ScoreWithReasons)
+async def create_and_score_transaction(tx: TransactionCreate):
+    overload = sync_api.overload
+    if overload is None:
+        return await _create_and_score(tx)
+    with overload.track():
+        if overload.should_degrade():
+            # in-memory features and a deferred write; nothing awaits PostgreSQL
+            return await asyncio.to_thread(sync_api._score_degraded, tx)
+        return await _create_and_score(tx)
+
+
+async def _create_and_score(tx: TransactionCreate):
+    transaction_id = f"tx_{uuid.uuid4().hex}"
+    now = datetime.utcnow()
+
+    with STAGE_LATENCY.time(stage="insert"):
+        await write_transaction(transaction_id, tx, now)
+        await asyncio.to_thread(record_rows, [(transaction_id, tx, now)])
+
+    with STAGE_LATENCY.time(stage="features"):
+        feats = await compute_and_upsert_features(transaction_id, tx=tx, ts=now)
+
+    prob, reasons = await asyncio.to_thread(score_with_reasons, feats, top_k=3)
+    risk_score = int(round(prob * 100))
+    decision = decide(risk_score)
+
+    with STAGE_LATENCY.time(stage="assessment_write"):
+        if sync_api.assessment_writer is not None:
+            # submit() may block briefly on backpressure; keep it off the event loop
+            await asyncio.to_thread(sync_api.assessment_writer.submit,
+                                    transaction_id, prob, risk_score, decision, reasons)
+        else:
+            async with async_db.acquire() as conn:
+                is_new = await async_db.fetchval(conn, ASSESSMENT_UPSERT_SQL,
+                                                 transaction_id, float(prob), risk_score, decision, reasons)
+            if is_new:
+                DECISIONS.inc(decision=decision)
+        if score_cache is not None:
+            score_cache.put_assessments([(transaction_id, prob, risk_score, decision, reasons)], model_version())
+
+    return {
+        "transaction_id": transaction_id,
+        "fraud_probability": float(prob),
+        "risk_score": risk_score,
+        "decision": decision,
+        "reasons": reasons,
+    }
+
+
+@app.get("/transactions/{transaction_id}/features")
+async def get_transaction_features(transaction_id: str):
+    async with async_db.acquire() as conn:
+        row = await async_db.fetchrow(conn, _FEATURES_BY_ID_SQL, transaction_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Features not found for this transaction")
+    return _without_keys(dict(row))
+
+
+@app.get("/transactions/{transaction_id}/assessment")
+async def get_assessment(transaction_id: str):
+    cached = _cached_assessment(transaction_id)
+    if cached is not None:
+        return cached
+    async with async_db.acquire() as conn:
+        row = await async_db.fetchrow(conn, _ASSESSMENT_BY_ID_SQL, transaction_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Assessment not found")
+    return _without_keys(dict(row))
+
+
+_FEATURES_BY_ID_SQL = async_db.numbered(FEATURES_BY_ID_SQL)
+_ASSESSMENT_BY_ID_SQL = async_db.numbered(ASSESSMENT_BY_ID_SQL)
+_ASYNC_REVIEW_CASES_SQL = async_db.numbered(REVIEW_CASES_SQL)
+_REVIEW_ACTION_INSERT_SQL = async_db.numbered(REVIEW_ACTION_INSERT_SQL)
+_REVIEW_RELABEL_SQL = async_db.numbered(REVIEW_RELABEL_SQL)
+_REVIEW_DECISION_SQL = async_db.numbered(REVIEW_DECISION_SQL)
+
+
+async def _load_review_cases(conn, transaction_ids: list[str]) -> dict:
+    if not transaction_ids:
+        return {}
+    cases = {}
+    for row in await async_db.fetch(conn, _ASYNC_REVIEW_CASES_SQL, transaction_ids):
+        case = dict(row)
+        tid = case.pop("transaction_id")
+        if case["assessment"] is None:
+            case["assessment"] = _cached_assessment(tid)
+        cases[tid] = case
+    return cases
+
+
+@app.get("/review/queue")
+async def review_queue(
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    embed: int = Query(0, ge=0, le=100, description="include the full case for the first N items"),
+):
+    async with async_db.acquire() as conn:
+        items = [dict(r) for r in await async_db.fetch(conn, """
+            SELECT
+                ra.transaction_id, ra.risk_score, ra.fraud_probability, ra.decision, ra.created_at,
+                t.user_id, t.amount, t.merchant, t.country, t.timestamp
+            FROM risk_assessments ra
+            JOIN transactions t ON t.tx_pk = ra.tx_pk
+            WHERE ra.decision = 'manual_review'
+            ORDER BY ra.created_at DESC
+            LIMIT $1 OFFSET $2
+        """, limit, offset)]
+        if embed:
+            cases = await _load_review_cases(conn, [r["transaction_id"] for r in items[:embed]])
+            for r in items[:embed]:
+                r["case"] = cases.get(r["transaction_id"])
+    return FastJSONResponse(items)
+
+
+@app.get("/review/case/{transaction_id}")
+async def review_case(transaction_id: str):
+    async with async_db.acquire() as conn:
+        case = (await _load_review_cases(conn, [transaction_id])).get(transaction_id)
+    if case is None:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    return FastJSONResponse(case)
+
+
+@app.post("/review/case/{transaction_id}/action")
+async def submit_review_action(transaction_id: str, body: ReviewActionIn, response: Response):
+    if body.action not in {"approve", "reject"}:
+        raise HTTPException(status_code=400, detail="action must be 'approve' or 'reject'")
+
+    async with async_db.acquire() as conn:
+        async with conn.transaction():
+            assessment = await async_db.fetchrow(conn, _ASSESSMENT_BY_ID_SQL, transaction_id)
+            if assessment is None:
+                raise HTTPException(status_code=404, detail="Assessment not found for transaction")
+            tx_pk = assessment["tx_pk"]
+
+            action_row = dict(await async_db.fetchrow(conn, _REVIEW_ACTION_INSERT_SQL,
+                                                      tx_pk, transaction_id, body.action, body.analyst, body.notes))
+
+            relabeled = None
+            if body.action == "reject":
+                relabeled = await async_db.fetchrow(conn, _REVIEW_RELABEL_SQL, tx_pk)
+
+            await async_db.execute(conn, _REVIEW_DECISION_SQL,
+                                   "block" if body.action == "reject" else "approve", tx_pk)
+
+        if REPLICA_ENABLED:
+            lsn = await async_db.fetchval(conn, "SELECT pg_current_wal_lsn()::text")
+            response.set_cookie(READ_LSN_COOKIE, lsn, max_age=READ_LSN_COOKIE_MAX_AGE_S,
+                                httponly=True, samesite="lax")
+
+    if score_cache is not None:
+        score_cache.invalidate([transaction_id])
+    # the store's flock and the graph's lock (and its first load) would block the loop
+    await asyncio.to_thread(_apply_review_label, transaction_id, relabeled)
+    return action_row
+
+
+# Everything not defined above: the sync handlers, matched after the async routes.
+_async_routes = {(r.path, m) for r in app.router.routes if isinstance(r, APIRoute) for m in r.methods}
+app.router.routes.extend(
+    r for r in sync_api.app.router.routes
+    if isinstance(r, APIRoute) and not any((r.path, m) in _async_routes for m in r.methods)
+)
@@ -0,0 +1,168 @@
+# api/batcher.py
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import datetime
+
+from api.persistence import write_transactions, upsert_assessments
+from features.realtime_features import compute_and_upsert_features_batch
+from features.online_store import record_rows
+from models.scoring import score_batch_with_reasons, decide, model_version
+from models.score_cache import score_cache
+from common.metrics import STAGE_LATENCY, DECISIONS, Histogram
+
+# 0 disables coalescing: every request runs its own pipeline.
+SCORE_BATCH_WINDOW_MS = float(os.getenv("SCORE_BATCH_WINDOW_MS", "0"))
+SCORE_BATCH_MAX_SIZE = int(os.getenv("SCORE_BATCH_MAX_SIZE", "64"))
+SCORE_BATCH_WORKERS = int(os.getenv("SCORE_BATCH_WORKERS", "1"))
+SCORE_BATCH_TIMEOUT_S = float(os.getenv("SCORE_BATCH_TIMEOUT_S", "30"))
+
+BATCH_SIZE = Histogram(
+    "fraud_score_batch_size",
+    "Requests coalesced into one scoring batch.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+
+class ScoreTimeout(Exception):
+    """The request waited out its timeout before a batch picked it up; nothing was written."""
+
+
+class ScoringBatcher:
+    """
+    Coalesces concurrent /transactions/score requests.
+
+    Request threads submit() a TransactionCreate and block on the returned Future.
+    A flusher thread takes the first waiting request, keeps collecting until
+    window_ms has elapsed or max_size requests are in hand, then runs the whole
+    group through one pipeline: multi-row inserts, one feature batch, one
+    vectorized model call and one multi-row assessment upsert. Each request
+    waits at most window_ms longer than it would alone.
+
+    Every row keeps the time it was submitted, so batch-mates from the same user
+    see each other in their velocity windows exactly as sequential requests
+    would. When a batch fails, its rows are retried one by one (the inserts skip
+    what the batch already wrote) so one bad row only fails its own request.
+    """
+
+    def __init__(
+        self, get_conn, window_ms: float, max_size: int, workers: int = 1,
+        assessment_writer=None, entity_cache=None,
+    ):
+        self._get_conn = get_conn
+        self._entity_cache = entity_cache
+        self._assessment_writer = assessment_writer
+        self._window_s = window_ms / 1000.0
+        self._max_size = max_size
+        self._queue = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"score-batcher-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, tx) -> Future:
+        fut = Future()
+        self._queue.put((tx, datetime.utcnow(), fut))
+        return fut
+
+    def score(self, tx, timeout: float = SCORE_BATCH_TIMEOUT_S) -> dict:
+        """
+        Raises ScoreTimeout when no batch took the request within timeout. Once a
+        batch has it, its writes will land, so the outcome is waited for instead
+        of reporting a failure for a stored transaction.
+        """
+        fut = self.submit(tx)
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            if fut.cancel():
+                raise ScoreTimeout(f"not picked up by a scoring batch within {timeout:g}s")
+            return fut.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self._window_s
+        while len(batch) < self._max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [(tx, ts, fut) for tx, ts, fut in self._collect() if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            rows = [(f"tx_{uuid.uuid4().hex}", tx, ts) for tx, ts, _ in batch]
+            futures = [fut for _, _, fut in batch]
+            try:
+                results = self._score_batch(rows)
+            except Exception as exc:
+                if len(rows) == 1:
+                    futures[0].set_exception(exc)
+                    continue
+                for row, fut in zip(rows, futures):
+                    try:
+                        fut.set_result(self._score_batch([row], retry=True)[0])
+                    except Exception as row_exc:
+                        fut.set_exception(row_exc)
+                continue
+            for fut, result in zip(futures, results):
+                fut.set_result(result)
+
+    def _score_batch(self, rows, retry: bool = False) -> list[dict]:
+        """rows: (transaction_id, TransactionCreate, submitted_at); retry=True after a failed batch."""
+        transaction_ids = [r[0] for r in rows]
+
+        if not retry:
+            BATCH_SIZE.observe(len(rows))
+        with STAGE_LATENCY.time(stage="insert"):
+            write_transactions(self._get_conn, rows, known=self._entity_cache, skip_existing=retry)
+            record_rows(rows)
+
+        with STAGE_LATENCY.time(stage="features"):
+            feats = compute_and_upsert_features_batch(transaction_ids, rows=rows)
+        scored = score_batch_with_reasons(feats, top_k=3)
+
+        results = []
+        for transaction_id, (prob, reasons) in zip(transaction_ids, scored):
+            risk_score = int(round(prob * 100))
+            results.append({
+                "transaction_id": transaction_id,
+                "fraud_probability": float(prob),
+                "risk_score": risk_score,
+                "decision": decide(risk_score),
+                "reasons": reasons,
+            })
+
+        assessments = [
+            (r["transaction_id"], r["fraud_probability"], r["risk_score"], r["decision"], r["reasons"])
+            for r in results
+        ]
+        with STAGE_LATENCY.time(stage="assessment_write"):
+            if self._assessment_writer is not None:
+                for a in assessments:
+                    self._assessment_writer.submit(*a)
+            else:
+                conn = self._get_conn()
+                try:
+                    with conn.cursor() as cur:
+                        new = upsert_assessments(cur, assessments)
+                    conn.commit()
+                finally:
+                    conn.close()
+                # counted once committed, so a failed batch isn't counted again by its retries
+                for d in new:
+                    DECISIONS.inc(decision=d)
+            if score_cache is not None:
+                score_cache.put_assessments(assessments, model_version())
+        return results
@@ -0,0 +1,241 @@
+# api/bulk.py
+import csv
+import io
+import json
+import os
+import pickle
+import tempfile
+import uuid
+from datetime import datetime, timezone
+
+from api.persistence import (
+    ensure_dimensions, remember_dimensions, upsert_assessments, enqueue_scoring_jobs,
+    TRANSACTION_COLUMNS, TRANSACTION_INSERT_SQL,
+)
+from features.realtime_features import compute_and_upsert_features_batch
+from features.online_store import record_rows
+from models.scoring import score_batch_with_reasons, decide, model_version
+from models.score_cache import score_cache
+from common.metrics import DECISIONS
+
+# COPY lands in a per-session staging table; one INSERT ... SELECT then resolves
+# the entity keys with a join and returns the new tx_pks.
+STAGING_TABLE_SQL = f"""
+CREATE TEMP TABLE IF NOT EXISTS transactions_copy ON COMMIT DELETE ROWS AS
+SELECT {", ".join(TRANSACTION_COLUMNS)} FROM transactions WITH NO DATA
+"""
+
+
+def copy_transactions(cur, rows) -> dict:
+    """
+    COPY (transaction_id, tx, timestamp) rows into transactions; returns
+    {transaction_id: tx_pk}.
+    """
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    for transaction_id, tx, ts in rows:
+        w.writerow((
+            transaction_id, tx.user_id, tx.card_id, tx.device_id, tx.amount, tx.currency,
+            tx.merchant, tx.merchant_category, tx.country, ts.isoformat(), "f", None,
+        ))
+    buf.seek(0)
+    cur.execute(STAGING_TABLE_SQL)
+    cur.copy_expert(
+        f"COPY transactions_copy ({', '.join(TRANSACTION_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+        buf,
+    )
+    cur.execute(TRANSACTION_INSERT_SQL.format(source="transactions_copy v") + "\nRETURNING transaction_id, tx_pk;")
+    return dict(cur.fetchall())
+
+
+# bulk loads queue behind live traffic
+BULK_JOB_PRIORITY = 1
+
+# an upload is refused, before anything is loaded, past this many invalid lines
+BULK_MAX_INVALID_LINES = int(os.getenv("BULK_MAX_INVALID_LINES", "1000"))
+BULK_MAX_LINE_BYTES = int(os.getenv("BULK_MAX_LINE_BYTES", str(64 * 1024)))
+
+
+class BulkRejected(Exception):
+    """The upload was refused while it was being received; nothing was loaded."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def parse_line(line_no: int, raw: bytes, model) -> tuple:
+    """(line_no, tx, None) for a valid NDJSON line, (line_no, None, error) otherwise."""
+    try:
+        obj = json.loads(raw)
+        if not isinstance(obj, dict):
+            raise ValueError("each line must be a JSON object")
+        return line_no, model(**obj), None
+    except Exception as exc:
+        return line_no, None, str(exc)
+
+
+class BulkSpool:
+    """
+    Parses and validates an NDJSON body as it arrives, and spools the parsed rows
+    (pickled, one frame per feed) to a temp file: in memory up to max_bytes, then
+    on disk. feed() raises BulkRejected as soon as the upload can't be accepted,
+    so a bad file is refused without being read to the end.
+    """
+
+    def __init__(self, model, max_bytes: int):
+        self._model = model
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_bytes, mode="w+b")
+        self._tail = b""
+        self._line_no = 0
+        self.invalid = 0
+
+    def feed(self, data: bytes, final: bool = False) -> None:
+        lines = (self._tail + data).split(b"\n")
+        self._tail = b"" if final else lines.pop()
+        if len(self._tail) > BULK_MAX_LINE_BYTES:
+            raise BulkRejected(413, f"line {self._line_no + len(lines) + 1} is longer than {BULK_MAX_LINE_BYTES} bytes")
+        rows = []
+        for raw in lines:
+            self._line_no += 1
+            if not raw.strip():
+                continue
+            if len(raw) > BULK_MAX_LINE_BYTES:
+                raise BulkRejected(413, f"line {self._line_no} is longer than {BULK_MAX_LINE_BYTES} bytes")
+            row = parse_line(self._line_no, raw, self._model)
+            if row[2] is not None:
+                self.invalid += 1
+                if self.invalid > BULK_MAX_INVALID_LINES:
+                    raise BulkRejected(400, f"more than {BULK_MAX_INVALID_LINES} invalid lines; "
+                                            f"line {row[0]}: {row[2]}")
+            rows.append(row)
+        if rows:
+            pickle.dump(rows, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def rows(self):
+        """The spooled (line_no, tx, error) rows, in input order."""
+        self._file.seek(0)
+        while True:
+            try:
+                batch = pickle.load(self._file)
+            except EOFError:
+                return
+            yield from batch
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _load_chunk(get_conn, chunk, score, known, assessment_writer, enqueue=False):
+    """
+    chunk: list of (line_no, transaction_id, tx, timestamp). Returns one result dict per row.
+    """
+    rows = [(tid, tx, ts) for _, tid, tx, ts in chunk]
+
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            written = ensure_dimensions(cur, [tx for _, tx, _ in rows], known=known)
+            tx_pks = copy_transactions(cur, rows)
+            if enqueue:
+                enqueue_scoring_jobs(cur, tx_pks, priority=BULK_JOB_PRIORITY)
+        conn.commit()
+        remember_dimensions(known, written)
+        record_rows(rows)
+    except Exception:
+        conn.rollback()
+        if known is not None:
+            known.clear()
+        raise
+    finally:
+        conn.close()
+
+    results = [
+        {"line": line_no, "status": "queued" if enqueue else "ok", "transaction_id": tid}
+        for line_no, tid, _, _ in chunk
+    ]
+    if not score:
+        return results
+
+    try:
+        _score_chunk(get_conn, results, rows, assessment_writer)
+    except Exception as exc:
+        # rows are committed; only the scoring step failed
+        for res in results:
+            res["score_error"] = str(exc)
+    return results
+
+
+def _score_chunk(get_conn, results, rows, assessment_writer) -> None:
+    feats = compute_and_upsert_features_batch([r["transaction_id"] for r in results], rows=rows)
+    assessments = []
+    for res, (prob, reasons) in zip(results, score_batch_with_reasons(feats, top_k=3)):
+        risk_score = int(round(prob * 100))
+        res.update({
+            "fraud_probability": float(prob),
+            "risk_score": risk_score,
+            "decision": decide(risk_score),
+            "reasons": reasons,
+        })
+        assessments.append((res["transaction_id"], prob, risk_score, res["decision"], reasons))
+
+    if assessment_writer is not None:
+        for a in assessments:
+            assessment_writer.submit(*a)
+    else:
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                new = upsert_assessments(cur, assessments)
+            conn.commit()
+        finally:
+            conn.close()
+        for d in new:
+            DECISIONS.inc(decision=d)
+    if score_cache is not None:
+        score_cache.put_assessments(assessments, model_version())
+
+
+def iter_bulk_results(
+    rows, get_conn, score: bool = False, chunk_size: int = 1000,
+    known=None, assessment_writer=None, enqueue: bool = False,
+):
+    """
+    Consume parsed (line_no, tx, error) rows (BulkSpool.rows()) one at a time and
+    yield one NDJSON result line per input row. Only one chunk of rows is held in
+    memory at any moment.
+
+    Rows that failed validation get an "error" result and are skipped. Valid rows are COPY'd in chunks of chunk_size and, when score=True,
+    featurized and scored per chunk; with enqueue=True they are queued for the
+    scoring workers instead, in the same commit as the load. A chunk that fails to load reports the error
+    on each of its rows and the stream carries on with the next chunk.
+    """
+    chunk = []
+
+    def flush():
+        try:
+            results = _load_chunk(get_conn, chunk, score, known, assessment_writer, enqueue=enqueue)
+        except Exception as exc:
+            results = [
+                {"line": line_no, "status": "error", "error": f"chunk failed: {exc}"}
+                for line_no, _, _, _ in chunk
+            ]
+        chunk.clear()
+        return b"".join(json.dumps(r).encode() + b"\n" for r in results)
+
+    for line_no, tx, error in rows:
+        if error is not None:
+            yield json.dumps({"line": line_no, "status": "error", "error": error}).encode() + b"\n"
+            continue
+
+        ts = getattr(tx, "timestamp", None) or datetime.utcnow()
+        if ts.tzinfo is not None:
+            # transactions.timestamp is naive UTC
+            ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+        chunk.append((line_no, f"tx_{uuid.uuid4().hex}", tx, ts))
+        if len(chunk) >= chunk_size:
+            yield flush()
+
+    if chunk:
+        yield flush()
@@ -0,0 +1,78 @@
+# api/entity_cache.py
+import os
+import threading
+from collections import OrderedDict
+
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "200000"))
+
+# kind -> (table, key column)
+ENTITY_TABLES = {
+    "user": ("users", "user_id"),
+    "card": ("cards", "card_id"),
+    "device": ("devices", "device_id"),
+}
+
+
+class KnownEntityCache:
+    """
+    In-process LRU of user/card/device IDs that already exist in the database.
+
+    ensure_dimensions() skips the INSERT ... ON CONFLICT DO NOTHING for IDs found
+    here; callers remember() new IDs only after their transaction has committed,
+    so a cached ID always refers to a committed row.
+    """
+
+    def __init__(self, capacity: int = ENTITY_CACHE_SIZE):
+        self._capacity = capacity
+        self._sets = {kind: OrderedDict() for kind in ENTITY_TABLES}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def missing(self, kind: str, ids) -> list:
+        out = []
+        with self._lock:
+            known = self._sets[kind]
+            for i in ids:
+                if i in known:
+                    known.move_to_end(i)
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                    out.append(i)
+        return out
+
+    def remember(self, kind: str, ids) -> None:
+        with self._lock:
+            known = self._sets[kind]
+            for i in ids:
+                known[i] = None
+                known.move_to_end(i)
+            while len(known) > self._capacity:
+                known.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            for known in self._sets.values():
+                known.clear()
+
+    def warm(self, conn) -> None:
+        """
+        Preload up to capacity IDs per dimension table.
+        """
+        with conn.cursor() as cur:
+            for kind, (table, col) in ENTITY_TABLES.items():
+                cur.execute(f"SELECT {col} FROM {table} LIMIT %s;", (self._capacity,))
+                self.remember(kind, [r[0] for r in cur.fetchall()])
+        conn.rollback()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / total) if total else 0.0,
+                "size": {kind: len(known) for kind, known in self._sets.items()},
+                "capacity": self._capacity,
+            }
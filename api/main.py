@@ -3,31 +3,218 @@ from datetime import datetime
 from typing import Optional, List
 
 import psycopg2
+import hmac
 import os
+import time
 from psycopg2.extras import RealDictCursor
-from fastapi import FastAPI, Query, HTTPException
+from http.cookies import SimpleCookie
+from fastapi import FastAPI, Query, HTTPException, Request, Response, Header
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
-from models.scoring import score_from_features
-from features.realtime_features import compute_and_upsert_features
-from models.scoring import score_with_reasons
+from features.realtime_features import compute_and_upsert_features, features_from_memory
+from features.online_store import get_store as get_online_store, record_rows
+from features.entity_graph import get_graph as get_entity_graph, save_snapshot as save_entity_graph_snapshot
+from models.scoring import score_with_reasons, decide, model_version, BLOCK_THRESHOLD, REVIEW_THRESHOLD
+from models.shadow import shadow_scorer, SHADOW_SAMPLE_RATE
+from models.score_cache import score_cache, assessment_view, SCORE_CACHE_LISTEN
 import json
 from fastapi.middleware.cors import CORSMiddleware
+from api.batcher import ScoringBatcher, ScoreTimeout, SCORE_BATCH_WINDOW_MS, SCORE_BATCH_MAX_SIZE, SCORE_BATCH_WORKERS
+from api.persistence import (
+    write_transactions, upsert_assessments,
+    TRANSACTION_COLUMNS, TRANSACTION_ROW_INSERT_SQL,
+)
+from api.entity_cache import KnownEntityCache, ENTITY_CACHE_SIZE
+from api.bulk import iter_bulk_results, BulkSpool, BulkRejected
+from api.scoring_worker import queue_stats, worker_decisions
+from common.db import connect, get_conn, get_read_conn, current_wal_lsn, min_read_lsn, REPLICA_ENABLED
+from common import metrics
+from common.metrics import STAGE_LATENCY, REQUEST_LATENCY, DB_ERRORS, DECISIONS
+from common.query_profiler import profiler as query_profiler
+from common.sampling_profiler import profiler as sampling_profiler, ProfileBusy, collapsed_text, PROFILE_MAX_SECONDS
+from api.assessment_writer import AssessmentWriter, ASSESSMENT_WRITE_BEHIND
+from api.responses import FastJSONResponse, CompressionMiddleware
+from api.overload import (
+    OverloadController, DeferredWriter, OVERLOAD_CONTROL, degraded_reason, overload_metrics,
+)
+
+
+
+
+
+class MetricsMiddleware:
+    """
+    Plain ASGI middleware: per-route latency histogram + DB error counter.
+    Routes are labelled by their path template, not the raw URL.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except psycopg2.Error as exc:
+            DB_ERRORS.inc(kind=type(exc).__name__)
+            raise
+        finally:
+            route = getattr(scope.get("route"), "path", None) \
+                or getattr(scope.get("endpoint"), "__name__", None) or "unmatched"
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - t0,
+                method=scope["method"], route=route, status=str(status["code"]),
+            )
+
 
+READ_LSN_COOKIE = "fraud_read_lsn"
+READ_LSN_COOKIE_MAX_AGE_S = int(os.getenv("READ_LSN_COOKIE_MAX_AGE_S", "60"))
 
 
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST", "localhost"),
-    "database": os.getenv("DB_NAME", "frauddb"),
-    "user": os.getenv("DB_USER", "frauduser"),
-    "password": os.getenv("DB_PASSWORD", "fraudpass"),
-    "port": int(os.getenv("DB_PORT", "5432")),
-}
+class ReadYourWritesMiddleware:
+    """
+    Copies the client's last-write WAL position (cookie, or X-Read-After-LSN header)
+    into common.db.min_read_lsn, so get_read_conn() won't serve it from a replica
+    that hasn't replayed that write yet.
+    """
+
+    def __init__(self, app):
+        self.app = app
 
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        lsn = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-read-after-lsn":
+                lsn = value.decode("latin-1")
+            elif name == b"cookie" and lsn is None:
+                morsel = SimpleCookie(value.decode("latin-1")).get(READ_LSN_COOKIE)
+                lsn = morsel.value if morsel else None
+        token = min_read_lsn.set(lsn)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            min_read_lsn.reset(token)
 
-def get_conn():
-    return psycopg2.connect(**DB_CONFIG)
 
 app = FastAPI(title="Fraud Detection Platform API", version="0.1.0")
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+if REPLICA_ENABLED:
+    app.add_middleware(ReadYourWritesMiddleware)
+
+# Known user/card/device IDs, so repeat customers skip the dimension upserts
+entity_cache = KnownEntityCache(ENTITY_CACHE_SIZE) if ENTITY_CACHE_SIZE > 0 else None
+
+# Optional write-behind for risk_assessments (see api/assessment_writer.py)
+assessment_writer = AssessmentWriter(get_conn) if ASSESSMENT_WRITE_BEHIND else None
+
+# Optional request coalescing for /transactions/score (see api/batcher.py)
+scoring_batcher = (
+    ScoringBatcher(
+        get_conn, SCORE_BATCH_WINDOW_MS, SCORE_BATCH_MAX_SIZE, SCORE_BATCH_WORKERS,
+        assessment_writer=assessment_writer, entity_cache=entity_cache,
+    )
+    if SCORE_BATCH_WINDOW_MS > 0 else None
+)
+
+# Optional degraded scoring under database overload (see api/overload.py)
+overload = OverloadController() if OVERLOAD_CONTROL else None
+deferred_writer = DeferredWriter(get_conn, known=entity_cache) if OVERLOAD_CONTROL else None
+if overload is not None:
+    overload_metrics(overload, deferred_writer)
+
+
+metrics.CallbackMetric(
+    "fraud_entity_cache_lookups_total",
+    "Known-entity cache lookups by result.",
+    lambda: {("hit",): entity_cache.hits, ("miss",): entity_cache.misses} if entity_cache else None,
+    kind="counter", labels=("result",),
+)
+metrics.CallbackMetric(
+    "fraud_score_cache_entries",
+    "Entries in the score cache.",
+    lambda: len(score_cache) if score_cache else None,
+)
+metrics.CallbackMetric(
+    "fraud_assessment_queue_depth",
+    "Assessments waiting in the write-behind queue.",
+    lambda: assessment_writer.depth() if assessment_writer else None,
+)
+
+
+def _scoring_worker_decisions():
+    conn = get_conn()
+    try:
+        return worker_decisions(conn)
+    finally:
+        conn.close()
+
+
+# Scoring workers have no /metrics; their committed decisions live in scoring_workers.
+# Every API process reports the same global totals, so aggregate with max, not sum.
+metrics.CallbackMetric(
+    "fraud_scoring_worker_decisions_total",
+    "First decisions committed by the scoring workers (all workers, read from scoring_workers).",
+    _scoring_worker_decisions,
+    kind="counter", labels=("decision",),
+)
+
+
+@app.on_event("startup")
+def warm_entity_cache():
+    if entity_cache is None:
+        return
+    try:
+        conn = get_conn()
+    except psycopg2.OperationalError:
+        return  # DB not up yet; the cache fills as traffic arrives
+    try:
+        entity_cache.warm(conn)
+    finally:
+        conn.close()
+
+
+@app.on_event("startup")
+def start_score_cache_listener():
+    if score_cache is not None and SCORE_CACHE_LISTEN:
+        score_cache.listen(connect)
+
+
+@app.on_event("startup")
+def warm_entity_graph():
+    try:
+        get_entity_graph()
+    except psycopg2.OperationalError:
+        pass  # DB not up yet; built on first use
+
+
+@app.on_event("shutdown")
+def drain_background_writers():
+    if assessment_writer is not None:
+        assessment_writer.close()
+    if deferred_writer is not None:
+        deferred_writer.close()
+    if shadow_scorer is not None:
+        shadow_scorer.close()
+
+
+@app.on_event("shutdown")
+def save_entity_graph():
+    save_entity_graph_snapshot()
 
 
 origins = os.getenv("CORS_ORIGINS", "http://localhost:5173").split(",")
@@ -68,11 +255,82 @@ class TransactionCreate(BaseModel):
     country: str
 
 
+class BulkTransactionIn(TransactionCreate):
+    # partner batch files carry the original event time; defaults to now
+    timestamp: Optional[datetime] = None
+
+
+BULK_SPOOL_MAX_BYTES = int(os.getenv("BULK_SPOOL_MAX_BYTES", str(8 * 1024 * 1024)))
+# body bytes gathered before one parse-and-spool step in the threadpool
+BULK_SPOOL_WRITE_BYTES = 1024 * 1024
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# Admin-only endpoints answer 404 unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+def require_admin(token: Optional[str]) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if token is None or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="admin token required")
+
+
+@app.get("/debug/queries", include_in_schema=False)
+def debug_queries(
+    limit: int = Query(20, ge=1, le=500),
+    order_by: str = Query("total", pattern="^(total|mean|max|calls|rows)$"),
+    x_admin_token: Optional[str] = Header(None),
+):
+    require_admin(x_admin_token)
+    return {"dropped_keys": query_profiler.dropped, "queries": query_profiler.report(limit=limit, order_by=order_by)}
+
+
+@app.post("/debug/queries/reset", include_in_schema=False)
+def debug_queries_reset(x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    query_profiler.reset()
+    return {"status": "ok"}
+
+
+@app.get("/debug/profile", include_in_schema=False)
+def debug_profile(
+    seconds: float = Query(10.0, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(10.0, ge=1, le=1000),
+    idle: bool = False,
+    thread: Optional[str] = None,
+    format: str = Query("collapsed", pattern="^(collapsed|json)$"),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """
+    Samples this worker's threads for `seconds` (common/sampling_profiler.py).
+    collapsed: flamegraph.pl / speedscope input, summary in X-Profile-* headers.
+    """
+    require_admin(x_admin_token)
+    try:
+        result = sampling_profiler.profile(seconds, interval_ms, idle=idle, thread=thread)
+    except ProfileBusy:
+        raise HTTPException(status_code=409, detail="a profile is already running in this worker")
+    if format == "json":
+        return result
+    return PlainTextResponse(collapsed_text(result), headers={
+        "X-Profile-Samples": str(result["samples"]),
+        "X-Profile-Idle-Samples": str(result["idle_samples"]),
+        "X-Profile-Overhead-Pct": f"{result['overhead_pct']:.2f}",
+        "X-Profile-Worker-Pid": str(os.getpid()),
+    })
+
+
 @app.get("/transactions", response_model=List[TransactionOut])
 def list_transactions(
     limit: int = Query(50, ge=1, le=500),
@@ -89,10 +347,10 @@ def list_transactions(
         where.append("is_fraud = %(is_fraud)s")
         params["is_fraud"] = is_fraud
     if user_id:
-        where.append("user_id = %(user_id)s")
+        where.append("user_pk = (SELECT user_pk FROM users WHERE user_id = %(user_id)s)")
         params["user_id"] = user_id
     if card_id:
-        where.append("card_id = %(card_id)s")
+        where.append("card_pk = (SELECT card_pk FROM cards WHERE card_id = %(card_id)s)")
         params["card_id"] = card_id
     if merchant:
         where.append("merchant = %(merchant)s")
@@ -110,19 +368,18 @@ def list_transactions(
     params["limit"] = limit
     params["offset"] = offset
 
-    conn = get_conn()
+    conn = get_read_conn()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(sql, params)
-            rows = cur.fetchall()
-            return rows
+            return FastJSONResponse(cur.fetchall())
     finally:
         conn.close()
 
 
 @app.get("/transactions/{transaction_id}", response_model=TransactionOut)
 def get_transaction(transaction_id: str):
-    conn = get_conn()
+    conn = get_read_conn()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(
@@ -144,7 +401,7 @@ def get_transaction(transaction_id: str):
 
 @app.get("/stats/fraud")
 def fraud_stats():
-    conn = get_conn()
+    conn = get_read_conn()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("SELECT COUNT(*)::int AS total FROM transactions;")
@@ -172,15 +429,7 @@ def create_transaction(tx: TransactionCreate):
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(
-                """
-                INSERT INTO transactions (
-                    transaction_id, user_id, card_id, device_id, amount, currency,
-                    merchant, merchant_category, country, timestamp, is_fraud, fraud_reason
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, false, NULL)
-                RETURNING transaction_id, user_id, card_id, device_id, amount, currency,
-                          merchant, merchant_category, country, timestamp, is_fraud, fraud_reason;
-                """,
+                TRANSACTION_ROW_INSERT_SQL + f"\nRETURNING {', '.join(TRANSACTION_COLUMNS)};",
                 (
                     transaction_id,
                     tx.user_id,
@@ -192,6 +441,8 @@ def create_transaction(tx: TransactionCreate):
                     tx.merchant_category,
                     tx.country,
                     now,
+                    False,
+                    None,
                 ),
             )
             conn.commit()
@@ -200,19 +451,79 @@ def create_transaction(tx: TransactionCreate):
         conn.close()
 from psycopg2.extras import RealDictCursor
 
+@app.post("/transactions/bulk")
+async def bulk_submit_transactions(
+    request: Request,
+    score: bool = Query(False),
+    queue: bool = Query(False, description="queue rows for the scoring workers instead of scoring inline"),
+    chunk_size: int = Query(1000, ge=1, le=10000),
+):
+    """
+    Body: NDJSON, one TransactionCreate object per line (optional "timestamp").
+    Response: NDJSON, one result per input line, streamed as each chunk is loaded.
+
+    Lines are parsed and validated as the body arrives, and the parsed rows are
+    spooled to a temp file (in memory up to BULK_SPOOL_MAX_BYTES, then on disk), so
+    memory stays bounded for any upload size and we never read the request while
+    the response is streaming. More than BULK_MAX_INVALID_LINES invalid lines
+    (400) or a line over BULK_MAX_LINE_BYTES (413) rejects the upload right away,
+    before anything is loaded. Parsing and spool writes run in the threadpool,
+    about a megabyte at a time.
+    """
+    if score and queue:
+        raise HTTPException(status_code=400, detail="use either score or queue, not both")
+
+    spool = BulkSpool(BulkTransactionIn, BULK_SPOOL_MAX_BYTES)
+    pending = bytearray()
+    try:
+        async for part in request.stream():
+            pending += part
+            if len(pending) >= BULK_SPOOL_WRITE_BYTES:
+                await run_in_threadpool(spool.feed, bytes(pending))
+                pending.clear()
+        await run_in_threadpool(spool.feed, bytes(pending), True)
+    except BulkRejected as exc:
+        spool.close()
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+
+    def results():
+        try:
+            yield from iter_bulk_results(
+                spool.rows(), get_conn,
+                score=score, chunk_size=chunk_size,
+                known=entity_cache, assessment_writer=assessment_writer, enqueue=queue,
+            )
+        finally:
+            spool.close()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+# Child rows by external id: one probe of the transaction_id unique index, then
+# primary-key lookups on tx_pk.
+FEATURES_BY_ID_SQL = """
+SELECT f.* FROM transactions t JOIN transaction_features f ON f.tx_pk = t.tx_pk WHERE t.transaction_id = %s
+"""
+ASSESSMENT_BY_ID_SQL = """
+SELECT ra.* FROM transactions t JOIN risk_assessments ra ON ra.tx_pk = t.tx_pk WHERE t.transaction_id = %s
+"""
+
+
+def _without_keys(row):
+    # surrogate keys stay internal
+    row.pop("tx_pk", None)
+    return row
+
+
 @app.get("/transactions/{transaction_id}/features")
 def get_transaction_features(transaction_id: str):
     conn = get_conn()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(
-                "SELECT * FROM transaction_features WHERE transaction_id = %s;",
-                (transaction_id,),
-            )
+            cur.execute(FEATURES_BY_ID_SQL, (transaction_id,))
             row = cur.fetchone()
             if not row:
                 raise HTTPException(status_code=404, detail="Features not found for this transaction")
-            return row
+            return _without_keys(row)
     finally:
         conn.close()
 
@@ -232,21 +543,23 @@ def score_transaction(transaction_id: str):
     conn = get_conn()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM transaction_features WHERE transaction_id = %s;", (transaction_id,))
+            cur.execute(FEATURES_BY_ID_SQL, (transaction_id,))
             feats = cur.fetchone()
             if not feats:
                 raise HTTPException(status_code=404, detail="Features not found for this transaction")
 
-        prob = score_from_features(feats)
-        risk_score = int(round(prob * 100))
+        # retries of the same call skip the model; re-scores are never counted as decisions
+        version = model_version()
+        cached = score_cache.get_score(transaction_id, version, feats["created_at"]) if score_cache else None
+        if cached is not None:
+            return cached
 
-       
-        if risk_score >= 90:
-            decision = "block"
-        elif risk_score >= 60:
-            decision = "manual_review"
-        else:
-            decision = "approve"
+        prob, reasons = score_with_reasons(feats, top_k=3)
+        risk_score = int(round(prob * 100))
+        decision = decide(risk_score)
+        if score_cache is not None:
+            score_cache.put(transaction_id, prob, risk_score, decision, reasons,
+                            model_version=version, features_created_at=feats["created_at"])
 
         return {
             "transaction_id": transaction_id,
@@ -264,79 +577,90 @@ class ScoreWithReasons(BaseModel):
     reasons: list
 @app.post("/transactions/score", response_model=ScoreWithReasons)
 def create_and_score_transaction(tx: TransactionCreate):
+    if overload is None:
+        return _create_and_score(tx)
+    with overload.track():
+        if overload.should_degrade():
+            return _score_degraded(tx)
+        return _create_and_score(tx)
+
+
+def _score_degraded(tx: TransactionCreate):
+    """
+    Overload path: in-memory features only, nothing waits on PostgreSQL. The
+    transaction, its features and the assessment are persisted by deferred_writer.
+    """
     import uuid
     transaction_id = f"tx_{uuid.uuid4().hex}"
     now = datetime.utcnow()
 
-    conn = get_conn()
-    try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Ensure FK dimension rows exist
-            cur.execute("""
-                INSERT INTO users (user_id, home_country, account_age_days, avg_transaction_amount)
-                VALUES (%s, %s, 30, 100.0)
-                ON CONFLICT (user_id) DO NOTHING;
-            """, (tx.user_id, tx.country))
+    record_rows([(transaction_id, tx, now)])
+    feats, source = features_from_memory(transaction_id, tx, now)
 
-            cur.execute("""
-                INSERT INTO cards (card_id, user_id, issuer, is_stolen)
-                VALUES (%s, %s, 'Visa', false)
-                ON CONFLICT (card_id) DO NOTHING;
-            """, (tx.card_id, tx.user_id))
+    prob, reasons = score_with_reasons(feats, top_k=3)
+    risk_score = int(round(prob * 100))
+    decision = decide(risk_score)
+    if source == "request" and decision == "approve":
+        # no history to vouch for it; let an analyst look once the backlog clears
+        decision = "manual_review"
+    reasons = reasons + [degraded_reason(source)]
 
-            cur.execute("""
-                INSERT INTO devices (device_id, device_type)
-                VALUES (%s, 'mobile')
-                ON CONFLICT (device_id) DO NOTHING;
-            """, (tx.device_id,))
+    deferred_writer.submit(transaction_id, tx, now, prob, risk_score, decision, reasons)
+    if score_cache is not None:
+        score_cache.put_assessments([(transaction_id, prob, risk_score, decision, reasons)], model_version())
 
-            # Insert transaction
-            cur.execute("""
-                INSERT INTO transactions (
-                    transaction_id, user_id, card_id, device_id, amount, currency,
-                    merchant, merchant_category, country, timestamp, is_fraud, fraud_reason
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, false, NULL);
-            """, (
-                transaction_id, tx.user_id, tx.card_id, tx.device_id, tx.amount, tx.currency,
-                tx.merchant, tx.merchant_category, tx.country, now
-            ))
+    return {
+        "transaction_id": transaction_id,
+        "fraud_probability": float(prob),
+        "risk_score": int(risk_score),
+        "decision": decision,
+        "reasons": reasons,
+    }
 
-        conn.commit()
-    finally:
-        conn.close()
+
+def _create_and_score(tx: TransactionCreate):
+    if scoring_batcher is not None:
+        try:
+            return scoring_batcher.score(tx)
+        except ScoreTimeout as exc:
+            # never written, so the client can safely retry
+            raise HTTPException(status_code=503, detail=str(exc), headers={"Retry-After": "1"})
+
+    import uuid
+    transaction_id = f"tx_{uuid.uuid4().hex}"
+    now = datetime.utcnow()
+
+    # Ensure FK dimension rows exist + insert transaction
+    with STAGE_LATENCY.time(stage="insert"):
+        write_transactions(get_conn, [(transaction_id, tx, now)], known=entity_cache)
+        record_rows([(transaction_id, tx, now)])
 
     # Build features for this transaction
-    feats = compute_and_upsert_features(transaction_id)
+    with STAGE_LATENCY.time(stage="features"):
+        feats = compute_and_upsert_features(transaction_id, tx=tx, ts=now)
 
     # Score + explain
     prob, reasons = score_with_reasons(feats, top_k=3)
     risk_score = int(round(prob * 100))
+    decision = decide(risk_score)
 
-    if risk_score >= 90:
-        decision = "block"
-    elif risk_score >= 60:
-        decision = "manual_review"
-    else:
-        decision = "approve"
-
-    # Store assessment
-    conn = get_conn()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                INSERT INTO risk_assessments (transaction_id, fraud_probability, risk_score, decision, reasons)
-                VALUES (%s, %s, %s, %s, %s::jsonb)
-                ON CONFLICT (transaction_id) DO UPDATE SET
-                    fraud_probability = EXCLUDED.fraud_probability,
-                    risk_score = EXCLUDED.risk_score,
-                    decision = EXCLUDED.decision,
-                    reasons = EXCLUDED.reasons,
-                    created_at = NOW();
-            """, (transaction_id, float(prob), int(risk_score), decision, json.dumps(reasons)))
-        conn.commit()
-    finally:
-        conn.close()
+    # Store assessment (queued when write-behind is enabled; the writer counts
+    # decisions once they are committed)
+    with STAGE_LATENCY.time(stage="assessment_write"):
+        if assessment_writer is not None:
+            assessment_writer.submit(transaction_id, prob, risk_score, decision, reasons)
+        else:
+            conn = get_conn()
+            try:
+                with conn.cursor() as cur:
+                    new = upsert_assessments(cur, [(transaction_id, prob, risk_score, decision, reasons)])
+                conn.commit()
+            finally:
+                conn.close()
+            for d in new:
+                DECISIONS.inc(decision=d)
+        if score_cache is not None:
+            score_cache.put_assessments([(transaction_id, prob, risk_score, decision, reasons)], model_version())
 
     return {
         "transaction_id": transaction_id,
@@ -345,25 +669,95 @@ def create_and_score_transaction(tx: TransactionCreate):
         "decision": decision,
         "reasons": reasons,
     }
+def _cached_assessment(transaction_id: str):
+    if score_cache is None:
+        return None
+    entry = score_cache.get_assessment(transaction_id, model_version())
+    return assessment_view(entry) if entry is not None else None
+
+
+@app.post("/transactions/enqueue", status_code=202)
+def enqueue_transaction(tx: TransactionCreate):
+    """
+    Store the transaction and queue it for the scoring workers (python -m
+    api.scoring_worker run); the assessment appears at
+    /transactions/{id}/assessment once a worker has processed it.
+    """
+    import uuid
+    transaction_id = f"tx_{uuid.uuid4().hex}"
+    now = datetime.utcnow()
+    with STAGE_LATENCY.time(stage="insert"):
+        write_transactions(get_conn, [(transaction_id, tx, now)], known=entity_cache, enqueue=True)
+        record_rows([(transaction_id, tx, now)])
+    return {"transaction_id": transaction_id, "status": "queued"}
+
+
 @app.get("/transactions/{transaction_id}/assessment")
 def get_assessment(transaction_id: str):
+    cached = _cached_assessment(transaction_id)
+    if cached is not None:
+        return cached
+
     conn = get_conn()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM risk_assessments WHERE transaction_id = %s;", (transaction_id,))
+            cur.execute(ASSESSMENT_BY_ID_SQL, (transaction_id,))
             row = cur.fetchone()
             if not row:
                 raise HTTPException(status_code=404, detail="Assessment not found")
-            return row
+            return _without_keys(row)
     finally:
         conn.close()
 class ReviewActionIn(BaseModel):
     action: str  # "approve" or "reject"
     analyst: str = "analyst_1"
     notes: str | None = None
+# Whole review cases (transaction, features, assessment, history) for a list of
+# ids in one statement; rows come back in the order of the ids.
+REVIEW_CASES_SQL = """
+SELECT
+    t.transaction_id,
+    to_jsonb(t) - 'tx_pk' - 'user_pk' - 'card_pk' - 'device_pk' AS transaction,
+    CASE WHEN f.tx_pk IS NULL THEN NULL ELSE to_jsonb(f) - 'tx_pk' END AS features,
+    CASE WHEN ra.tx_pk IS NULL THEN NULL ELSE to_jsonb(ra) - 'tx_pk' END AS assessment,
+    COALESCE((
+        SELECT jsonb_agg(jsonb_build_object(
+                   'id', a.id, 'action', a.action, 'analyst', a.analyst,
+                   'notes', a.notes, 'created_at', a.created_at
+               ) ORDER BY a.created_at DESC)
+        FROM review_actions a
+        WHERE a.tx_pk = t.tx_pk
+    ), '[]'::jsonb) AS review_history
+FROM unnest(%s::text[]) WITH ORDINALITY AS ids(transaction_id, ord)
+JOIN transactions t ON t.transaction_id = ids.transaction_id
+LEFT JOIN transaction_features f ON f.tx_pk = t.tx_pk
+LEFT JOIN risk_assessments ra ON ra.tx_pk = t.tx_pk
+ORDER BY ids.ord;
+"""
+
+
+def _load_review_cases(cur, transaction_ids: list[str]) -> dict:
+    if not transaction_ids:
+        return {}
+    cur.execute(REVIEW_CASES_SQL, (transaction_ids,))
+    cases = {}
+    for row in cur.fetchall():
+        case = dict(row)
+        tid = case.pop("transaction_id")
+        if case["assessment"] is None:
+            # still in the write-behind queue
+            case["assessment"] = _cached_assessment(tid)
+        cases[tid] = case
+    return cases
+
+
 @app.get("/review/queue")
-def review_queue(limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge=0)):
-    conn = get_conn()
+def review_queue(
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    embed: int = Query(0, ge=0, le=100, description="include the full case for the first N items"),
+):
+    conn = get_read_conn()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
@@ -379,43 +773,54 @@ def review_queue(limit: int = Query(50, ge=1, le=500), offset: int = Query(0, ge
                     t.country,
                     t.timestamp
                 FROM risk_assessments ra
-                JOIN transactions t ON t.transaction_id = ra.transaction_id
+                JOIN transactions t ON t.tx_pk = ra.tx_pk
                 WHERE ra.decision = 'manual_review'
                 ORDER BY ra.created_at DESC
                 LIMIT %s OFFSET %s;
             """, (limit, offset))
-            return cur.fetchall()
+            items = cur.fetchall()
+
+            if embed:
+                cases = _load_review_cases(cur, [r["transaction_id"] for r in items[:embed]])
+                for r in items[:embed]:
+                    r["case"] = cases.get(r["transaction_id"])
+            return FastJSONResponse(items)
     finally:
         conn.close()
 @app.get("/review/case/{transaction_id}")
 def review_case(transaction_id: str):
-    conn = get_conn()
+    conn = get_read_conn()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT * FROM transactions WHERE transaction_id=%s;", (transaction_id,))
-            tx = cur.fetchone()
-            if not tx:
+            case = _load_review_cases(cur, [transaction_id]).get(transaction_id)
+            if case is None:
                 raise HTTPException(status_code=404, detail="Transaction not found")
-
-            cur.execute("SELECT * FROM transaction_features WHERE transaction_id=%s;", (transaction_id,))
-            feats = cur.fetchone()
-
-            cur.execute("SELECT * FROM risk_assessments WHERE transaction_id=%s;", (transaction_id,))
-            assess = cur.fetchone()
-
-            cur.execute("""
-                SELECT id, action, analyst, notes, created_at
-                FROM review_actions
-                WHERE transaction_id=%s
-                ORDER BY created_at DESC;
-            """, (transaction_id,))
-            history = cur.fetchall()
-
-            return {"transaction": tx, "features": feats, "assessment": assess, "review_history": history}
+            return FastJSONResponse(case)
     finally:
         conn.close()
+# shared with api/async_main.py
+REVIEW_ACTION_INSERT_SQL = """
+INSERT INTO review_actions (tx_pk, transaction_id, action, analyst, notes)
+VALUES (%s, %s, %s, %s, %s)
+RETURNING id, transaction_id, action, analyst, notes, created_at
+"""
+REVIEW_RELABEL_SQL = """
+UPDATE transactions t
+SET is_fraud = true, fraud_reason = 'confirmed_by_review'
+FROM (
+    SELECT tx_pk, is_fraud
+    FROM transactions
+    WHERE tx_pk = %s
+    FOR UPDATE
+) prev
+WHERE t.tx_pk = prev.tx_pk
+RETURNING prev.is_fraud AS was_fraud, t.merchant, t.merchant_category, t.user_id
+"""
+REVIEW_DECISION_SQL = "UPDATE risk_assessments SET decision = %s WHERE tx_pk = %s"
+
+
 @app.post("/review/case/{transaction_id}/action")
-def submit_review_action(transaction_id: str, body: ReviewActionIn):
+def submit_review_action(transaction_id: str, body: ReviewActionIn, response: Response):
     if body.action not in {"approve", "reject"}:
         raise HTTPException(status_code=400, detail="action must be 'approve' or 'reject'")
 
@@ -423,45 +828,58 @@ def submit_review_action(transaction_id: str, body: ReviewActionIn):
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             # ensure assessment exists
-            cur.execute("SELECT decision FROM risk_assessments WHERE transaction_id=%s;", (transaction_id,))
+            cur.execute(ASSESSMENT_BY_ID_SQL, (transaction_id,))
             row = cur.fetchone()
             if not row:
                 raise HTTPException(status_code=404, detail="Assessment not found for transaction")
+            tx_pk = row["tx_pk"]
 
             # store analyst decision
-            cur.execute("""
-                INSERT INTO review_actions (transaction_id, action, analyst, notes)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id, transaction_id, action, analyst, notes, created_at;
-            """, (transaction_id, body.action, body.analyst, body.notes))
+            cur.execute(REVIEW_ACTION_INSERT_SQL, (tx_pk, transaction_id, body.action, body.analyst, body.notes))
 
             action_row = cur.fetchone()
 
             # optional: write back “confirmed fraud” when rejected
             # (in real fintech this may be "chargeback/confirmed fraud" later,
             # but for your showcase this is great.)
+            relabeled = None
             if body.action == "reject":
-                cur.execute("""
-                    UPDATE transactions
-                    SET is_fraud = true, fraud_reason = 'confirmed_by_review'
-                    WHERE transaction_id = %s;
-                """, (transaction_id,))
+                cur.execute(REVIEW_RELABEL_SQL, (tx_pk,))
+                relabeled = cur.fetchone()
 
             # update assessment decision for auditability
             new_decision = "block" if body.action == "reject" else "approve"
-            cur.execute("""
-                UPDATE risk_assessments
-                SET decision = %s
-                WHERE transaction_id = %s;
-            """, (new_decision, transaction_id))
+            cur.execute(REVIEW_DECISION_SQL, (new_decision, tx_pk))
 
         conn.commit()
+        if score_cache is not None:
+            score_cache.invalidate([transaction_id])  # the assessment's decision changed
+        if REPLICA_ENABLED:
+            # this client's next reads wait for (or bypass) a replica behind this write
+            response.set_cookie(READ_LSN_COOKIE, current_wal_lsn(conn),
+                                max_age=READ_LSN_COOKIE_MAX_AGE_S, httponly=True, samesite="lax")
+
+        _apply_review_label(transaction_id, relabeled)
         return action_row
     finally:
         conn.close()
+
+
+def _apply_review_label(transaction_id: str, relabeled) -> None:
+    """Keep online merchant/category fraud rates and rings in step with a new fraud label."""
+    if not relabeled:
+        return
+    online_store = get_online_store()
+    if online_store is not None and not relabeled["was_fraud"]:
+        online_store.record_fraud_label(transaction_id, relabeled["merchant"], relabeled["merchant_category"])
+    entity_graph = get_entity_graph()
+    if entity_graph is not None and relabeled["user_id"] is not None:
+        entity_graph.record_fraud_label(relabeled["user_id"])
+
+
 @app.get("/monitoring/summary")
 def monitoring_summary():
-    conn = get_conn()
+    conn = get_read_conn()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
@@ -480,7 +898,7 @@ def monitoring_summary():
 
 @app.get("/monitoring/score_buckets")
 def monitoring_score_buckets():
-    conn = get_conn()
+    conn = get_read_conn()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
@@ -502,9 +920,112 @@ def monitoring_score_buckets():
         conn.close()
 
 
+@app.get("/monitoring/entity_cache")
+def monitoring_entity_cache():
+    if entity_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **entity_cache.stats()}
+
+
+@app.get("/users/{user_id}/ring")
+def user_ring(user_id: str):
+    entity_graph = get_entity_graph()
+    if entity_graph is None:
+        raise HTTPException(status_code=404, detail="Entity graph is disabled (ENTITY_GRAPH=1)")
+    ring = entity_graph.ring(user_id)
+    if ring is None:
+        raise HTTPException(status_code=404, detail="User not in entity graph")
+    return {"user_id": user_id, **ring}
+
+
+@app.get("/monitoring/scoring_queue")
+def monitoring_scoring_queue():
+    conn = get_conn()  # depth and lag should not lag behind on a replica
+    try:
+        return queue_stats(conn)
+    finally:
+        conn.close()
+
+
+# Per challenger over the last %(hours)s: how often it lands in the champion's
+# decision band, and how the review band (score >= review threshold) would catch
+# fraud. Labels: latest review outcome, else is_fraud.
+SHADOW_REPORT_SQL = """
+WITH s AS (
+    SELECT
+        s.model_id,
+        s.champion_score,
+        s.challenger_score,
+        CASE WHEN s.champion_score >= %(block)s THEN 2 WHEN s.champion_score >= %(review)s THEN 1 ELSE 0 END AS champion_band,
+        CASE WHEN s.challenger_score >= %(block)s THEN 2 WHEN s.challenger_score >= %(review)s THEN 1 ELSE 0 END AS challenger_band,
+        COALESCE(r.action = 'reject', t.is_fraud) AS fraud
+    FROM shadow_scores s
+    JOIN transactions t ON t.tx_pk = s.tx_pk
+    LEFT JOIN LATERAL (
+        SELECT a.action FROM review_actions a
+        WHERE a.tx_pk = s.tx_pk
+        ORDER BY a.created_at DESC, a.id DESC
+        LIMIT 1
+    ) r ON true
+    WHERE s.created_at >= NOW() - make_interval(hours => %(hours)s)
+)
+SELECT
+    m.name,
+    m.version,
+    COUNT(*)::int AS scored,
+    AVG((champion_band = challenger_band)::int)::float AS decision_agreement,
+    COUNT(*) FILTER (WHERE challenger_band > champion_band)::int AS escalated,
+    COUNT(*) FILTER (WHERE challenger_band < champion_band)::int AS relaxed,
+    AVG(ABS(champion_score - challenger_score))::float AS mean_abs_score_diff,
+    corr(champion_score, challenger_score) AS score_correlation,
+    COUNT(*) FILTER (WHERE fraud)::int AS fraud,
+    COUNT(*) FILTER (WHERE champion_band > 0)::int AS champion_flagged,
+    COUNT(*) FILTER (WHERE challenger_band > 0)::int AS challenger_flagged,
+    COUNT(*) FILTER (WHERE champion_band > 0 AND fraud)::int AS champion_caught,
+    COUNT(*) FILTER (WHERE challenger_band > 0 AND fraud)::int AS challenger_caught
+FROM s
+JOIN shadow_models m ON m.id = s.model_id
+GROUP BY m.id, m.name, m.version
+ORDER BY m.id;
+"""
+
+
+def _ratio(a, b):
+    return a / b if b else None
+
+
+@app.get("/monitoring/shadow")
+def monitoring_shadow(hours: int = Query(24, ge=1, le=24 * 90)):
+    conn = get_read_conn()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(SHADOW_REPORT_SQL, {"hours": hours, "block": BLOCK_THRESHOLD, "review": REVIEW_THRESHOLD})
+            models = cur.fetchall()
+    finally:
+        conn.close()
+
+    for m in models:
+        base_rate = _ratio(m["fraud"], m["scored"])
+        for who in ("champion", "challenger"):
+            precision = _ratio(m[f"{who}_caught"], m[f"{who}_flagged"])
+            m[f"{who}_precision"] = precision
+            m[f"{who}_recall"] = _ratio(m[f"{who}_caught"], m["fraud"])
+            m[f"{who}_lift"] = _ratio(precision, base_rate) if precision is not None else None
+        # > 1: the challenger's review band would catch more fraud than the champion's
+        m["caught_ratio"] = _ratio(m["challenger_caught"], m["champion_caught"])
+    return {
+        "enabled": shadow_scorer is not None,
+        "sample_rate": SHADOW_SAMPLE_RATE,
+        "hours": hours,
+        "block_threshold": BLOCK_THRESHOLD,
+        "review_threshold": REVIEW_THRESHOLD,
+        "models": models,
+    }
+
+
 @app.get("/monitoring/top_merchants")
 def monitoring_top_merchants(limit: int = Query(10, ge=1, le=50)):
-    conn = get_conn()
+    conn = get_read_conn()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute("""
@@ -515,7 +1036,7 @@ def monitoring_top_merchants(limit: int = Query(10, ge=1, le=50)):
                   SUM(CASE WHEN ra.decision='block' THEN 1 ELSE 0 END)::int AS blocks,
                   SUM(CASE WHEN ra.decision='manual_review' THEN 1 ELSE 0 END)::int AS reviews
                 FROM risk_assessments ra
-                JOIN transactions t ON t.transaction_id = ra.transaction_id
+                JOIN transactions t ON t.tx_pk = ra.tx_pk
                 WHERE ra.created_at >= NOW() - INTERVAL '24 hours'
                 GROUP BY t.merchant
                 ORDER BY avg_risk DESC
@@ -0,0 +1,417 @@
+# api/overload.py
+"""
+Adaptive overload control for POST /transactions/score.
+
+When PostgreSQL slows down, every scoring request holds a worker thread and a pool
+connection for the whole insert -> features -> assessment round trip, requests pile
+up behind each other and authorization fails outright. The controller watches two
+signals:
+
+  in-flight   scoring requests currently inside the handler (checked per request)
+  latency     mean latency of the database stages (db_connect, insert, feature_queries,
+              feature_upsert, assessment_write) over the last OVERLOAD_CHECK_MS
+
+and trips into degraded mode when either crosses its threshold. Degraded requests
+never touch the database: features come from the online store and the entity
+graph (or, when those can't answer, from the request alone), the decision is
+returned at once, and the transaction, its features and its assessment are
+handed to a DeferredWriter that persists them once PostgreSQL keeps up again.
+
+Recovery needs data, so OVERLOAD_PROBE_RATE of degraded requests still take the
+normal path. Once the stage latency stays under OVERLOAD_RECOVER_MS (and in-flight
+under half the limit) for OVERLOAD_RECOVER_S, the controller switches back.
+"""
+import fcntl
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import psycopg2
+
+from common.metrics import STAGE_LATENCY, DB_ERRORS, DECISIONS, Counter, CallbackMetric
+
+OVERLOAD_CONTROL = os.getenv("OVERLOAD_CONTROL", "0") == "1"
+OVERLOAD_MAX_IN_FLIGHT = int(os.getenv("OVERLOAD_MAX_IN_FLIGHT", "64"))
+OVERLOAD_LATENCY_MS = float(os.getenv("OVERLOAD_LATENCY_MS", "250"))
+OVERLOAD_RECOVER_MS = float(os.getenv("OVERLOAD_RECOVER_MS", "100"))
+OVERLOAD_RECOVER_S = float(os.getenv("OVERLOAD_RECOVER_S", "5"))
+OVERLOAD_CHECK_MS = float(os.getenv("OVERLOAD_CHECK_MS", "500"))
+OVERLOAD_PROBE_RATE = float(os.getenv("OVERLOAD_PROBE_RATE", "0.05"))
+OVERLOAD_DEFER_QUEUE_MAX = int(os.getenv("OVERLOAD_DEFER_QUEUE_MAX", "50000"))
+OVERLOAD_DEFER_BATCH = int(os.getenv("OVERLOAD_DEFER_BATCH", "500"))
+OVERLOAD_SPILL_PATH = os.getenv("OVERLOAD_SPILL_PATH", "/tmp/fraud_deferred_spill.jsonl")
+OVERLOAD_DEFER_MAX_ATTEMPTS = int(os.getenv("OVERLOAD_DEFER_MAX_ATTEMPTS", "5"))
+OVERLOAD_DEAD_LETTER_PATH = os.getenv("OVERLOAD_DEAD_LETTER_PATH", "/tmp/fraud_deferred_dead.jsonl")
+
+DB_STAGES = ("db_connect", "insert", "feature_queries", "feature_upsert", "assessment_write")
+
+log = logging.getLogger("fraud.overload")
+
+TRANSITIONS = Counter(
+    "fraud_overload_transitions_total",
+    "Switches between normal and degraded scoring, by target mode.",
+    labels=("mode",),
+)
+DEGRADED_DECISIONS = Counter(
+    "fraud_overload_degraded_decisions_total",
+    "Decisions made in degraded mode, by feature source (online_store, online_store_stale, request).",
+    labels=("source",),
+)
+DEFERRED_SPILLED = Counter(
+    "fraud_overload_deferred_spilled_total",
+    "Deferred transactions written to the on-disk spill file.",
+)
+DEFERRED_DEAD = Counter(
+    "fraud_overload_deferred_dead_letter_total",
+    "Deferred transactions that kept failing on their own and were set aside.",
+)
+
+# the database being down or slow, as opposed to something wrong with the rows
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+
+class OverloadController:
+    def __init__(
+        self,
+        max_in_flight: int = OVERLOAD_MAX_IN_FLIGHT,
+        latency_ms: float = OVERLOAD_LATENCY_MS,
+        recover_ms: float = OVERLOAD_RECOVER_MS,
+        recover_s: float = OVERLOAD_RECOVER_S,
+        check_ms: float = OVERLOAD_CHECK_MS,
+        probe_rate: float = OVERLOAD_PROBE_RATE,
+    ):
+        self.max_in_flight = max_in_flight
+        self._trip_s = latency_ms / 1000.0
+        self._recover_below_s = recover_ms / 1000.0
+        self._recover_s = recover_s
+        self._check_s = check_ms / 1000.0
+        self._probe_rate = probe_rate
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.degraded = False
+        self.last_latency_s = 0.0
+        self._calm_since = None
+        self._last_totals = self._stage_totals()
+        threading.Thread(target=self._run, name="overload-controller", daemon=True).start()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @contextmanager
+    def track(self):
+        with self._lock:
+            self._in_flight += 1
+            over = self._in_flight > self.max_in_flight
+        if over and not self.degraded:
+            self._switch(True, f"{self._in_flight} requests in flight")
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def should_degrade(self) -> bool:
+        """True when this request should skip the database; a few go through as probes."""
+        return self.degraded and random.random() >= self._probe_rate
+
+    def _switch(self, degraded: bool, why: str) -> None:
+        with self._lock:
+            if self.degraded == degraded:
+                return
+            self.degraded = degraded
+            self._calm_since = None
+        TRANSITIONS.inc(mode="degraded" if degraded else "normal")
+        log.warning("scoring switched to %s mode: %s", "degraded" if degraded else "normal", why)
+
+    @staticmethod
+    def _stage_totals() -> dict:
+        return {k[0]: v for k, v in STAGE_LATENCY.totals().items() if k[0] in DB_STAGES}
+
+    def _window_latency(self) -> float | None:
+        """Worst per-stage mean latency since the last check, or None without samples."""
+        totals = self._stage_totals()
+        worst = None
+        for stage, (total, count) in totals.items():
+            prev_total, prev_count = self._last_totals.get(stage, (0.0, 0))
+            if count > prev_count:
+                mean = (total - prev_total) / (count - prev_count)
+                worst = mean if worst is None else max(worst, mean)
+        self._last_totals = totals
+        return worst
+
+    def check(self) -> None:
+        latency = self._window_latency()
+        self.last_latency_s = latency or 0.0
+        if not self.degraded:
+            if latency is not None and latency > self._trip_s:
+                self._switch(True, f"database stages at {latency * 1000:.0f} ms")
+            return
+        # no samples means nobody is waiting on the database either
+        calm = (latency is None or latency < self._recover_below_s) \
+            and self._in_flight <= self.max_in_flight // 2
+        if not calm:
+            self._calm_since = None
+        elif self._calm_since is None:
+            self._calm_since = time.monotonic()
+        elif time.monotonic() - self._calm_since >= self._recover_s:
+            self._switch(False, f"database stages under {self._recover_below_s * 1000:.0f} ms "
+                                f"for {self._recover_s:g}s")
+
+    def _run(self):
+        while True:
+            time.sleep(self._check_s)
+            try:
+                self.check()
+            except Exception:
+                log.exception("overload check failed")
+
+
+def degraded_reason(source: str) -> dict:
+    """Marker appended to risk_assessments.reasons for decisions made in degraded mode."""
+    DEGRADED_DECISIONS.inc(source=source)
+    return {"feature": "degraded_mode", "value": 1.0, "contribution": 0.0, "source": source}
+
+
+def _spill_row(transaction_id, tx, ts, prob, risk_score, decision, reasons) -> dict:
+    return {
+        "transaction_id": transaction_id,
+        "tx": {k: getattr(tx, k) for k in (
+            "user_id", "card_id", "device_id", "amount", "currency",
+            "merchant", "merchant_category", "country",
+        )},
+        "ts": ts.isoformat(),
+        "assessment": [float(prob), int(risk_score), decision, reasons],
+    }
+
+
+def _from_spill(d: dict) -> tuple:
+    from datetime import datetime
+
+    prob, risk_score, decision, reasons = d["assessment"]
+    row = (d["transaction_id"], SimpleNamespace(**d["tx"]), datetime.fromisoformat(d["ts"]),
+           prob, risk_score, decision, reasons)
+    return row, d.get("step", 0)
+
+
+class DeferredWriter:
+    """
+    Persists transactions scored in degraded mode: the transaction row, its
+    features (computed by SQL, so they are exact once written) and the degraded
+    assessment, in that order. Every step is idempotent, and a batch that fails
+    is retried from the step that failed. Connection errors are retried for as
+    long as the database is away; any other error is retried max_attempts times,
+    then the batch is split and retried row by row, and a row that still fails
+    on its own goes to a dead-letter JSONL file with the error. Rows that don't
+    fit the queue, and whatever is left at shutdown, go to a JSONL spill file
+    (with the step they reached) that is replayed once the queue is empty.
+
+    Until a row is flushed, probes and other non-degraded requests don't see it in
+    their velocity features.
+    """
+
+    def __init__(
+        self,
+        get_conn,
+        known=None,
+        max_queue: int = OVERLOAD_DEFER_QUEUE_MAX,
+        batch_size: int = OVERLOAD_DEFER_BATCH,
+        spill_path: str = OVERLOAD_SPILL_PATH,
+        max_attempts: int = OVERLOAD_DEFER_MAX_ATTEMPTS,
+        dead_letter_path: str = OVERLOAD_DEAD_LETTER_PATH,
+    ):
+        self._get_conn = get_conn
+        self._known = known
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._batch_size = batch_size
+        self._spill_path = spill_path
+        self._max_attempts = max_attempts
+        self._dead_letter_path = dead_letter_path
+        self._spill_pending = os.path.exists(spill_path) and os.path.getsize(spill_path) > 0
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="deferred-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, transaction_id, tx, ts, prob, risk_score, decision, reasons) -> None:
+        row = (transaction_id, tx, ts, float(prob), int(risk_score), decision, reasons)
+        if self._closed.is_set():
+            self._spill([row])
+            return
+        try:
+            self._queue.put_nowait((row, 0))
+        except queue.Full:
+            self._spill([row])
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def close(self, timeout: float = 10.0) -> None:
+        self._closed.set()
+        self._thread.join(timeout=timeout)
+        for step, rows in self._by_step(self._drain(block=False)).items():
+            self._spill(rows, step)
+
+    def _drain(self, block: bool) -> list:
+        items = []
+        while len(items) < self._batch_size:
+            try:
+                items.append(self._queue.get(timeout=0.1) if block and not items else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    @staticmethod
+    def _by_step(items) -> dict:
+        groups = {}
+        for row, step in items:
+            groups.setdefault(step, []).append(row)
+        return groups
+
+    def _run(self):
+        while True:
+            closing = self._closed.is_set()
+            items = self._drain(block=not closing)
+            if items:
+                for step, rows in sorted(self._by_step(items).items()):
+                    self._flush_until_done(rows, step, give_up=closing)
+            elif closing:
+                return
+            elif self._spill_pending and not self._replay_spill():
+                time.sleep(1.0)
+
+    def _flush_until_done(self, rows, step: int, give_up: bool) -> None:
+        backoff = 0.1
+        attempts = 0
+        while True:
+            failed = self._flush(rows, step)
+            if failed is None:
+                return
+            step, exc = failed
+            if give_up or self._closed.is_set():
+                self._spill(rows, step)
+                return
+            if not isinstance(exc, TRANSIENT_ERRORS):
+                attempts += 1
+                if attempts >= self._max_attempts:
+                    if len(rows) == 1:
+                        self._dead_letter(rows[0], step, exc)
+                    else:
+                        # one bad row shouldn't hold back the rest of the batch
+                        for row in rows:
+                            self._flush_until_done([row], step, give_up)
+                    return
+            time.sleep(backoff)
+            backoff = min(5.0, backoff * 2)
+
+    def _flush(self, rows, step: int = 0) -> tuple[int, Exception] | None:
+        """Runs the remaining steps; returns None when done, else the failed step and its error."""
+        from api.persistence import write_transactions, upsert_assessments
+        from features.realtime_features import compute_and_upsert_features_batch
+
+        ids = [r[0] for r in rows]
+        try:
+            if step == 0:
+                with STAGE_LATENCY.time(stage="deferred_insert"):
+                    write_transactions(self._get_conn, [r[:3] for r in rows], known=self._known,
+                                       skip_existing=True)
+                step = 1
+            if step == 1:
+                with STAGE_LATENCY.time(stage="deferred_features"):
+                    compute_and_upsert_features_batch(ids)
+                step = 2
+            with STAGE_LATENCY.time(stage="deferred_assessment_write"):
+                conn = self._get_conn()
+                try:
+                    with conn.cursor() as cur:
+                        new = upsert_assessments(cur, [(r[0], *r[3:]) for r in rows])
+                    conn.commit()
+                finally:
+                    conn.close()
+                for decision in new:
+                    DECISIONS.inc(decision=decision)
+            return None
+        except Exception as exc:
+            DB_ERRORS.inc(kind=f"deferred_flush:{type(exc).__name__}")
+            return step, exc
+
+    def _dead_letter(self, row, step: int, exc: Exception) -> None:
+        log.error("deferred transaction %s failed at step %d, set aside: %s", row[0], step, exc)
+        with open(self._dead_letter_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(json.dumps({**_spill_row(*row), "step": step, "error": repr(exc)}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        DEFERRED_DEAD.inc()
+
+    def _spill(self, rows, step: int = 0) -> None:
+        with open(self._spill_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                for row in rows:
+                    f.write(json.dumps({**_spill_row(*row), "step": step}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                DEFERRED_SPILLED.inc(len(rows))
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        self._spill_pending = True
+
+    def _replay_spill(self) -> bool:
+        """
+        Move as much of the spill file back into the queue as it has room for, and
+        rewrite the file with the rest, holding its lock so no one appends
+        meanwhile. A backlog bigger than the queue drains over several calls.
+        False when the queue had no room at all.
+        """
+        try:
+            f = open(self._spill_path, "r+")
+        except FileNotFoundError:
+            self._spill_pending = False
+            return True
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                lines = [line for line in f if line.strip()]
+                room = self._queue.maxsize - self._queue.qsize() if self._queue.maxsize > 0 else len(lines)
+                if lines and room <= 0:
+                    return False
+                taken, rest = lines[:room], lines[room:]
+                for line in taken:
+                    self._queue.put_nowait(_from_spill(json.loads(line)))
+                f.seek(0)
+                f.truncate()
+                if rest:
+                    f.writelines(rest)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._spill_pending = bool(rest)
+                return True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def overload_metrics(controller: OverloadController, writer: DeferredWriter) -> None:
+    CallbackMetric(
+        "fraud_overload_degraded",
+        "1 while /transactions/score runs in degraded mode.",
+        lambda: 1 if controller.degraded else 0,
+    )
+    CallbackMetric(
+        "fraud_overload_in_flight",
+        "Scoring requests currently being handled.",
+        lambda: controller.in_flight,
+    )
+    CallbackMetric(
+        "fraud_overload_deferred_depth",
+        "Degraded-mode transactions waiting to be persisted.",
+        writer.depth,
+    )
@@ -0,0 +1,183 @@
+# api/persistence.py
+import json
+
+from psycopg2 import errors
+from psycopg2.extras import execute_values
+
+
+def ensure_dimensions(cur, txs, known=None) -> dict:
+    """
+    Make sure the FK dimension rows (users, cards, devices) exist for every transaction.
+    Keys are de-duplicated and sorted so concurrent batches lock rows in the same order.
+
+    With a KnownEntityCache, IDs already known to exist are skipped. Returns the IDs
+    that were written, per kind, so the caller can remember() them after commit.
+    """
+    users = {}
+    cards = {}
+    devices = set()
+    for tx in txs:
+        users.setdefault(tx.user_id, tx.country)
+        cards.setdefault(tx.card_id, tx.user_id)
+        devices.add(tx.device_id)
+
+    if known is not None:
+        users = {u: users[u] for u in known.missing("user", users)}
+        cards = {c: cards[c] for c in known.missing("card", cards)}
+        devices = set(known.missing("device", devices))
+
+    if users:
+        execute_values(cur, """
+            INSERT INTO users (user_id, home_country, account_age_days, avg_transaction_amount)
+            VALUES %s
+            ON CONFLICT (user_id) DO NOTHING;
+        """, [(u, c, 30, 100.0) for u, c in sorted(users.items())])
+
+    if cards:
+        execute_values(cur, """
+            INSERT INTO cards (card_id, user_id, issuer, is_stolen)
+            VALUES %s
+            ON CONFLICT (card_id) DO NOTHING;
+        """, [(c, u, "Visa", False) for c, u in sorted(cards.items())])
+
+    if devices:
+        execute_values(cur, """
+            INSERT INTO devices (device_id, device_type)
+            VALUES %s
+            ON CONFLICT (device_id) DO NOTHING;
+        """, [(d, "mobile") for d in sorted(devices)])
+
+    return {"user": list(users), "card": list(cards), "device": list(devices)}
+
+
+def remember_dimensions(known, written: dict) -> None:
+    if known is None:
+        return
+    for kind, ids in written.items():
+        known.remember(kind, ids)
+
+
+TRANSACTION_COLUMNS = (
+    "transaction_id", "user_id", "card_id", "device_id", "amount", "currency",
+    "merchant", "merchant_category", "country", "timestamp", "is_fraud", "fraud_reason",
+)
+
+# Transactions from `source` (columns TRANSACTION_COLUMNS, aliased v) with their
+# entity keys resolved by one join in the statement. An unknown id leaves its key
+# NULL, and the transactions_fill_entity_keys trigger raises foreign_key_violation.
+TRANSACTION_INSERT_SQL = f"""
+INSERT INTO transactions ({", ".join(TRANSACTION_COLUMNS)}, user_pk, card_pk, device_pk)
+SELECT {", ".join(f"v.{c}" for c in TRANSACTION_COLUMNS)}, u.user_pk, c.card_pk, d.device_pk
+FROM {{source}}
+LEFT JOIN users u ON u.user_id = v.user_id
+LEFT JOIN cards c ON c.card_id = v.card_id
+LEFT JOIN devices d ON d.device_id = v.device_id"""
+TRANSACTION_VALUES = f"(VALUES %s) AS v({', '.join(TRANSACTION_COLUMNS)})"
+TRANSACTION_TEMPLATE = ("(%s::text, %s::text, %s::text, %s::text, %s::float8, %s::text, "
+                        "%s::text, %s::text, %s::text, %s::timestamp, %s::boolean, %s::text)")
+# single-row form, one parameter per column
+TRANSACTION_ROW_INSERT_SQL = TRANSACTION_INSERT_SQL.format(
+    source=TRANSACTION_VALUES.replace("%s", TRANSACTION_TEMPLATE))
+
+
+def insert_transactions(cur, rows, skip_existing: bool = False) -> dict:
+    """
+    rows: iterable of (transaction_id, TransactionCreate, timestamp)
+    skip_existing=True ignores rows whose transaction_id is already stored, for
+    writers that may retry a batch whose commit did in fact go through.
+
+    Returns {transaction_id: tx_pk} for the rows inserted.
+    """
+    conflict = "\nON CONFLICT (transaction_id) DO NOTHING" if skip_existing else ""
+    inserted = execute_values(cur, f"""{TRANSACTION_INSERT_SQL.format(source=TRANSACTION_VALUES)}{conflict}
+        RETURNING transaction_id, tx_pk;
+    """, [
+        (
+            transaction_id, tx.user_id, tx.card_id, tx.device_id, tx.amount, tx.currency,
+            tx.merchant, tx.merchant_category, tx.country, ts, False, None,
+        )
+        for transaction_id, tx, ts in rows
+    ], template=TRANSACTION_TEMPLATE, fetch=True)
+    return dict(inserted)
+
+
+def enqueue_scoring_jobs(cur, tx_pks: dict, priority: int = 0) -> None:
+    """
+    Queue transactions for the scoring workers (api/scoring_worker.py). Runs in the
+    caller's transaction, so a job exists exactly when its transaction row does.
+    tx_pks: {transaction_id: tx_pk}, as returned by insert_transactions.
+    """
+    execute_values(cur, "INSERT INTO scoring_jobs (tx_pk, transaction_id, priority) VALUES %s;",
+                   [(tx_pk, tid, priority) for tid, tx_pk in tx_pks.items()])
+
+
+def write_transactions(get_conn, rows, known=None, enqueue: bool = False, skip_existing: bool = False) -> dict:
+    """
+    Insert dimension rows + transactions in one commit; returns {transaction_id: tx_pk}
+    for the rows inserted.
+    rows: list of (transaction_id, TransactionCreate, timestamp)
+    enqueue=True also queues a scoring job per row in the same commit.
+    skip_existing=True makes the insert idempotent (see insert_transactions).
+
+    If the known-entity cache is stale (dimension rows deleted underneath us) the
+    FK check fails; drop the cache and retry once with every upsert in place.
+    """
+    for attempt in range(2):
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                written = ensure_dimensions(cur, [tx for _, tx, _ in rows], known=known)
+                tx_pks = insert_transactions(cur, rows, skip_existing=skip_existing)
+                if enqueue:
+                    enqueue_scoring_jobs(cur, tx_pks)
+            conn.commit()
+            remember_dimensions(known, written)
+            return tx_pks
+        except errors.ForeignKeyViolation:
+            conn.rollback()
+            if known is None or attempt:
+                raise
+            known.clear()
+        finally:
+            conn.close()
+
+
+# Rescoring refreshes the model's numbers, but once an analyst has acted on a
+# transaction its decision (and its place in the review queue) is theirs.
+REVIEWED = "EXISTS (SELECT 1 FROM review_actions a WHERE a.tx_pk = risk_assessments.tx_pk)"
+
+# Shared with the async API, which runs it one row at a time. tx_pk comes from one
+# join in the statement; for an unknown transaction it stays NULL and the fill_tx_pk
+# trigger raises foreign_key_violation.
+ASSESSMENT_INSERT_SQL = """
+INSERT INTO risk_assessments (tx_pk, transaction_id, fraud_probability, risk_score, decision, reasons)
+SELECT t.tx_pk, v.transaction_id, v.fraud_probability, v.risk_score, v.decision, v.reasons
+FROM (VALUES %s) AS v(transaction_id, fraud_probability, risk_score, decision, reasons)
+LEFT JOIN transactions t ON t.transaction_id = v.transaction_id"""
+ASSESSMENT_TEMPLATE = "(%s::text, %s::float8, %s::int, %s::text, %s::jsonb)"
+ASSESSMENT_CONFLICT_SQL = f"""
+ON CONFLICT (tx_pk) DO UPDATE SET
+    fraud_probability = EXCLUDED.fraud_probability,
+    risk_score = EXCLUDED.risk_score,
+    decision = CASE WHEN {REVIEWED} THEN risk_assessments.decision ELSE EXCLUDED.decision END,
+    reasons = EXCLUDED.reasons,
+    created_at = CASE WHEN {REVIEWED} THEN risk_assessments.created_at ELSE NOW() END"""
+
+
+def upsert_assessments(cur, rows, skip_existing: bool = False) -> list[str]:
+    """
+    rows: iterable of (transaction_id, fraud_probability, risk_score, decision, reasons)
+    skip_existing=True leaves existing assessments alone, for replaying rows that
+    may be older than what has been written since.
+
+    Returns the decisions of rows that had no assessment yet (rescored rows are
+    left out), for callers that only count first decisions.
+    """
+    conflict = "\nON CONFLICT (tx_pk) DO NOTHING" if skip_existing else ASSESSMENT_CONFLICT_SQL
+    inserted = execute_values(cur, f"""{ASSESSMENT_INSERT_SQL}{conflict}
+        RETURNING (xmax = 0), decision;
+    """, [
+        (transaction_id, float(prob), int(risk_score), decision, json.dumps(reasons))
+        for transaction_id, prob, risk_score, decision, reasons in rows
+    ], template=ASSESSMENT_TEMPLATE, fetch=True)
+    return [decision for is_new, decision in inserted if is_new]
@@ -0,0 +1,147 @@
+# api/responses.py
+"""
+Fast path for large JSON responses.
+
+FastJSONResponse encodes with orjson and is returned directly by list endpoints
+whose rows come straight from PostgreSQL, so FastAPI skips response_model
+validation and jsonable_encoder for them (the model stays on the route for the
+OpenAPI schema). Output matches the default encoder: ISO-8601 datetimes, NUMERIC
+as float.
+
+CompressionMiddleware negotiates brotli or gzip from Accept-Encoding for any
+single-body response of at least RESPONSE_COMPRESS_MIN_BYTES. Streaming bodies
+(bulk results) pass through untouched. Bodies of RESPONSE_COMPRESS_THREAD_BYTES
+or more are compressed in a worker thread so the event loop keeps serving;
+smaller ones compress in less time than the thread hop costs.
+"""
+import gzip
+import os
+from decimal import Decimal
+
+import anyio.to_thread
+import brotli
+import orjson
+from fastapi.responses import JSONResponse
+
+from common.metrics import Counter
+
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "4"))
+RESPONSE_COMPRESS_THREAD_BYTES = int(os.getenv("RESPONSE_COMPRESS_THREAD_BYTES", "16384"))
+
+COMPRESSED_BYTES = Counter(
+    "fraud_http_compressed_bytes_total",
+    "Bytes of compressed response bodies, before (raw) and after (sent), by encoding.",
+    labels=("encoding", "size"),
+)
+
+# preference order when the client accepts several at the same q
+ENCODINGS = ("br", "gzip")
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    """Best of ENCODINGS acceptable per an Accept-Encoding header, or None."""
+    q = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        weight = 1.0
+        for p in params.split(";"):
+            k, _, v = p.strip().partition("=")
+            if k == "q":
+                try:
+                    weight = float(v)
+                except ValueError:
+                    weight = 0.0
+        q[name] = weight
+    best, best_q = None, 0.0
+    for enc in ENCODINGS:
+        w = q.get(enc, q.get("*", 0.0))
+        if w > best_q:
+            best, best_q = enc, w
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """
+    Plain ASGI middleware: holds back http.response.start until the first body
+    chunk shows whether the response is a single, large enough, uncompressed body.
+    """
+
+    def __init__(self, app, min_bytes: int = RESPONSE_COMPRESS_MIN_BYTES,
+                 thread_bytes: int = RESPONSE_COMPRESS_THREAD_BYTES):
+        self.app = app
+        self.min_bytes = min_bytes
+        self.thread_bytes = thread_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        accept = ""
+        for name, value in scope.get("headers", ()):
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept) if accept else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        state = {"start": None, "passthrough": False}
+
+        async def send_wrapper(message):
+            if state["passthrough"]:
+                return await send(message)
+            if message["type"] == "http.response.start":
+                state["start"] = message
+                return
+            if message["type"] != "http.response.body":
+                return await send(message)
+
+            start, state["passthrough"] = state["start"], True
+            body = message.get("body", b"")
+            headers = [(k, v) for k, v in start.get("headers", ())]
+            already_encoded = any(k.lower() == b"content-encoding" for k, _ in headers)
+            if message.get("more_body", False) or already_encoded or len(body) < self.min_bytes:
+                await send(start)
+                return await send(message)
+
+            if len(body) >= self.thread_bytes:
+                compressed = await anyio.to_thread.run_sync(compress, body, encoding)
+            else:
+                compressed = compress(body, encoding)
+            COMPRESSED_BYTES.inc(len(body), encoding=encoding, size="raw")
+            COMPRESSED_BYTES.inc(len(compressed), encoding=encoding, size="sent")
+            vary = b", ".join([v for k, v in headers if k.lower() == b"vary"] + [b"Accept-Encoding"])
+            headers = [(k, v) for k, v in headers if k.lower() not in (b"content-length", b"vary")]
+            headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+                (b"vary", vary),
+            ]
+            await send({**start, "headers": headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
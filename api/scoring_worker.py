@@ -0,0 +1,331 @@
+# api/scoring_worker.py
+"""
+Scoring workers fed by the scoring_jobs queue (database/scoring_jobs.sql).
+
+    python -m api.scoring_worker run --workers 4
+    python -m api.scoring_worker enqueue --unscored          # batch rescoring
+    python -m api.scoring_worker enqueue --since 2024-01-01 --priority 2
+
+Each worker claims up to batch_size jobs with FOR UPDATE SKIP LOCKED (so workers
+never wait on each other), computes features and scores in one pass, writes
+risk_assessments and deletes the jobs, all in one transaction. A worker that dies
+mid-batch just releases its row locks; the jobs are picked up again. Idle workers
+sleep until NOTIFY scoring_jobs or poll_s passes. A worker that loses its
+connection reconnects with backoff, and `run` restarts worker processes that exit.
+
+Rescoring never changes the decision of a transaction an analyst has reviewed
+(api.persistence.upsert_assessments), and enqueue skips transactions that
+already have a queued job.
+
+Jobs are claimed in (priority, id) order: the API enqueues live traffic at
+priority 0, bulk loads at 1, and rescoring runs below that by default.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import select
+import socket
+import time
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+from api.persistence import upsert_assessments
+from common.db import connect
+from features.realtime_features import compute_and_upsert_in_transaction
+from models.scoring import score_batch_with_reasons, decide
+
+SCORING_WORKER_BATCH_SIZE = int(os.getenv("SCORING_WORKER_BATCH_SIZE", "200"))
+SCORING_WORKER_POLL_S = float(os.getenv("SCORING_WORKER_POLL_S", "5"))
+SCORING_WORKER_MAX_ATTEMPTS = int(os.getenv("SCORING_WORKER_MAX_ATTEMPTS", "3"))
+SCORING_WORKER_MAX_BACKOFF_S = float(os.getenv("SCORING_WORKER_MAX_BACKOFF_S", "30"))
+RESCORE_PRIORITY = 5
+# one scoring_workers counter column per decision
+DECISION_KINDS = ("approve", "manual_review", "block")
+
+log = logging.getLogger("fraud.scoring_worker")
+
+CLAIM_SQL = """
+SELECT id, transaction_id, EXTRACT(EPOCH FROM NOW() - enqueued_at)::float8 AS lag_s
+FROM scoring_jobs
+WHERE status = 'queued'
+ORDER BY priority, id
+LIMIT %s
+FOR UPDATE SKIP LOCKED;
+"""
+
+
+class ScoringWorker:
+    def __init__(
+        self,
+        worker_id: str = None,
+        batch_size: int = SCORING_WORKER_BATCH_SIZE,
+        poll_s: float = SCORING_WORKER_POLL_S,
+        max_attempts: int = SCORING_WORKER_MAX_ATTEMPTS,
+    ):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self._batch_size = batch_size
+        self._poll_s = poll_s
+        self._max_attempts = max_attempts
+        self._conn = None
+
+    def _register(self) -> None:
+        with self._conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO scoring_workers (worker_id) VALUES (%s)
+                ON CONFLICT (worker_id) DO UPDATE SET
+                    started_at = NOW(), heartbeat_at = NOW(),
+                    batches = 0, jobs_done = 0, jobs_failed = 0,
+                    last_batch_jobs_per_s = NULL, last_lag_s = NULL;
+            """, (self.worker_id,))
+        self._conn.commit()
+
+    def _process(self, cur, jobs) -> list[str]:
+        """
+        Features, scores, assessments and job deletion for claimed jobs (caller
+        commits). Returns the decisions of transactions scored for the first time.
+        """
+        transaction_ids = list(dict.fromkeys(j["transaction_id"] for j in jobs))
+        feats = compute_and_upsert_in_transaction(cur, transaction_ids)
+        assessments = []
+        for tid, (prob, reasons) in zip(transaction_ids, score_batch_with_reasons(feats, top_k=3)):
+            risk_score = int(round(prob * 100))
+            assessments.append((tid, prob, risk_score, decide(risk_score), reasons))
+        # jobs queued by bulk ingest score a transaction for the first time; retries rescore it
+        new = upsert_assessments(cur, assessments)
+        cur.execute("DELETE FROM scoring_jobs WHERE id = ANY(%s);", ([j["id"] for j in jobs],))
+        return new
+
+    def _heartbeat(self, cur, done: int, failed: int, elapsed_s: float, lag_s: float, decisions=()) -> None:
+        # decisions are committed with the batch's assessments; workers have no
+        # /metrics, so the API exports these (fraud_scoring_worker_decisions_total)
+        cur.execute("""
+            UPDATE scoring_workers SET
+                heartbeat_at = NOW(),
+                batches = batches + 1,
+                jobs_done = jobs_done + %s,
+                jobs_failed = jobs_failed + %s,
+                last_batch_jobs_per_s = %s,
+                last_lag_s = %s,
+                decisions_approve = decisions_approve + %s,
+                decisions_manual_review = decisions_manual_review + %s,
+                decisions_block = decisions_block + %s
+            WHERE worker_id = %s;
+        """, (done, failed, done / elapsed_s if elapsed_s > 0 else None, lag_s,
+              *(sum(d == k for d in decisions) for k in DECISION_KINDS), self.worker_id))
+
+    def run_once(self) -> int:
+        """Claim and process one batch. Returns the number of jobs claimed."""
+        t0 = time.perf_counter()
+        with self._conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(CLAIM_SQL, (self._batch_size,))
+            jobs = cur.fetchall()
+            if not jobs:
+                self._conn.rollback()
+                return 0
+            try:
+                decisions = self._process(cur, jobs)
+                self._heartbeat(cur, len(jobs), 0, time.perf_counter() - t0, max(j["lag_s"] for j in jobs),
+                                decisions)
+                self._conn.commit()
+                return len(jobs)
+            except Exception as exc:
+                self._conn.rollback()
+                log.warning("batch of %d failed (%s); retrying jobs one by one", len(jobs), exc)
+
+        # isolate the bad job(s) so they don't keep failing their whole batch
+        for job in jobs:
+            self._run_single(job["id"])
+        return len(jobs)
+
+    def _run_single(self, job_id: int) -> None:
+        t0 = time.perf_counter()
+        with self._conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                SELECT id, transaction_id, EXTRACT(EPOCH FROM NOW() - enqueued_at)::float8 AS lag_s
+                FROM scoring_jobs WHERE id = %s AND status = 'queued'
+                FOR UPDATE SKIP LOCKED;
+            """, (job_id,))
+            job = cur.fetchone()
+            if job is None:
+                self._conn.rollback()
+                return  # done or taken by another worker meanwhile
+            try:
+                decisions = self._process(cur, [job])
+                self._heartbeat(cur, 1, 0, time.perf_counter() - t0, job["lag_s"], decisions)
+                self._conn.commit()
+                return
+            except Exception as exc:
+                self._conn.rollback()
+                error = f"{type(exc).__name__}: {exc}"
+
+        with self._conn.cursor() as cur:
+            cur.execute("""
+                UPDATE scoring_jobs SET
+                    attempts = attempts + 1,
+                    last_error = %s,
+                    status = CASE WHEN attempts + 1 >= %s THEN 'failed' ELSE status END
+                WHERE id = %s;
+            """, (error, self._max_attempts, job_id))
+            self._heartbeat(cur, 0, 1, 0.0, None)
+        self._conn.commit()
+        log.error("job %s failed: %s", job_id, error)
+
+    def run(self) -> None:
+        """Serves forever; a lost connection (e.g. a database restart) is retried with backoff."""
+        delay = 1.0
+        while True:
+            started = time.monotonic()
+            try:
+                self._serve()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as exc:
+                if time.monotonic() - started > 60:
+                    delay = 1.0  # it was healthy for a while; this is a fresh outage
+                log.warning("worker %s lost its database connection (%s); reconnecting in %.0fs",
+                            self.worker_id, exc, delay)
+            time.sleep(delay)
+            delay = min(delay * 2, SCORING_WORKER_MAX_BACKOFF_S)
+
+    def _serve(self) -> None:
+        listener = None
+        try:
+            self._conn = connect()
+            self._register()
+            listener = connect()
+            listener.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with listener.cursor() as cur:
+                cur.execute("LISTEN scoring_jobs;")
+            log.info("worker %s started", self.worker_id)
+
+            while True:
+                # drain; a short batch means the queue is (momentarily) empty
+                while self.run_once() >= self._batch_size:
+                    pass
+                if select.select([listener], [], [], self._poll_s) != ([], [], []):
+                    listener.poll()
+                    listener.notifies.clear()
+        finally:
+            for conn in (listener, self._conn):
+                if conn is not None and not conn.closed:
+                    conn.close()
+            self._conn = None
+
+
+def enqueue(unscored: bool = False, since=None, priority: int = RESCORE_PRIORITY) -> int:
+    """Queue existing transactions for (re)scoring; returns how many were queued."""
+    # a transaction already waiting in the queue is scored once
+    where = ["NOT EXISTS (SELECT 1 FROM scoring_jobs j WHERE j.tx_pk = t.tx_pk AND j.status = 'queued')"]
+    args = []
+    if unscored:
+        where.append("NOT EXISTS (SELECT 1 FROM risk_assessments r WHERE r.tx_pk = t.tx_pk)")
+    if since:
+        where.append("t.timestamp >= %s")
+        args.append(since)
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                INSERT INTO scoring_jobs (tx_pk, transaction_id, priority)
+                SELECT t.tx_pk, t.transaction_id, %s FROM transactions t
+                WHERE {" AND ".join(where)}
+                ORDER BY t.timestamp;
+            """, (priority, *args))
+            n = cur.rowcount
+        conn.commit()
+        return n
+    finally:
+        conn.close()
+
+
+def worker_decisions(conn) -> dict:
+    """{(decision,): count} of first decisions committed by all scoring workers."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT {", ".join(f"COALESCE(SUM(decisions_{k}), 0)" for k in DECISION_KINDS)}
+                FROM scoring_workers;
+            """)
+            row = cur.fetchone()
+    finally:
+        conn.rollback()
+    return {(k,): int(v) for k, v in zip(DECISION_KINDS, row)}
+
+
+def queue_stats(conn) -> dict:
+    """Depth and lag per priority, and per-worker throughput (for /monitoring/scoring_queue)."""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT priority, status, COUNT(*)::int AS jobs,
+                   EXTRACT(EPOCH FROM NOW() - MIN(enqueued_at))::float8 AS oldest_s
+            FROM scoring_jobs
+            GROUP BY priority, status
+            ORDER BY priority, status;
+        """)
+        queues = cur.fetchall()
+        cur.execute("""
+            SELECT worker_id, started_at, heartbeat_at, batches, jobs_done, jobs_failed,
+                   jobs_done / GREATEST(EXTRACT(EPOCH FROM heartbeat_at - started_at), 1)::float8 AS avg_jobs_per_s,
+                   last_batch_jobs_per_s, last_lag_s,
+                   decisions_approve, decisions_manual_review, decisions_block,
+                   EXTRACT(EPOCH FROM NOW() - heartbeat_at)::float8 AS idle_s
+            FROM scoring_workers
+            ORDER BY worker_id;
+        """)
+        workers = cur.fetchall()
+    return {
+        "depth": sum(q["jobs"] for q in queues if q["status"] == "queued"),
+        "failed": sum(q["jobs"] for q in queues if q["status"] == "failed"),
+        "oldest_queued_s": max((q["oldest_s"] for q in queues if q["status"] == "queued"), default=None),
+        "queues": queues,
+        "workers": workers,
+    }
+
+
+def _worker_main(batch_size: int, poll_s: float) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(message)s")
+    ScoringWorker(batch_size=batch_size, poll_s=poll_s).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scoring job queue workers.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    run = sub.add_parser("run")
+    run.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    run.add_argument("--batch-size", type=int, default=SCORING_WORKER_BATCH_SIZE)
+    run.add_argument("--poll", type=float, default=SCORING_WORKER_POLL_S)
+    enq = sub.add_parser("enqueue")
+    enq.add_argument("--unscored", action="store_true", help="only transactions without an assessment")
+    enq.add_argument("--since", help="only transactions at or after this timestamp")
+    enq.add_argument("--priority", type=int, default=RESCORE_PRIORITY)
+    args = parser.parse_args()
+
+    if args.cmd == "enqueue":
+        print(f"Queued {enqueue(args.unscored, args.since, args.priority)} transactions.")
+        return
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(message)s")
+
+    def spawn(i: int) -> multiprocessing.Process:
+        p = multiprocessing.Process(target=_worker_main, args=(args.batch_size, args.poll),
+                                    name=f"scoring-worker-{i}")
+        p.start()
+        return p
+
+    procs = [spawn(i) for i in range(args.workers)]
+    try:
+        # supervise: a worker that exits (crash, unexpected error) is replaced
+        while True:
+            time.sleep(1.0)
+            for i, p in enumerate(procs):
+                if p.exitcode is not None:
+                    log.error("%s exited with code %s; restarting it", p.name, p.exitcode)
+                    procs[i] = spawn(i)
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+
+
+if __name__ == "__main__":
+    main()
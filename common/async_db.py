@@ -0,0 +1,123 @@
+# common/async_db.py
+"""
+asyncpg counterpart of common.db for the async API (api/async_main.py).
+
+One pool per process, created on startup. fetch/fetchrow/fetchval/execute time
+every statement into the same common.query_profiler as the psycopg2 path, so
+/debug/queries covers both; asyncpg prepares and caches statements per
+connection by itself.
+"""
+import asyncio
+import json
+import os
+import time
+
+import asyncpg
+import orjson
+
+from common.db import DB_CONFIG
+from common.metrics import STAGE_LATENCY, DB_ERRORS, POOL_WAITS, CallbackMetric
+from common.query_profiler import SQL_PROFILE, normalize_sql, profiler
+
+ASYNC_DB_POOL_MIN = int(os.getenv("ASYNC_DB_POOL_MIN", "5"))
+ASYNC_DB_POOL_MAX = int(os.getenv("ASYNC_DB_POOL_MAX", "50"))
+ASYNC_DB_POOL_TIMEOUT_S = float(os.getenv("ASYNC_DB_POOL_TIMEOUT_S", "10"))
+
+_pool = None
+
+
+async def _init_connection(conn) -> None:
+    # JSONB in and out as Python objects, like psycopg2's default
+    await conn.set_type_codec("jsonb", encoder=json.dumps, decoder=orjson.loads, schema="pg_catalog")
+
+
+async def open_pool() -> asyncpg.Pool:
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            host=DB_CONFIG["host"], port=DB_CONFIG["port"], database=DB_CONFIG["database"],
+            user=DB_CONFIG["user"], password=DB_CONFIG["password"],
+            min_size=ASYNC_DB_POOL_MIN, max_size=ASYNC_DB_POOL_MAX, init=_init_connection,
+        )
+    return _pool
+
+
+async def close_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+class _Acquire:
+    """async with acquire() as conn: ... — a pooled connection, timed as db_connect."""
+
+    def __init__(self):
+        self._ctx = None
+
+    async def __aenter__(self):
+        pool = await open_pool()
+        if pool.get_idle_size() == 0 and pool.get_size() >= ASYNC_DB_POOL_MAX:
+            POOL_WAITS.inc(pool="async")
+        with STAGE_LATENCY.time(stage="db_connect"):
+            self._ctx = pool.acquire(timeout=ASYNC_DB_POOL_TIMEOUT_S)
+            try:
+                return await self._ctx.__aenter__()
+            except asyncio.TimeoutError:
+                DB_ERRORS.inc(kind="pool_timeout")
+                raise
+
+    async def __aexit__(self, *exc):
+        return await self._ctx.__aexit__(*exc)
+
+
+def acquire() -> _Acquire:
+    return _Acquire()
+
+
+def numbered(sql: str) -> str:
+    """psycopg2 %s placeholders -> asyncpg $1, $2, ..., so both APIs run the same SQL constants."""
+    parts = sql.split("%s")
+    return parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], 1))
+
+
+async def _timed(method, sql: str, args, rows_of):
+    if not SQL_PROFILE:
+        return await method(sql, *args)
+    t0 = time.perf_counter()
+    try:
+        result = await method(sql, *args)
+    except Exception:
+        profiler.record(normalize_sql(sql), time.perf_counter() - t0, 0, error=True)
+        raise
+    profiler.record(normalize_sql(sql), time.perf_counter() - t0, rows_of(result), error=False)
+    return result
+
+
+async def fetch(conn, sql: str, *args) -> list:
+    return await _timed(conn.fetch, sql, args, len)
+
+
+async def fetchrow(conn, sql: str, *args):
+    return await _timed(conn.fetchrow, sql, args, lambda r: 0 if r is None else 1)
+
+
+async def fetchval(conn, sql: str, *args):
+    return await _timed(conn.fetchval, sql, args, lambda r: 0 if r is None else 1)
+
+
+async def execute(conn, sql: str, *args) -> str:
+    # status tag, e.g. "INSERT 0 3"
+    return await _timed(conn.execute, sql, args, lambda s: int(s.rsplit(" ", 1)[-1]) if s[-1:].isdigit() else 0)
+
+
+CallbackMetric(
+    "fraud_async_db_pool_connections",
+    "asyncpg pool connections by state.",
+    lambda: None if _pool is None else {
+        ("in_use",): _pool.get_size() - _pool.get_idle_size(),
+        ("idle",): _pool.get_idle_size(),
+        ("max",): ASYNC_DB_POOL_MAX,
+    },
+    labels=("state",),
+)
@@ -0,0 +1,329 @@
+# common/db.py
+import contextvars
+import logging
+import os
+import threading
+import time
+
+import orjson
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+
+from common.metrics import STAGE_LATENCY, DB_ERRORS, POOL_WAITS, POOL_WAIT_LATENCY, CallbackMetric, Counter
+from common.query_profiler import SQL_PROFILE, profiled_cursor_class
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "database": os.getenv("DB_NAME", "frauddb"),
+    "user": os.getenv("DB_USER", "frauduser"),
+    "password": os.getenv("DB_PASSWORD", "fraudpass"),
+    "port": int(os.getenv("DB_PORT", "5432")),
+}
+
+# jsonb columns (review cases, reasons) are parsed with orjson rather than json.loads
+psycopg2.extras.register_default_jsonb(loads=orjson.loads, globally=True)
+
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "10"))
+# an idle connection parked longer than this is pinged before it is handed out
+DB_POOL_PING_IDLE_S = float(os.getenv("DB_POOL_PING_IDLE_S", "30"))
+
+# Optional streaming replica for read-only endpoints; unset DB_REPLICA_HOST = everything on the primary
+DB_REPLICA_CONFIG = {
+    "host": os.getenv("DB_REPLICA_HOST", ""),
+    "database": os.getenv("DB_REPLICA_NAME", DB_CONFIG["database"]),
+    "user": os.getenv("DB_REPLICA_USER", DB_CONFIG["user"]),
+    "password": os.getenv("DB_REPLICA_PASSWORD", DB_CONFIG["password"]),
+    "port": int(os.getenv("DB_REPLICA_PORT", "5432")),
+}
+DB_REPLICA_POOL_MAX = int(os.getenv("DB_REPLICA_POOL_MAX", "20"))
+DB_REPLICA_MAX_LAG_S = float(os.getenv("DB_REPLICA_MAX_LAG_S", "5"))
+DB_REPLICA_LAG_CHECK_S = float(os.getenv("DB_REPLICA_LAG_CHECK_S", "1"))
+
+READS = Counter(
+    "fraud_db_reads_total",
+    "Read-only checkouts by the pool that served them and why.",
+    labels=("pool", "reason"),
+)
+
+log = logging.getLogger("fraud.db")
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+class ProfiledConnection(psycopg2.extensions.connection):
+    """
+    Every cursor (plain, RealDictCursor, named) is wrapped so its statements are
+    timed by common.query_profiler.
+    """
+
+    def cursor(self, *args, **kwargs):
+        if SQL_PROFILE and len(args) < 2:
+            base = kwargs.get("cursor_factory") or self.cursor_factory or psycopg2.extensions.cursor
+            kwargs["cursor_factory"] = profiled_cursor_class(base)
+        return super().cursor(*args, **kwargs)
+
+
+def execute_prepared(cur, name: str, sql: str, args: tuple) -> None:
+    """
+    Run `sql` (written with $1, $2 ... placeholders) as a server-side prepared
+    statement. PREPARE is issued the first time a physical connection sees `name`;
+    pooled connections keep it across checkouts.
+    """
+    conn = cur.connection
+    prepared = conn.__dict__.setdefault("_prepared", set())
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {sql}")
+        prepared.add(name)
+    cur.execute(f"EXECUTE {name}({', '.join(['%s'] * len(args))})", args)
+
+
+def connect(config: dict = None) -> ProfiledConnection:
+    """
+    A dedicated (unpooled) profiled connection, for batch jobs and scripts.
+    """
+    return psycopg2.connect(**(config or DB_CONFIG), connection_factory=ProfiledConnection)
+
+
+class PooledConnection(ProfiledConnection):
+    """
+    A psycopg2 connection whose close() hands it back to its pool, so call sites
+    keep the usual `conn = get_conn() ... finally: conn.close()` shape.
+    """
+
+    _pool = None
+    _checked_out = False
+    _released_at = 0.0
+
+    def close(self):
+        if self._pool is None or self.closed:
+            return super().close()
+        if self._checked_out:
+            self._checked_out = False
+            self._pool._release(self)
+
+    def discard(self):
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Bounded LIFO pool. At most maxconn connections are checked out at once;
+    further checkouts wait up to timeout_s (counted as pool waits) and then fail
+    with PoolTimeout. Idle connections are health-checked on checkout: closed or
+    broken ones are dropped, and ones parked longer than ping_idle_s must answer
+    a SELECT 1 first (a server restart or idle timeout kills them silently).
+    """
+
+    def __init__(self, config: dict, maxconn: int, timeout_s: float, name: str = "primary",
+                 ping_idle_s: float = DB_POOL_PING_IDLE_S):
+        self.name = name
+        self._ping_idle_s = ping_idle_s
+        self._config = config
+        self._maxconn = maxconn
+        self._timeout_s = timeout_s
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = []
+        self._lock = threading.Lock()
+        self.in_use = 0
+
+    def getconn(self) -> PooledConnection:
+        if not self._slots.acquire(blocking=False):
+            POOL_WAITS.inc(pool=self.name)
+            t0 = time.perf_counter()
+            ok = self._slots.acquire(timeout=self._timeout_s)
+            POOL_WAIT_LATENCY.observe(time.perf_counter() - t0, pool=self.name)
+            if not ok:
+                DB_ERRORS.inc(kind="pool_timeout")
+                raise PoolTimeout(f"no free connection in pool '{self.name}' after {self._timeout_s}s")
+        try:
+            conn = None
+            while conn is None:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    conn = self._idle.pop()
+                if not self._healthy(conn):
+                    conn.discard()
+                    conn = None
+            if conn is None:
+                try:
+                    conn = psycopg2.connect(**self._config, connection_factory=PooledConnection)
+                except psycopg2.Error:
+                    DB_ERRORS.inc(kind="connect")
+                    raise
+                conn._pool = self
+            conn._checked_out = True
+            with self._lock:
+                self.in_use += 1
+            return conn
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _healthy(self, conn: PooledConnection) -> bool:
+        if conn.closed:
+            return False
+        if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - conn._released_at < self._ping_idle_s:
+            return True
+        try:
+            # plain cursor: the ping is not a query worth profiling
+            with psycopg2.extensions.cursor(conn) as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            DB_ERRORS.inc(kind="stale_connection")
+            return False
+
+    def _release(self, conn: PooledConnection) -> None:
+        try:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                conn.discard()
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            conn.discard()
+        with self._lock:
+            self.in_use -= 1
+            if not conn.closed:
+                conn._released_at = time.monotonic()
+                self._idle.append(conn)
+        self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"in_use": self.in_use, "idle": len(self._idle), "max": self._maxconn}
+
+
+_primary_pool = ConnectionPool(DB_CONFIG, DB_POOL_MAX, DB_POOL_TIMEOUT_S, name="primary")
+
+
+def get_conn():
+    with STAGE_LATENCY.time(stage="db_connect"):
+        return _primary_pool.getconn()
+
+
+# WAL position a client must see before the replica may serve it (read-your-writes);
+# set per request from the client's cookie by the API
+min_read_lsn = contextvars.ContextVar("min_read_lsn", default=None)
+
+REPLICA_ENABLED = bool(DB_REPLICA_CONFIG["host"])
+
+_replica_pool = (
+    ConnectionPool(DB_REPLICA_CONFIG, DB_REPLICA_POOL_MAX, DB_POOL_TIMEOUT_S, name="replica")
+    if DB_REPLICA_CONFIG["host"] else None
+)
+_replica_lag = {"checked": 0.0, "lag_s": None}
+_replica_lag_lock = threading.Lock()
+
+REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END::float8;
+"""
+
+
+def _replica_lag_s(conn) -> float | None:
+    """
+    Replay lag in seconds, measured at most every DB_REPLICA_LAG_CHECK_S.
+    None means unknown (not a standby, or the check failed): don't use the replica.
+    """
+    now = time.monotonic()
+    with _replica_lag_lock:
+        if now - _replica_lag["checked"] < DB_REPLICA_LAG_CHECK_S:
+            return _replica_lag["lag_s"]
+        _replica_lag["checked"] = now
+    try:
+        with conn.cursor() as cur:
+            cur.execute(REPLICA_LAG_SQL)
+            lag = cur.fetchone()[0]
+        conn.rollback()
+    except psycopg2.Error as exc:
+        DB_ERRORS.inc(kind="replica_lag_check")
+        log.warning("replica lag check failed: %s", exc)
+        lag = None
+    _replica_lag["lag_s"] = lag
+    return lag
+
+
+def _replica_has(conn, lsn: str) -> bool:
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn;", (lsn,))
+            ok = bool(cur.fetchone()[0])
+        conn.rollback()
+        return ok
+    except psycopg2.Error:
+        conn.rollback()
+        return False
+
+
+def get_read_conn():
+    """
+    A connection for read-only work: the replica when one is configured, its replay
+    lag is within DB_REPLICA_MAX_LAG_S and it has replayed the caller's last write
+    (min_read_lsn); otherwise the primary. Release it with close() as usual.
+    """
+    if _replica_pool is None:
+        return get_conn()
+
+    try:
+        with STAGE_LATENCY.time(stage="db_connect"):
+            conn = _replica_pool.getconn()
+    except psycopg2.OperationalError:
+        READS.inc(pool="primary", reason="replica_unavailable")
+        return get_conn()
+
+    lag = _replica_lag_s(conn)
+    if lag is None or lag > DB_REPLICA_MAX_LAG_S:
+        conn.close()
+        READS.inc(pool="primary", reason="replica_lag")
+        return get_conn()
+
+    lsn = min_read_lsn.get()
+    if lsn and not _replica_has(conn, lsn):
+        conn.close()
+        READS.inc(pool="primary", reason="read_your_writes")
+        return get_conn()
+
+    READS.inc(pool="replica", reason="ok")
+    return conn
+
+
+def current_wal_lsn(conn) -> str:
+    """The primary's WAL insert position, e.g. right after committing a write."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_current_wal_lsn()::text;")
+        lsn = cur.fetchone()[0]
+    conn.rollback()
+    return lsn
+
+
+def _pool_stats():
+    out = {}
+    for pool in (_primary_pool, _replica_pool):
+        if pool is not None:
+            out.update({(pool.name, k): v for k, v in pool.stats().items()})
+    return out
+
+
+CallbackMetric(
+    "fraud_db_pool_connections",
+    "Pool connections by state.",
+    _pool_stats,
+    labels=("pool", "state"),
+)
+CallbackMetric(
+    "fraud_db_replica_lag_seconds",
+    "Last measured replica replay lag.",
+    lambda: _replica_lag["lag_s"] if _replica_pool is not None else None,
+)
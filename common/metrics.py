@@ -0,0 +1,178 @@
+# common/metrics.py
+"""
+Minimal in-process Prometheus metrics (text exposition format 0.0.4).
+
+Each metric keeps a dict of label-value tuples guarded by its own lock, so an
+observation is a dict lookup, a bisect and a couple of additions. Values are
+per process; with several uvicorn workers each worker reports its own series.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+_registry = []
+
+
+def _fmt_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+def _fmt_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            items = list(self._values.items())
+        for key, v in items:
+            yield f"{self.name}{_fmt_labels(self.labels, key)} {_fmt_value(v)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(n, "") for n in self.labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                v[i] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def totals(self) -> dict:
+        """{label values: (sum, count)} so far; diff two calls for a windowed mean."""
+        with self._lock:
+            return {k: (v[-2], v[-1]) for k, v in self._values.items()}
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for key, v in items:
+            cumulative = 0
+            for le, n in zip(self.buckets, v):
+                cumulative += n
+                yield f"{self.name}_bucket{_fmt_labels(self.labels, key, [('le', _fmt_value(le))])} {cumulative}"
+            yield f"{self.name}_bucket{_fmt_labels(self.labels, key, [('le', '+Inf')])} {v[-1]}"
+            yield f"{self.name}_sum{_fmt_labels(self.labels, key)} {_fmt_value(v[-2])}"
+            yield f"{self.name}_count{_fmt_labels(self.labels, key)} {v[-1]}"
+
+
+class CallbackMetric:
+    """
+    A gauge or counter whose values are read at scrape time.
+    fn() returns {label-values tuple: value}, or a plain number when there are no labels.
+    """
+
+    def __init__(self, name: str, help: str, fn, kind: str = "gauge", labels=()):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labels = tuple(labels)
+        self._fn = fn
+        _registry.append(self)
+
+    def collect(self):
+        try:
+            values = self._fn()
+        except Exception:
+            return
+        if values is None:
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, v in values.items():
+            yield f"{self.name}{_fmt_labels(self.labels, key)} {_fmt_value(v)}"
+
+
+def render() -> str:
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+# Shared metrics for the scoring path
+
+STAGE_LATENCY = Histogram(
+    "fraud_stage_duration_seconds",
+    "Latency of each scoring pipeline stage.",
+    labels=("stage",),
+)
+REQUEST_LATENCY = Histogram(
+    "fraud_http_request_duration_seconds",
+    "HTTP request latency by route.",
+    labels=("method", "route", "status"),
+)
+DECISIONS = Counter(
+    "fraud_decisions_total",
+    "First decisions persisted per transaction (re-scores and rescoring excluded).",
+    labels=("decision",),
+)
+DB_ERRORS = Counter(
+    "fraud_db_errors_total",
+    "Database errors by kind.",
+    labels=("kind",),
+)
+POOL_WAITS = Counter(
+    "fraud_db_pool_waits_total",
+    "Connection checkouts that had to wait for a free pool slot.",
+    labels=("pool",),
+)
+POOL_WAIT_LATENCY = Histogram(
+    "fraud_db_pool_wait_seconds",
+    "Time spent waiting for a free pool slot (waiting checkouts only).",
+    labels=("pool",),
+)
@@ -0,0 +1,219 @@
+# common/query_profiler.py
+"""
+Per-statement SQL profiling for every psycopg2 cursor created through common.db.
+
+Statements are keyed by a normalized form of their SQL (whitespace collapsed,
+literals and VALUES lists folded), and for each key we keep call count, total /
+max latency, rows and errors. Statements slower than SLOW_QUERY_MS are logged;
+with SLOW_QUERY_EXPLAIN=1, read-only slow statements are re-run once under
+EXPLAIN (ANALYZE, BUFFERS) and the plan is logged and kept with the stats.
+"""
+import atexit
+import logging
+import os
+import re
+import threading
+import time
+
+import psycopg2.extensions
+
+SQL_PROFILE = os.getenv("SQL_PROFILE", "1") == "1"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "0") == "1"
+SLOW_QUERY_EXPLAIN_INTERVAL_S = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL_S", "60"))
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "5000"))
+SQL_PROFILE_MAX_KEYS = int(os.getenv("SQL_PROFILE_MAX_KEYS", "2000"))
+
+log = logging.getLogger("fraud.sql")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.IGNORECASE)
+_VALUES_LIST = re.compile(r"VALUES\s*\(.*?\)(?:\s*,\s*\(.*?\))*", re.IGNORECASE | re.DOTALL)
+_COMMENT = re.compile(r"--[^\n]*")
+_SPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql) -> str:
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    elif not isinstance(sql, str):
+        sql = str(sql)  # psycopg2.sql.Composed
+    sql = _COMMENT.sub(" ", sql)
+    sql = _STRING.sub("?", sql)
+    sql = _VALUES_LIST.sub("VALUES (...)", sql)
+    sql = _NUMBER.sub("?", sql)
+    return _SPACE.sub(" ", sql).strip().rstrip(";")
+
+
+class QueryStats:
+    __slots__ = ("calls", "total_s", "max_s", "rows", "errors", "last_plan", "last_explain")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.rows = 0
+        self.errors = 0
+        self.last_plan = None
+        self.last_explain = 0.0
+
+
+class QueryProfiler:
+    def __init__(self, max_keys: int = SQL_PROFILE_MAX_KEYS):
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._max_keys = max_keys
+        self.dropped = 0
+
+    def record(self, key: str, elapsed_s: float, rows: int, error: bool) -> QueryStats:
+        with self._lock:
+            st = self._stats.get(key)
+            if st is None:
+                if len(self._stats) >= self._max_keys:
+                    self.dropped += 1
+                    return None
+                st = self._stats[key] = QueryStats()
+            st.calls += 1
+            st.total_s += elapsed_s
+            st.max_s = max(st.max_s, elapsed_s)
+            if rows > 0:
+                st.rows += rows
+            if error:
+                st.errors += 1
+            return st
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self.dropped = 0
+
+    def report(self, limit: int = 20, order_by: str = "total") -> list[dict]:
+        sort_keys = {
+            "total": lambda kv: kv[1].total_s,
+            "mean": lambda kv: kv[1].total_s / kv[1].calls,
+            "max": lambda kv: kv[1].max_s,
+            "calls": lambda kv: kv[1].calls,
+            "rows": lambda kv: kv[1].rows,
+        }
+        with self._lock:
+            items = sorted(self._stats.items(), key=sort_keys[order_by], reverse=True)[:limit]
+            return [
+                {
+                    "query": key,
+                    "calls": st.calls,
+                    "total_ms": st.total_s * 1000.0,
+                    "mean_ms": st.total_s * 1000.0 / st.calls,
+                    "max_ms": st.max_s * 1000.0,
+                    "rows": st.rows,
+                    "errors": st.errors,
+                    "plan": st.last_plan,
+                }
+                for key, st in items
+            ]
+
+
+profiler = QueryProfiler()
+
+
+def _is_read_only(key: str) -> bool:
+    head = key.lstrip("( ").split(" ", 1)[0].upper()
+    if head not in ("SELECT", "WITH"):
+        return False
+    upper = key.upper()
+    return not any(w in upper for w in (" INSERT ", " UPDATE ", " DELETE ", " FOR UPDATE"))
+
+
+def _maybe_explain(cursor, query, vars, key: str, st: QueryStats) -> None:
+    now = time.monotonic()
+    if st is None or now - st.last_explain < SLOW_QUERY_EXPLAIN_INTERVAL_S or not _is_read_only(key):
+        return
+    st.last_explain = now
+    conn = cursor.connection
+    # EXPLAIN ANALYZE runs the statement again on the caller's connection: do it in
+    # a savepoint (its own transaction under autocommit) that is always rolled back,
+    # so a failure or timeout can't abort the caller's transaction and the
+    # SET LOCAL timeout ends with it
+    begin, end = (
+        ("BEGIN", "ROLLBACK") if conn.autocommit
+        else ("SAVEPOINT query_profiler_explain", "ROLLBACK TO SAVEPOINT query_profiler_explain")
+    )
+    try:
+        # plain cursor: not profiled, doesn't disturb the caller's result set
+        with psycopg2.extensions.cursor(conn) as ecur:
+            explain = b"EXPLAIN (ANALYZE, BUFFERS) " + cursor.mogrify(query, vars)
+            ecur.execute(begin)
+            try:
+                ecur.execute("SET LOCAL statement_timeout = %s", (SLOW_QUERY_EXPLAIN_TIMEOUT_MS,))
+                ecur.execute(explain)
+                st.last_plan = "\n".join(r[0] for r in ecur.fetchall())
+            finally:
+                ecur.execute(end)
+        log.warning("plan for slow query %s\n%s", key, st.last_plan)
+    except psycopg2.Error as exc:
+        log.info("EXPLAIN failed for %s: %s", key, exc)
+
+
+def _observe(cursor, query, vars, t0: float, error: bool) -> None:
+    elapsed = time.perf_counter() - t0
+    key = normalize_sql(query)
+    st = profiler.record(key, elapsed, cursor.rowcount if not error else 0, error)
+    if elapsed * 1000.0 >= SLOW_QUERY_MS:
+        log.warning("slow query %.1f ms rows=%s: %s", elapsed * 1000.0, cursor.rowcount, key)
+        if SLOW_QUERY_EXPLAIN and not error:
+            _maybe_explain(cursor, query, vars, key, st)
+
+
+class ProfilingCursorMixin:
+    def execute(self, query, vars=None):
+        t0 = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            _observe(self, query, vars, t0, error=True)
+            raise
+        _observe(self, query, vars, t0, error=False)
+        return result
+
+    def executemany(self, query, vars_list):
+        t0 = time.perf_counter()
+        try:
+            result = super().executemany(query, vars_list)
+        except Exception:
+            _observe(self, query, None, t0, error=True)
+            raise
+        _observe(self, query, None, t0, error=False)
+        return result
+
+    def copy_expert(self, sql, file, size=8192):
+        t0 = time.perf_counter()
+        try:
+            result = super().copy_expert(sql, file, size)
+        except Exception:
+            _observe(self, sql, None, t0, error=True)
+            raise
+        _observe(self, sql, None, t0, error=False)
+        return result
+
+
+_profiled_classes = {}
+
+
+def profiled_cursor_class(base):
+    cls = _profiled_classes.get(base)
+    if cls is None:
+        cls = type(f"Profiling{base.__name__}", (ProfilingCursorMixin, base), {})
+        _profiled_classes[base] = cls
+    return cls
+
+
+def print_report(limit: int = 20) -> None:
+    rows = profiler.report(limit=limit)
+    if not rows:
+        return
+    print(f"\n{'calls':>8} {'total_ms':>10} {'mean_ms':>9} {'max_ms':>9} {'rows':>9}  query")
+    for r in rows:
+        print(f"{r['calls']:>8} {r['total_ms']:>10.1f} {r['mean_ms']:>9.2f} {r['max_ms']:>9.2f} {r['rows']:>9}  {r['query'][:120]}")
+
+
+if os.getenv("SQL_PROFILE_REPORT", "0") == "1":
+    atexit.register(print_report)
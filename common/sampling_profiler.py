@@ -0,0 +1,156 @@
+# common/sampling_profiler.py
+"""
+On-demand sampling profiler for a live worker.
+
+While a profile runs, the calling thread wakes every interval, reads every other
+thread's Python stack with sys._current_frames() and counts identical stacks.
+Nothing is installed in the interpreter (no settrace / setprofile hooks), so the
+cost outside a profile is zero, and during one it is a stack walk per thread per
+sample. The time spent sampling is measured and reported as overhead.
+
+Output is collapsed stacks, one line per distinct stack, root first, thread name
+as the root frame:
+
+    MainThread;run (asyncio/base_events.py:...);...;_compute_features (features/realtime_features.py:...) 42
+
+which flamegraph.pl, speedscope and inferno read directly. Time inside C code
+(NumPy, psycopg2, pydantic-core) is attributed to the Python function that made
+the call. Threads parked in a wait (idle pool workers, queue consumers, the
+event loop's select) are left out unless idle stacks are asked for.
+
+Only one profile runs at a time per process, and its length is capped at
+PROFILE_MAX_SECONDS.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_MAX_STACKS = int(os.getenv("PROFILE_MAX_STACKS", "20000"))
+
+# (file name, function) of leaf frames that mean the thread is blocked waiting
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("socket.py", "accept"),
+}
+
+_PATH_PREFIXES = sorted(
+    {os.path.join(p, "") for p in sys.path if p and os.path.isdir(p)} | {os.path.join(os.getcwd(), "")},
+    key=len,
+    reverse=True,
+)
+
+
+class ProfileBusy(Exception):
+    pass
+
+
+def _short_path(filename: str) -> str:
+    for prefix in _PATH_PREFIXES:
+        if filename.startswith(prefix):
+            return filename[len(prefix):]
+    return filename
+
+
+class SamplingProfiler:
+    def __init__(self, max_seconds: float = PROFILE_MAX_SECONDS, max_stacks: int = PROFILE_MAX_STACKS):
+        self._running = threading.Lock()
+        self._labels = {}  # code object -> frame label
+        self._max_seconds = max_seconds
+        self._max_stacks = max_stacks
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            name = getattr(code, "co_qualname", code.co_name)
+            # ';' separates frames in the collapsed format
+            label = f"{name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+            self._labels[code] = label
+        return label
+
+    def _stack(self, frame) -> tuple[tuple, list]:
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        leaf = codes[0]
+        return (os.path.basename(leaf.co_filename), leaf.co_name), codes
+
+    def profile(self, seconds: float, interval_ms: float = 10.0, idle: bool = False,
+                thread: str | None = None) -> dict:
+        """
+        Samples for `seconds` on the calling thread. Raises ProfileBusy when a
+        profile is already running in this process.
+        """
+        if not self._running.acquire(blocking=False):
+            raise ProfileBusy()
+        try:
+            return self._profile(min(seconds, self._max_seconds), interval_ms / 1000.0, idle, thread)
+        finally:
+            self._running.release()
+
+    def _profile(self, seconds: float, interval_s: float, idle: bool, thread: str | None) -> dict:
+        me = threading.get_ident()
+        stacks = Counter()
+        samples = idle_samples = dropped = 0
+        sampling_s = 0.0
+        started = time.perf_counter()
+        deadline = started + seconds
+        next_at = started
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if now < next_at:
+                time.sleep(next_at - now)
+            next_at += interval_s
+
+            t0 = time.perf_counter()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                name = names.get(ident, f"thread-{ident}")
+                if thread is not None and thread not in name:
+                    continue
+                leaf, codes = self._stack(frame)
+                samples += 1
+                if leaf in _IDLE_LEAVES:
+                    idle_samples += 1
+                    if not idle:
+                        continue
+                key = (name, tuple(codes))
+                if key not in stacks and len(stacks) >= self._max_stacks:
+                    dropped += 1
+                    continue
+                stacks[key] += 1
+            frame = None  # don't keep the last thread's frames alive between samples
+            sampling_s += time.perf_counter() - t0
+
+        elapsed = time.perf_counter() - started
+        collapsed = Counter()
+        for (name, codes), count in stacks.items():
+            line = ";".join([name.replace(";", ":")] + [self._label(c) for c in reversed(codes)])
+            collapsed[line] += count
+        return {
+            "duration_s": elapsed,
+            "interval_ms": interval_s * 1000.0,
+            "samples": samples,
+            "idle_samples": idle_samples,
+            "dropped_samples": dropped,
+            # share of one core spent walking stacks, while holding the GIL
+            "overhead_pct": 100.0 * sampling_s / elapsed if elapsed else 0.0,
+            "stacks": collapsed.most_common(),
+        }
+
+
+def collapsed_text(result: dict) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in result["stacks"])
+
+
+profiler = SamplingProfiler()
@@ -40,6 +40,8 @@ export default function App() {
   const [queue, setQueue] = useState([]);
   const [selectedId, setSelectedId] = useState(null);
   const [caseData, setCaseData] = useState(null);
+  // full cases embedded in the queue response, so opening them needs no request
+  const [prefetched, setPrefetched] = useState({});
   const [loadingQueue, setLoadingQueue] = useState(false);
   const [loadingCase, setLoadingCase] = useState(false);
 
@@ -56,8 +58,11 @@ export default function App() {
     setLoadingQueue(true);
     setError("");
     try {
-      const data = await getReviewQueue(100, 0);
+      const data = await getReviewQueue(100, 0, 20);
       setQueue(data);
+      setPrefetched(
+        Object.fromEntries(data.filter((x) => x.case).map((x) => [x.transaction_id, x.case]))
+      );
 
       if (!selectedId && data.length) setSelectedId(data[0].transaction_id);
 
@@ -73,8 +78,12 @@ export default function App() {
     }
   }
 
-  async function loadCase(id) {
+  async function loadCase(id, { fresh = false } = {}) {
     if (!id) return;
+    if (!fresh && prefetched[id]) {
+      setCaseData(prefetched[id]);
+      return;
+    }
     setLoadingCase(true);
     setError("");
     try {
@@ -139,7 +148,7 @@ export default function App() {
       await postReviewAction(selectedId, action, analyst, notes || null);
       setNotes("");
       await refreshQueue();
-      if (selectedId) await loadCase(selectedId);
+      if (selectedId) await loadCase(selectedId, { fresh: true });
     } catch (e) {
       setError(e.message);
     }
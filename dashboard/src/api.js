@@ -2,6 +2,7 @@ const API_BASE = "http://127.0.0.1:8000";
 
 async function req(path, options = {}) {
   const res = await fetch(`${API_BASE}${path}`, {
+    credentials: "include", // read-your-writes cookie after review actions
     headers: { "Content-Type": "application/json", ...(options.headers || {}) },
     ...options,
   });
@@ -20,8 +21,8 @@ async function req(path, options = {}) {
   return data;
 }
 
-export function getReviewQueue(limit = 50, offset = 0) {
-  return req(`/review/queue?limit=${limit}&offset=${offset}`);
+export function getReviewQueue(limit = 50, offset = 0, embed = 0) {
+  return req(`/review/queue?limit=${limit}&offset=${offset}&embed=${embed}`);
 }
 
 export function getReviewCase(transactionId) {
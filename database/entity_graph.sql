@@ -0,0 +1,6 @@
+-- Ring features from the in-memory entity graph (features/entity_graph.py).
+-- NULL when the row was written with ENTITY_GRAPH off.
+
+ALTER TABLE transaction_features
+    ADD COLUMN IF NOT EXISTS ring_size INT,
+    ADD COLUMN IF NOT EXISTS ring_fraud_rate FLOAT;
@@ -71,6 +71,8 @@ CREATE TABLE IF NOT EXISTS risk_assessments (
 );
 
 CREATE INDEX IF NOT EXISTS idx_risk_assessments_created_at ON risk_assessments(created_at);
+-- /review/queue: WHERE decision = 'manual_review' ORDER BY created_at DESC LIMIT n
+CREATE INDEX IF NOT EXISTS idx_risk_assessments_decision_created ON risk_assessments(decision, created_at DESC);
 CREATE TABLE IF NOT EXISTS review_actions (
     id BIGSERIAL PRIMARY KEY,
     transaction_id TEXT NOT NULL REFERENCES transactions(transaction_id),
@@ -0,0 +1,79 @@
+-- Incremental users.home_country maintenance.
+-- Per-(user, country) transaction counts are kept up to date on every insert into
+-- transactions, and home_country (most frequent country, ties -> alphabetical) is
+-- recomputed only for the users touched by that statement.
+--
+-- Concurrent inserts for the same user are serialized on the user's row, which
+-- is locked in user_id order before anything else, so two statements can neither
+-- deadlock nor recompute home_country from counts missing each other's rows.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS user_country_counts (
+    user_id TEXT NOT NULL REFERENCES users(user_id),
+    country TEXT NOT NULL,
+    tx_count BIGINT NOT NULL,
+    PRIMARY KEY (user_id, country)
+);
+
+CREATE OR REPLACE FUNCTION track_user_country_counts() RETURNS trigger AS $$
+BEGIN
+    -- NO KEY UPDATE: conflicts with itself and the UPDATE below, but not with the
+    -- KEY SHARE locks other inserts take for their foreign keys. Each following
+    -- statement takes a fresh snapshot, so it sees counts committed while we waited.
+    PERFORM 1 FROM users
+    WHERE user_id IN (SELECT user_id FROM new_rows WHERE user_id IS NOT NULL AND country IS NOT NULL)
+    ORDER BY user_id
+    FOR NO KEY UPDATE;
+
+    INSERT INTO user_country_counts (user_id, country, tx_count)
+    SELECT user_id, country, COUNT(*)
+    FROM new_rows
+    WHERE user_id IS NOT NULL AND country IS NOT NULL
+    GROUP BY user_id, country
+    ORDER BY user_id, country
+    ON CONFLICT (user_id, country) DO UPDATE
+        SET tx_count = user_country_counts.tx_count + EXCLUDED.tx_count;
+
+    UPDATE users u
+    SET home_country = best.country
+    FROM (
+        SELECT DISTINCT ON (c.user_id) c.user_id, c.country
+        FROM user_country_counts c
+        WHERE c.user_id IN (SELECT DISTINCT user_id FROM new_rows)
+        ORDER BY c.user_id, c.tx_count DESC, c.country
+    ) best
+    WHERE u.user_id = best.user_id
+      AND u.home_country IS DISTINCT FROM best.country;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Backfill under a lock that blocks inserts, so no row is counted twice or missed.
+LOCK TABLE transactions IN SHARE ROW EXCLUSIVE MODE;
+
+DROP TRIGGER IF EXISTS transactions_user_country_counts ON transactions;
+CREATE TRIGGER transactions_user_country_counts
+    AFTER INSERT ON transactions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION track_user_country_counts();
+
+TRUNCATE user_country_counts;
+INSERT INTO user_country_counts (user_id, country, tx_count)
+SELECT user_id, country, COUNT(*)
+FROM transactions
+WHERE user_id IS NOT NULL AND country IS NOT NULL
+GROUP BY user_id, country;
+
+UPDATE users u
+SET home_country = best.country
+FROM (
+    SELECT DISTINCT ON (user_id) user_id, country
+    FROM user_country_counts
+    ORDER BY user_id, tx_count DESC, country
+) best
+WHERE u.user_id = best.user_id
+  AND u.home_country IS DISTINCT FROM best.country;
+
+COMMIT;
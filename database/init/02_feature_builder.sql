@@ -0,0 +1,34 @@
+-- Incremental feature builder: persisted tx_pk high-water mark, an insertion time to
+-- hold back rows the realtime path is still working on, and a NOTIFY so the builder
+-- wakes on new rows.
+
+CREATE TABLE IF NOT EXISTS feature_builder_state (
+    name TEXT PRIMARY KEY,
+    last_tx_pk BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- earlier versions kept a (timestamp, transaction_id) watermark; rows committed late
+-- with an older event timestamp landed behind it, so it restarts from tx_pk 0
+ALTER TABLE feature_builder_state ADD COLUMN IF NOT EXISTS last_tx_pk BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE feature_builder_state DROP COLUMN IF EXISTS last_timestamp,
+    DROP COLUMN IF EXISTS last_transaction_id;
+DROP INDEX IF EXISTS idx_transactions_ts_id;
+
+-- server time of the insert (the event timestamp comes from the client / API)
+ALTER TABLE transactions ADD COLUMN IF NOT EXISTS inserted_at TIMESTAMP NOT NULL DEFAULT NOW();
+-- incremental snapshot exports: transactions inserted since the previous run
+CREATE INDEX IF NOT EXISTS idx_transactions_inserted_at ON transactions(inserted_at);
+
+CREATE OR REPLACE FUNCTION notify_transactions_inserted() RETURNS trigger AS $$
+BEGIN
+    -- identical notifications within one transaction are collapsed by Postgres
+    PERFORM pg_notify('transactions_inserted', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS transactions_notify_inserted ON transactions;
+CREATE TRIGGER transactions_notify_inserted
+    AFTER INSERT ON transactions
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_transactions_inserted();
@@ -0,0 +1,47 @@
+-- Scoring job queue: workers claim batches with FOR UPDATE SKIP LOCKED and wake on
+-- NOTIFY scoring_jobs. A job row is deleted in the same transaction that writes its
+-- assessment; rows that keep failing end up with status 'failed'.
+
+CREATE TABLE IF NOT EXISTS scoring_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    transaction_id TEXT NOT NULL REFERENCES transactions(transaction_id),
+    priority SMALLINT NOT NULL DEFAULT 0,  -- 0 = live traffic, higher = batch rescoring
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'failed')),
+    attempts INT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    enqueued_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+-- the claim query: WHERE status = 'queued' ORDER BY priority, id
+CREATE INDEX IF NOT EXISTS idx_scoring_jobs_claim ON scoring_jobs(priority, id) WHERE status = 'queued';
+
+-- one row per worker process, updated with each batch it commits
+CREATE TABLE IF NOT EXISTS scoring_workers (
+    worker_id TEXT PRIMARY KEY,
+    started_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    heartbeat_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    batches BIGINT NOT NULL DEFAULT 0,
+    jobs_done BIGINT NOT NULL DEFAULT 0,
+    jobs_failed BIGINT NOT NULL DEFAULT 0,
+    last_batch_jobs_per_s FLOAT,
+    last_lag_s FLOAT
+);
+
+-- first decisions committed by the worker (exported by the API as
+-- fraud_scoring_worker_decisions_total); kept across worker restarts
+ALTER TABLE scoring_workers
+    ADD COLUMN IF NOT EXISTS decisions_approve BIGINT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS decisions_manual_review BIGINT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS decisions_block BIGINT NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION notify_scoring_jobs() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('scoring_jobs', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS scoring_jobs_notify ON scoring_jobs;
+CREATE TRIGGER scoring_jobs_notify
+    AFTER INSERT ON scoring_jobs
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_scoring_jobs();
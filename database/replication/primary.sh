@@ -0,0 +1,10 @@
+#!/bin/bash
+# Runs once on the primary's first start (docker-entrypoint-initdb.d):
+# a replication role and a pg_hba rule for the standby.
+set -e
+
+psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB" <<-SQL
+    CREATE ROLE replicator WITH REPLICATION LOGIN PASSWORD '${REPLICATION_PASSWORD:-replpass}';
+SQL
+
+echo "host replication replicator all scram-sha-256" >> "$PGDATA/pg_hba.conf"
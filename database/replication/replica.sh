@@ -0,0 +1,14 @@
+#!/bin/bash
+# Standby entrypoint: clone the primary with pg_basebackup on first start
+# (-R writes standby.signal + primary_conninfo), then run as a hot standby.
+set -e
+
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    until pg_basebackup -h "$PRIMARY_HOST" -U replicator -D "$PGDATA" -R -X stream -P; do
+        echo "waiting for primary..."
+        sleep 2
+    done
+    chmod 700 "$PGDATA"
+fi
+
+exec postgres -c hot_standby=on
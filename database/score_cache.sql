@@ -0,0 +1,27 @@
+-- Cross-process score cache invalidation (models/score_cache.py). Any change to an
+-- existing assessment (a review decision, a rescore by a scoring worker, a replayed
+-- write) notifies every API process, which drops its cached copy. Inserts need no
+-- notification: no process can hold an entry for a row that did not exist.
+
+CREATE OR REPLACE FUNCTION notify_score_cache_invalidate() RETURNS trigger AS $$
+DECLARE
+    ids TEXT;
+BEGIN
+    -- NOTIFY payloads are capped at 8000 bytes; 100 ids per notification stay well under
+    FOR ids IN
+        SELECT string_agg(transaction_id, ',')
+        FROM (SELECT transaction_id, (row_number() OVER () - 1) / 100 AS chunk FROM changed) c
+        GROUP BY chunk
+    LOOP
+        PERFORM pg_notify('score_cache_invalidate', ids);
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- also fires for INSERT ... ON CONFLICT DO UPDATE, with only the updated rows in `changed`
+DROP TRIGGER IF EXISTS risk_assessments_notify_changed ON risk_assessments;
+CREATE TRIGGER risk_assessments_notify_changed
+    AFTER UPDATE ON risk_assessments
+    REFERENCING NEW TABLE AS changed
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_score_cache_invalidate();
@@ -0,0 +1,25 @@
+-- Challenger scores from shadow scoring (models/shadow.py).
+-- One narrow row per (transaction, challenger): the champion's risk score at the
+-- time, the challenger's score and probability. Models are interned in
+-- shadow_models so each row carries a SMALLINT instead of a name and version.
+
+CREATE TABLE IF NOT EXISTS shadow_models (
+    id SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    registered_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    UNIQUE (name, version)
+);
+
+CREATE TABLE IF NOT EXISTS shadow_scores (
+    tx_pk BIGINT NOT NULL REFERENCES transactions(tx_pk),
+    model_id SMALLINT NOT NULL REFERENCES shadow_models(id),
+    champion_score SMALLINT NOT NULL,
+    challenger_score SMALLINT NOT NULL,
+    challenger_prob REAL NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (tx_pk, model_id)
+);
+
+-- the report reads recent rows per model
+CREATE INDEX IF NOT EXISTS idx_shadow_scores_model_created ON shadow_scores(model_id, created_at);
@@ -0,0 +1,186 @@
+-- BIGINT surrogate keys.
+-- users/cards/devices/transactions get an identity primary key; the external TEXT
+-- ids stay as UNIQUE lookup columns. transaction_features, risk_assessments,
+-- review_actions and scoring_jobs reference transactions by tx_pk, and transactions
+-- references its entities by user_pk/card_pk/device_pk.
+--
+-- The application's writers fill the surrogate keys themselves, resolved once per
+-- statement: transactions join users/cards/devices on the way in and return tx_pk,
+-- and child rows take tx_pk from that RETURNING or from one join on transaction_id.
+-- The BEFORE INSERT triggers only fire for rows that arrive without keys (psql,
+-- ad-hoc loads, or an unknown id that left the key NULL); they resolve the key or
+-- raise foreign_key_violation, as the old foreign keys did. ON CONFLICT targets
+-- move to tx_pk.
+--
+-- The TEXT ids stay on every table. They are the external identifiers: the API,
+-- the spill and dead-letter files, the columnar snapshots and the review UI all
+-- address rows by transaction_id, and the child tables' copies let /features,
+-- /assessment and review lookups by id hit one index without a join to
+-- transactions. They are written in the same statement as tx_pk and never updated.
+--
+-- The key migration runs once (psql \if) and holds ACCESS EXCLUSIVE locks on all
+-- tables while it rewrites them; the triggers at the end are (re)created on every run.
+
+SELECT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'transactions' AND column_name = 'tx_pk'
+) AS surrogate_keys_applied \gset
+
+\if :surrogate_keys_applied
+\echo 'surrogate keys already applied'
+\else
+
+BEGIN;
+
+LOCK TABLE users, cards, devices, transactions,
+           transaction_features, risk_assessments, review_actions, scoring_jobs
+    IN ACCESS EXCLUSIVE MODE;
+
+-- keys
+ALTER TABLE users ADD COLUMN user_pk BIGINT GENERATED BY DEFAULT AS IDENTITY;
+ALTER TABLE cards ADD COLUMN card_pk BIGINT GENERATED BY DEFAULT AS IDENTITY;
+ALTER TABLE devices ADD COLUMN device_pk BIGINT GENERATED BY DEFAULT AS IDENTITY;
+ALTER TABLE transactions
+    ADD COLUMN tx_pk BIGINT GENERATED BY DEFAULT AS IDENTITY,
+    ADD COLUMN user_pk BIGINT,
+    ADD COLUMN card_pk BIGINT,
+    ADD COLUMN device_pk BIGINT;
+
+-- text primary keys become unique lookup columns
+ALTER TABLE cards DROP CONSTRAINT IF EXISTS cards_user_id_fkey;
+ALTER TABLE user_country_counts DROP CONSTRAINT IF EXISTS user_country_counts_user_id_fkey;
+ALTER TABLE transactions
+    DROP CONSTRAINT IF EXISTS transactions_user_id_fkey,
+    DROP CONSTRAINT IF EXISTS transactions_card_id_fkey,
+    DROP CONSTRAINT IF EXISTS transactions_device_id_fkey;
+ALTER TABLE transaction_features DROP CONSTRAINT IF EXISTS transaction_features_transaction_id_fkey;
+ALTER TABLE risk_assessments DROP CONSTRAINT IF EXISTS risk_assessments_transaction_id_fkey;
+ALTER TABLE review_actions DROP CONSTRAINT IF EXISTS review_actions_transaction_id_fkey;
+ALTER TABLE scoring_jobs DROP CONSTRAINT IF EXISTS scoring_jobs_transaction_id_fkey;
+
+ALTER TABLE users DROP CONSTRAINT users_pkey,
+    ADD PRIMARY KEY (user_pk), ADD CONSTRAINT users_user_id_key UNIQUE (user_id);
+ALTER TABLE cards DROP CONSTRAINT cards_pkey,
+    ADD PRIMARY KEY (card_pk), ADD CONSTRAINT cards_card_id_key UNIQUE (card_id);
+ALTER TABLE devices DROP CONSTRAINT devices_pkey,
+    ADD PRIMARY KEY (device_pk), ADD CONSTRAINT devices_device_id_key UNIQUE (device_id);
+ALTER TABLE transactions DROP CONSTRAINT transactions_pkey,
+    ADD PRIMARY KEY (tx_pk), ADD CONSTRAINT transactions_transaction_id_key UNIQUE (transaction_id);
+
+ALTER TABLE cards ADD FOREIGN KEY (user_id) REFERENCES users(user_id);
+ALTER TABLE user_country_counts ADD FOREIGN KEY (user_id) REFERENCES users(user_id);
+
+-- transactions -> entities
+UPDATE transactions t SET
+    user_pk = (SELECT u.user_pk FROM users u WHERE u.user_id = t.user_id),
+    card_pk = (SELECT c.card_pk FROM cards c WHERE c.card_id = t.card_id),
+    device_pk = (SELECT d.device_pk FROM devices d WHERE d.device_id = t.device_id);
+
+ALTER TABLE transactions
+    ADD FOREIGN KEY (user_pk) REFERENCES users(user_pk),
+    ADD FOREIGN KEY (card_pk) REFERENCES cards(card_pk),
+    ADD FOREIGN KEY (device_pk) REFERENCES devices(device_pk);
+
+DROP INDEX IF EXISTS idx_transactions_user;
+DROP INDEX IF EXISTS idx_transactions_card;
+-- velocity windows and user averages: WHERE user_pk = ? AND timestamp ...
+CREATE INDEX idx_transactions_user_pk_ts ON transactions(user_pk, timestamp);
+CREATE INDEX idx_transactions_card_pk ON transactions(card_pk);
+-- device reuse: COUNT(DISTINCT user_pk) WHERE device_pk = ?, index-only
+CREATE INDEX idx_transactions_device_pk_user ON transactions(device_pk, user_pk);
+
+-- child tables -> transactions
+ALTER TABLE transaction_features ADD COLUMN tx_pk BIGINT;
+UPDATE transaction_features f SET tx_pk = t.tx_pk FROM transactions t WHERE t.transaction_id = f.transaction_id;
+ALTER TABLE transaction_features DROP CONSTRAINT transaction_features_pkey,
+    ADD PRIMARY KEY (tx_pk), ADD FOREIGN KEY (tx_pk) REFERENCES transactions(tx_pk);
+
+ALTER TABLE risk_assessments ADD COLUMN tx_pk BIGINT;
+UPDATE risk_assessments r SET tx_pk = t.tx_pk FROM transactions t WHERE t.transaction_id = r.transaction_id;
+ALTER TABLE risk_assessments DROP CONSTRAINT risk_assessments_pkey,
+    ADD PRIMARY KEY (tx_pk), ADD FOREIGN KEY (tx_pk) REFERENCES transactions(tx_pk);
+
+ALTER TABLE review_actions ADD COLUMN tx_pk BIGINT;
+UPDATE review_actions a SET tx_pk = t.tx_pk FROM transactions t WHERE t.transaction_id = a.transaction_id;
+ALTER TABLE review_actions ALTER COLUMN tx_pk SET NOT NULL,
+    ADD FOREIGN KEY (tx_pk) REFERENCES transactions(tx_pk);
+DROP INDEX IF EXISTS idx_review_actions_tx;
+CREATE INDEX idx_review_actions_tx_pk ON review_actions(tx_pk);
+
+ALTER TABLE scoring_jobs ADD COLUMN tx_pk BIGINT;
+UPDATE scoring_jobs j SET tx_pk = t.tx_pk FROM transactions t WHERE t.transaction_id = j.transaction_id;
+ALTER TABLE scoring_jobs ALTER COLUMN tx_pk SET NOT NULL,
+    ADD FOREIGN KEY (tx_pk) REFERENCES transactions(tx_pk);
+
+-- writers insert external ids; resolve the keys on the way in
+CREATE OR REPLACE FUNCTION transactions_fill_entity_keys() RETURNS trigger AS $$
+BEGIN
+    IF NEW.user_pk IS NULL AND NEW.user_id IS NOT NULL THEN
+        SELECT user_pk INTO NEW.user_pk FROM users WHERE user_id = NEW.user_id;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'user % does not exist', NEW.user_id USING ERRCODE = 'foreign_key_violation';
+        END IF;
+    END IF;
+    IF NEW.card_pk IS NULL AND NEW.card_id IS NOT NULL THEN
+        SELECT card_pk INTO NEW.card_pk FROM cards WHERE card_id = NEW.card_id;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'card % does not exist', NEW.card_id USING ERRCODE = 'foreign_key_violation';
+        END IF;
+    END IF;
+    IF NEW.device_pk IS NULL AND NEW.device_id IS NOT NULL THEN
+        SELECT device_pk INTO NEW.device_pk FROM devices WHERE device_id = NEW.device_id;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'device % does not exist', NEW.device_id USING ERRCODE = 'foreign_key_violation';
+        END IF;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION fill_tx_pk() RETURNS trigger AS $$
+BEGIN
+    IF NEW.tx_pk IS NULL THEN
+        SELECT tx_pk INTO NEW.tx_pk FROM transactions WHERE transaction_id = NEW.transaction_id;
+        IF NOT FOUND THEN
+            RAISE EXCEPTION 'transaction % does not exist', NEW.transaction_id
+                USING ERRCODE = 'foreign_key_violation';
+        END IF;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
+
+ANALYZE users, cards, devices, transactions, transaction_features, risk_assessments, review_actions, scoring_jobs;
+
+\endif
+
+-- Fallback key resolution. The WHEN clause keeps the function from being called at
+-- all for rows whose writer already supplied the keys.
+BEGIN;
+
+DROP TRIGGER IF EXISTS transactions_fill_entity_keys ON transactions;
+CREATE TRIGGER transactions_fill_entity_keys
+    BEFORE INSERT ON transactions
+    FOR EACH ROW
+    WHEN ((NEW.user_pk IS NULL AND NEW.user_id IS NOT NULL)
+          OR (NEW.card_pk IS NULL AND NEW.card_id IS NOT NULL)
+          OR (NEW.device_pk IS NULL AND NEW.device_id IS NOT NULL))
+    EXECUTE FUNCTION transactions_fill_entity_keys();
+
+DROP TRIGGER IF EXISTS transaction_features_fill_tx_pk ON transaction_features;
+CREATE TRIGGER transaction_features_fill_tx_pk BEFORE INSERT ON transaction_features
+    FOR EACH ROW WHEN (NEW.tx_pk IS NULL) EXECUTE FUNCTION fill_tx_pk();
+DROP TRIGGER IF EXISTS risk_assessments_fill_tx_pk ON risk_assessments;
+CREATE TRIGGER risk_assessments_fill_tx_pk BEFORE INSERT ON risk_assessments
+    FOR EACH ROW WHEN (NEW.tx_pk IS NULL) EXECUTE FUNCTION fill_tx_pk();
+DROP TRIGGER IF EXISTS review_actions_fill_tx_pk ON review_actions;
+CREATE TRIGGER review_actions_fill_tx_pk BEFORE INSERT ON review_actions
+    FOR EACH ROW WHEN (NEW.tx_pk IS NULL) EXECUTE FUNCTION fill_tx_pk();
+DROP TRIGGER IF EXISTS scoring_jobs_fill_tx_pk ON scoring_jobs;
+CREATE TRIGGER scoring_jobs_fill_tx_pk BEFORE INSERT ON scoring_jobs
+    FOR EACH ROW WHEN (NEW.tx_pk IS NULL) EXECUTE FUNCTION fill_tx_pk();
+
+COMMIT;
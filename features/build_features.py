@@ -4,22 +4,24 @@ from __future__ import annotations
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
+import argparse
+import os
+import select
+import time
 
-import psycopg2
+import psycopg2.extensions
 from psycopg2.extras import RealDictCursor
 
+from common.db import connect
+from features.realtime_features import compute_and_upsert_in_transaction
 
-DB_CONFIG = {
-    "host": "localhost",
-    "database": "frauddb",
-    "user": "frauduser",
-    "password": "fraudpass",
-    "port": 5432,
-}
+
+# identity values commit out of order; re-check this many ids behind the watermark
+FEATURE_BUILDER_OVERLAP = int(os.getenv("FEATURE_BUILDER_OVERLAP", "10000"))
 
 
 def get_conn():
-    return psycopg2.connect(**DB_CONFIG)
+    return connect()
 
 
 def ensure_user_home_country(conn):
@@ -27,8 +29,17 @@ def ensure_user_home_country(conn):
     Earlier ingestion used an approximation for users.home_country.
     Now we correct it properly: set home_country = most frequent transaction country per user.
     This makes 'foreign country' feature meaningful.
+
+    With database/home_country.sql applied, a trigger on transactions keeps
+    per-(user, country) counts and home_country current on every insert, so there
+    is nothing to do here. Without it, fall back to the full recomputation.
     """
     with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('user_country_counts') IS NOT NULL;")
+        if cur.fetchone()[0]:
+            conn.rollback()
+            return
+
         cur.execute("""
             UPDATE users u
             SET home_country = sub.country
@@ -36,13 +47,14 @@ def ensure_user_home_country(conn):
                 SELECT user_id, country
                 FROM (
                     SELECT user_id, country,
-                           ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY COUNT(*) DESC) AS rn
+                           ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY COUNT(*) DESC, country) AS rn
                     FROM transactions
                     GROUP BY user_id, country
                 ) ranked
                 WHERE rn = 1
             ) sub
-            WHERE u.user_id = sub.user_id;
+            WHERE u.user_id = sub.user_id
+              AND u.home_country IS DISTINCT FROM sub.country;
         """)
     conn.commit()
 
@@ -51,11 +63,11 @@ def fetch_transactions_missing_features(conn, limit: int = 2000) -> List[Dict[st
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute(
             """
-            SELECT t.transaction_id, t.user_id, t.device_id, t.merchant, t.merchant_category,
+            SELECT t.tx_pk, t.transaction_id, t.user_pk, t.device_pk, t.merchant, t.merchant_category,
                    t.amount, t.country, t.timestamp
             FROM transactions t
-            LEFT JOIN transaction_features f ON f.transaction_id = t.transaction_id
-            WHERE f.transaction_id IS NULL
+            LEFT JOIN transaction_features f ON f.tx_pk = t.tx_pk
+            WHERE f.tx_pk IS NULL
             ORDER BY t.timestamp ASC
             LIMIT %s;
             """,
@@ -66,26 +78,26 @@ def fetch_transactions_missing_features(conn, limit: int = 2000) -> List[Dict[st
 
 def compute_velocity_counts(conn, transaction_id: str) -> Dict[str, int]:
     """
-    Compute velocity based on the transaction's timestamp and user_id.
+    Compute velocity based on the transaction's timestamp and user.
     We'll do this in one SQL call for realism.
     """
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute(
             """
             WITH base AS (
-              SELECT user_id, timestamp
+              SELECT user_pk, timestamp
               FROM transactions
               WHERE transaction_id = %s
             )
             SELECT
               (SELECT COUNT(*)::int FROM transactions t, base b
-               WHERE t.user_id = b.user_id AND t.timestamp >= b.timestamp - INTERVAL '5 minutes'
+               WHERE t.user_pk = b.user_pk AND t.timestamp >= b.timestamp - INTERVAL '5 minutes'
                  AND t.timestamp <= b.timestamp) AS tx_count_5m,
               (SELECT COUNT(*)::int FROM transactions t, base b
-               WHERE t.user_id = b.user_id AND t.timestamp >= b.timestamp - INTERVAL '1 hour'
+               WHERE t.user_pk = b.user_pk AND t.timestamp >= b.timestamp - INTERVAL '1 hour'
                  AND t.timestamp <= b.timestamp) AS tx_count_1h,
               (SELECT COUNT(*)::int FROM transactions t, base b
-               WHERE t.user_id = b.user_id AND t.timestamp >= b.timestamp - INTERVAL '24 hours'
+               WHERE t.user_pk = b.user_pk AND t.timestamp >= b.timestamp - INTERVAL '24 hours'
                  AND t.timestamp <= b.timestamp) AS tx_count_24h;
             """,
             (transaction_id,),
@@ -93,28 +105,28 @@ def compute_velocity_counts(conn, transaction_id: str) -> Dict[str, int]:
         return cur.fetchone()
 
 
-def compute_user_avg_amount(conn, user_id: str, up_to_ts: datetime) -> float:
+def compute_user_avg_amount(conn, user_pk: int, up_to_ts: datetime) -> float:
     with conn.cursor() as cur:
         cur.execute(
             """
             SELECT COALESCE(AVG(amount), 0)::float
             FROM transactions
-            WHERE user_id = %s AND timestamp <= %s;
+            WHERE user_pk = %s AND timestamp <= %s;
             """,
-            (user_id, up_to_ts),
+            (user_pk, up_to_ts),
         )
         return float(cur.fetchone()[0])
 
 
-def compute_device_user_count(conn, device_id: str) -> int:
+def compute_device_user_count(conn, device_pk: int) -> int:
     with conn.cursor() as cur:
         cur.execute(
             """
-            SELECT COUNT(DISTINCT user_id)::int
+            SELECT COUNT(DISTINCT user_pk)::int
             FROM transactions
-            WHERE device_id = %s;
+            WHERE device_pk = %s;
             """,
-            (device_id,),
+            (device_pk,),
         )
         return int(cur.fetchone()[0])
 
@@ -151,27 +163,27 @@ def compute_category_fraud_rate(conn, category: str) -> float:
         return float(cur.fetchone()[0])
 
 
-def compute_is_foreign(conn, user_id: str, tx_country: str) -> bool:
+def compute_is_foreign(conn, user_pk: int, tx_country: str) -> bool:
     with conn.cursor() as cur:
-        cur.execute("SELECT home_country FROM users WHERE user_id = %s;", (user_id,))
+        cur.execute("SELECT home_country FROM users WHERE user_pk = %s;", (user_pk,))
         row = cur.fetchone()
         home = row[0] if row else None
     return (home is not None) and (tx_country != home)
 
 
-def upsert_features(conn, transaction_id: str, feats: Dict[str, Any]) -> None:
+def upsert_features(conn, tx_pk: int, transaction_id: str, feats: Dict[str, Any]) -> None:
     with conn.cursor() as cur:
         cur.execute(
             """
             INSERT INTO transaction_features (
-                transaction_id,
+                tx_pk, transaction_id,
                 tx_count_5m, tx_count_1h, tx_count_24h,
                 user_avg_amount, amount_vs_user_avg,
                 is_foreign_country, device_user_count,
                 merchant_fraud_rate, category_fraud_rate
             )
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-            ON CONFLICT (transaction_id) DO UPDATE SET
+            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+            ON CONFLICT (tx_pk) DO UPDATE SET
                 tx_count_5m = EXCLUDED.tx_count_5m,
                 tx_count_1h = EXCLUDED.tx_count_1h,
                 tx_count_24h = EXCLUDED.tx_count_24h,
@@ -184,6 +196,7 @@ def upsert_features(conn, transaction_id: str, feats: Dict[str, Any]) -> None:
                 created_at = NOW();
             """,
             (
+                tx_pk,
                 transaction_id,
                 feats["tx_count_5m"],
                 feats["tx_count_1h"],
@@ -211,8 +224,8 @@ def build_features_batch(limit: int = 2000) -> int:
 
         for r in rows:
             tx_id = r["transaction_id"]
-            user_id = r["user_id"]
-            device_id = r["device_id"]
+            user_pk = r["user_pk"]
+            device_pk = r["device_pk"]
             merchant = r["merchant"]
             category = r["merchant_category"]
             amount = float(r["amount"])
@@ -220,10 +233,10 @@ def build_features_batch(limit: int = 2000) -> int:
             ts = r["timestamp"]
 
             velocity = compute_velocity_counts(conn, tx_id)
-            user_avg = compute_user_avg_amount(conn, user_id, ts)
+            user_avg = compute_user_avg_amount(conn, user_pk, ts)
             amount_vs_avg = amount / user_avg if user_avg > 0 else 0.0
-            is_foreign = compute_is_foreign(conn, user_id, country)
-            device_users = compute_device_user_count(conn, device_id)
+            is_foreign = compute_is_foreign(conn, user_pk, country)
+            device_users = compute_device_user_count(conn, device_pk)
             merch_rate = compute_merchant_fraud_rate(conn, merchant)
             cat_rate = compute_category_fraud_rate(conn, category)
 
@@ -237,7 +250,7 @@ def build_features_batch(limit: int = 2000) -> int:
                 "category_fraud_rate": cat_rate,
             }
 
-            upsert_features(conn, tx_id, feats)
+            upsert_features(conn, r["tx_pk"], tx_id, feats)
 
         print(f"Built features for {len(rows)} transactions.")
         return len(rows)
@@ -246,5 +259,127 @@ def build_features_batch(limit: int = 2000) -> int:
         conn.close()
 
 
+def build_features_incremental(
+    conn, chunk_size: int = 1000, name: str = "default", grace_s: float = 5.0,
+    overlap: int = FEATURE_BUILDER_OVERLAP,
+) -> tuple[int, int, bool]:
+    """
+    Process the next chunk of transactions past the persisted tx_pk high-water
+    mark, in one transaction: features for rows that don't have them yet (the
+    realtime path usually got there first) plus the watermark advance.
+
+    tx_pk is allocated at insert time, so a row whose event timestamp is old
+    (partner batches, overload-deferred writes) still lands past the watermark.
+    Identity values can commit out of order, so the `overlap` ids behind the
+    watermark are re-checked for rows still missing features. Rows inserted less
+    than grace_s ago (inserted_at, server time) without features are left to the
+    realtime path: the watermark stops in front of the first one and the caller
+    comes back after grace_s.
+
+    Cost depends on the chunk and the overlap, not on table size: both are
+    primary-key range scans with a primary-key probe per row for features.
+
+    Returns (rows the watermark moved past, rows that needed features,
+    whether fresh rows are waiting).
+    """
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            INSERT INTO feature_builder_state (name) VALUES (%s)
+            ON CONFLICT (name) DO NOTHING;
+        """, (name,))
+        # serializes concurrent builders sharing a watermark
+        cur.execute("SELECT last_tx_pk FROM feature_builder_state WHERE name = %s FOR UPDATE;", (name,))
+        last_tx_pk = cur.fetchone()["last_tx_pk"]
+
+        # committed late, behind the watermark
+        cur.execute("""
+            SELECT t.transaction_id
+            FROM transactions t
+            WHERE t.tx_pk > %s AND t.tx_pk <= %s
+              AND t.inserted_at < NOW() - make_interval(secs => %s)
+              AND NOT EXISTS (SELECT 1 FROM transaction_features f WHERE f.tx_pk = t.tx_pk)
+            ORDER BY t.tx_pk;
+        """, (last_tx_pk - overlap, last_tx_pk, grace_s))
+        missing = [r["transaction_id"] for r in cur.fetchall()]
+
+        cur.execute("""
+            SELECT t.tx_pk, t.transaction_id,
+                   t.inserted_at >= NOW() - make_interval(secs => %s) AS fresh,
+                   EXISTS (
+                       SELECT 1 FROM transaction_features f WHERE f.tx_pk = t.tx_pk
+                   ) AS has_features
+            FROM transactions t
+            WHERE t.tx_pk > %s
+            ORDER BY t.tx_pk
+            LIMIT %s;
+        """, (grace_s, last_tx_pk, chunk_size))
+        rows = cur.fetchall()
+
+        advanced, pending = 0, False
+        for r in rows:
+            if not r["has_features"]:
+                if r["fresh"]:
+                    pending = True
+                    break
+                missing.append(r["transaction_id"])
+            last_tx_pk = r["tx_pk"]
+            advanced += 1
+
+        if missing:
+            compute_and_upsert_in_transaction(cur, missing)
+        if advanced:
+            cur.execute("""
+                UPDATE feature_builder_state
+                SET last_tx_pk = %s, updated_at = NOW()
+                WHERE name = %s;
+            """, (last_tx_pk, name))
+    conn.commit()
+    return advanced, len(missing), pending
+
+
+def follow(chunk_size: int = 1000, poll_s: float = 30.0, name: str = "default", grace_s: float = 5.0) -> None:
+    """
+    Run forever: drain everything past the watermark, then sleep until a
+    'transactions_inserted' NOTIFY arrives (or poll_s passes). When fresh rows
+    were held back for the realtime path, look again after grace_s.
+    """
+    conn = get_conn()
+    listener = get_conn()
+    listener.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        with listener.cursor() as cur:
+            cur.execute("LISTEN transactions_inserted;")
+
+        while True:
+            t0 = time.perf_counter()
+            total = 0
+            while True:
+                scanned, built, pending = build_features_incremental(
+                    conn, chunk_size=chunk_size, name=name, grace_s=grace_s,
+                )
+                total += built
+                if scanned < chunk_size:
+                    break  # caught up with the watermark
+            if total:
+                print(f"Built features for {total} transactions in {time.perf_counter() - t0:.2f}s.")
+
+            if select.select([listener], [], [], grace_s if pending else poll_s) != ([], [], []):
+                listener.poll()
+                listener.notifies.clear()
+    finally:
+        conn.close()
+        listener.close()
+
+
 if __name__ == "__main__":
-    build_features_batch(limit=5000)
+    parser = argparse.ArgumentParser(description="Build transaction features.")
+    parser.add_argument("--follow", action="store_true",
+                        help="run continuously from the persisted watermark, waking on LISTEN/NOTIFY")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--poll", type=float, default=30.0, help="seconds between polls without a NOTIFY")
+    args = parser.parse_args()
+
+    if args.follow:
+        follow(chunk_size=args.chunk_size, poll_s=args.poll)
+    else:
+        build_features_batch(limit=5000)
@@ -0,0 +1,342 @@
+# features/entity_graph.py
+"""
+In-memory union-find over user-device and user-card edges: the connected
+component of a user is their "ring" of accounts linked through shared devices
+and cards, however many hops away.
+
+  ring_size        distinct users in the transaction's user's component
+  ring_fraud_rate  share of those users with a fraud-labelled transaction
+
+Union by size plus path halving keep find() at O(α(n)). Both features are
+monotone in the set of edges and labels seen, so replaying a transaction or a
+label twice changes nothing. Identity values commit out of order, so the
+catch-up keeps the ids it skipped past the watermark as gaps (at most
+ENTITY_GRAPH_GAP_SLOTS, for ENTITY_GRAPH_GAP_TTL_S) and re-reads just those.
+
+Each process builds (or loads) its own graph on first use, adds the edges of
+every transaction it computes features for, and polls transactions and review
+rejections past its watermark every ENTITY_GRAPH_REFRESH_S. The snapshot makes
+restarts a file load plus a short catch-up:
+
+    python -m features.entity_graph rebuild    # full build from transactions, writes the snapshot
+    python -m features.entity_graph show USER_ID
+"""
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+from array import array
+
+from common.metrics import Counter, CallbackMetric
+from features.online_store import advance_watermark
+
+ENTITY_GRAPH = os.getenv("ENTITY_GRAPH", "0") == "1"
+ENTITY_GRAPH_SNAPSHOT = os.getenv("ENTITY_GRAPH_SNAPSHOT", "data/entity_graph.pkl")
+ENTITY_GRAPH_REFRESH_S = float(os.getenv("ENTITY_GRAPH_REFRESH_S", "2"))
+ENTITY_GRAPH_GAP_SLOTS = int(os.getenv("ENTITY_GRAPH_GAP_SLOTS", "4096"))
+ENTITY_GRAPH_GAP_TTL_S = float(os.getenv("ENTITY_GRAPH_GAP_TTL_S", "60"))
+
+RING_FEATURE_COLUMNS = ("ring_size", "ring_fraud_rate")
+SNAPSHOT_VERSION = 2
+
+log = logging.getLogger("fraud.entity_graph")
+
+REFRESHES = Counter(
+    "fraud_entity_graph_refresh_rows_total",
+    "Rows replayed into the entity graph by kind (transaction, label).",
+    labels=("kind",),
+)
+
+GAPS_DROPPED = Counter(
+    "fraud_entity_graph_gaps_dropped_total",
+    "Skipped ids no longer re-read by the entity graph catch-up, by reason (expired, overflow).",
+    labels=("reason",),
+)
+
+
+class EntityGraph:
+    def __init__(self):
+        self._index = {}            # "u:<user_id>" / "d:<device_id>" / "c:<card_id>" -> node
+        self._keys = []
+        self._parent = array("q")
+        self._size = array("q")     # nodes in the component (valid at roots)
+        self._users = array("q")    # user nodes in the component (valid at roots)
+        self._fraud = array("q")    # flagged user nodes in the component (valid at roots)
+        self._flagged = bytearray() # per node: user has a fraud label
+        self._lock = threading.RLock()
+        self.tx_watermark = 0       # highest transactions.tx_pk replayed
+        self.label_watermark = 0    # highest review_actions.id replayed
+        self.tx_gaps = {}           # tx_pk skipped past the watermark -> first missed (us)
+        self.label_gaps = {}        # review_actions.id skipped past the watermark -> first missed (us)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    # ---------- union-find ----------
+
+    def _node(self, key: str, is_user: bool) -> int:
+        node = self._index.get(key)
+        if node is None:
+            node = len(self._keys)
+            self._index[key] = node
+            self._keys.append(key)
+            self._parent.append(node)
+            self._size.append(1)
+            self._users.append(1 if is_user else 0)
+            self._fraud.append(0)
+            self._flagged.append(0)
+        return node
+
+    def _find(self, node: int) -> int:
+        parent = self._parent
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def _union(self, a: int, b: int) -> None:
+        a, b = self._find(a), self._find(b)
+        if a == b:
+            return
+        if self._size[a] < self._size[b]:
+            a, b = b, a
+        self._parent[b] = a
+        self._size[a] += self._size[b]
+        self._users[a] += self._users[b]
+        self._fraud[a] += self._fraud[b]
+
+    # ---------- updates ----------
+
+    def add_transaction(self, user_id, device_id, card_id, is_fraud: bool = False) -> None:
+        if user_id is None:
+            return
+        with self._lock:
+            u = self._node("u:" + user_id, True)
+            if device_id is not None:
+                self._union(u, self._node("d:" + device_id, False))
+            if card_id is not None:
+                self._union(u, self._node("c:" + card_id, False))
+            if is_fraud:
+                self._flag(u)
+
+    def record_fraud_label(self, user_id) -> None:
+        with self._lock:
+            self._flag(self._node("u:" + user_id, True))
+
+    def _flag(self, u: int) -> None:
+        if not self._flagged[u]:
+            self._flagged[u] = 1
+            self._fraud[self._find(u)] += 1
+
+    # ---------- lookups ----------
+
+    def ring(self, user_id) -> dict | None:
+        """Component id and counts for a user, or None if the user was never seen."""
+        with self._lock:
+            node = self._index.get("u:" + user_id) if user_id is not None else None
+            if node is None:
+                return None
+            root = self._find(node)
+            return {
+                "ring_id": root,
+                "users": self._users[root],
+                "devices_and_cards": self._size[root] - self._users[root],
+                "fraud_users": self._fraud[root],
+            }
+
+    def ring_features(self, user_id) -> dict:
+        r = self.ring(user_id)
+        if r is None:
+            return {"ring_size": 0, "ring_fraud_rate": 0.0}
+        return {"ring_size": r["users"], "ring_fraud_rate": r["fraud_users"] / r["users"]}
+
+    # ---------- persistence ----------
+
+    def save(self, path: str = ENTITY_GRAPH_SNAPSHOT) -> None:
+        with self._lock:
+            state = {
+                "version": SNAPSHOT_VERSION,
+                "keys": self._keys,
+                "parent": self._parent,
+                "size": self._size,
+                "users": self._users,
+                "fraud": self._fraud,
+                "flagged": bytes(self._flagged),
+                "tx_watermark": self.tx_watermark,
+                "label_watermark": self.label_watermark,
+                "tx_gaps": self.tx_gaps,
+                "label_gaps": self.label_gaps,
+            }
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = f"{path}.tmp-{os.getpid()}"
+            with open(tmp, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str = ENTITY_GRAPH_SNAPSHOT) -> "EntityGraph | None":
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        if state.get("version") != SNAPSHOT_VERSION:
+            log.warning("ignoring entity graph snapshot %s with version %s", path, state.get("version"))
+            return None
+        g = cls()
+        g._keys = state["keys"]
+        g._index = {k: i for i, k in enumerate(g._keys)}
+        g._parent, g._size, g._users, g._fraud = state["parent"], state["size"], state["users"], state["fraud"]
+        g._flagged = bytearray(state["flagged"])
+        g.tx_watermark, g.label_watermark = state["tx_watermark"], state["label_watermark"]
+        g.tx_gaps, g.label_gaps = state["tx_gaps"], state["label_gaps"]
+        return g
+
+    # ---------- catch-up from PostgreSQL ----------
+
+    def _advance(self, mark: int, gaps: dict, ids) -> tuple[int, dict]:
+        return advance_watermark(mark, gaps, ids, int(time.time() * 1e6), int(ENTITY_GRAPH_GAP_TTL_S * 1e6),
+                                 ENTITY_GRAPH_GAP_SLOTS, GAPS_DROPPED)
+
+    def refresh(self, conn, fetch_size: int = 50000) -> int:
+        """
+        Replay transactions and review rejections past the watermarks, plus the
+        gaps left behind them; returns rows replayed.
+        """
+        n = 0
+        with conn.cursor(name="entity_graph_refresh") as cur:
+            cur.itersize = fetch_size
+            cur.execute("""
+                SELECT tx_pk, user_id, device_id, card_id, is_fraud
+                FROM transactions
+                WHERE tx_pk > %s OR tx_pk = ANY(%s)
+                ORDER BY tx_pk;
+            """, (self.tx_watermark, list(self.tx_gaps)))
+            while True:
+                rows = cur.fetchmany(fetch_size)
+                if not rows:
+                    break
+                for tx_pk, user_id, device_id, card_id, is_fraud in rows:
+                    self.add_transaction(user_id, device_id, card_id, bool(is_fraud))
+                self.tx_watermark, self.tx_gaps = self._advance(
+                    self.tx_watermark, self.tx_gaps, [r[0] for r in rows])
+                n += len(rows)
+        if not n:
+            self.tx_watermark, self.tx_gaps = self._advance(self.tx_watermark, self.tx_gaps, ())
+        REFRESHES.inc(n, kind="transaction")
+
+        with conn.cursor() as cur:
+            # every action id advances the watermark; only rejects flag a user
+            cur.execute("""
+                SELECT a.id, CASE WHEN a.action = 'reject' THEN t.user_id END
+                FROM review_actions a
+                JOIN transactions t ON t.tx_pk = a.tx_pk
+                WHERE a.id > %s OR a.id = ANY(%s)
+                ORDER BY a.id;
+            """, (self.label_watermark, list(self.label_gaps)))
+            labels = cur.fetchall()
+        for _, user_id in labels:
+            if user_id is not None:
+                self.record_fraud_label(user_id)
+        self.label_watermark, self.label_gaps = self._advance(
+            self.label_watermark, self.label_gaps, [r[0] for r in labels])
+        REFRESHES.inc(len(labels), kind="label")
+        conn.rollback()
+        return n + len(labels)
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def _refresh_loop(graph: EntityGraph) -> None:
+    from common.db import connect
+
+    conn = None
+    while True:
+        time.sleep(ENTITY_GRAPH_REFRESH_S)
+        try:
+            conn = conn or connect()
+            graph.refresh(conn)
+        except Exception:
+            log.exception("entity graph refresh failed")
+            if conn is not None:
+                conn.close()
+            conn = None
+
+
+def get_graph() -> EntityGraph | None:
+    """
+    The process-wide graph, or None when ENTITY_GRAPH is off. The first call
+    loads the snapshot (or builds from scratch), catches up and starts the
+    background refresh.
+    """
+    global _graph
+    if not ENTITY_GRAPH:
+        return None
+    if _graph is None:
+        with _graph_lock:
+            if _graph is None:
+                from common.db import connect
+
+                graph = EntityGraph.load() or EntityGraph()
+                conn = connect()
+                try:
+                    graph.refresh(conn)
+                finally:
+                    conn.close()
+                threading.Thread(target=_refresh_loop, args=(graph,), name="entity-graph-refresh",
+                                 daemon=True).start()
+                _graph = graph
+    return _graph
+
+
+def ring_features_for(user_id, device_id, card_id) -> dict:
+    """
+    Ring features for a transaction, after adding its own edges; None values when
+    the graph is off.
+    """
+    graph = get_graph()
+    if graph is None:
+        return {"ring_size": None, "ring_fraud_rate": None}
+    graph.add_transaction(user_id, device_id, card_id)
+    return graph.ring_features(user_id)
+
+
+def save_snapshot() -> None:
+    if _graph is not None:
+        _graph.save()
+
+
+CallbackMetric(
+    "fraud_entity_graph_nodes",
+    "Users, devices and cards in the in-memory entity graph.",
+    lambda: None if _graph is None else len(_graph),
+)
+
+
+if __name__ == "__main__":
+    from common.db import connect
+
+    if sys.argv[1:2] == ["rebuild"]:
+        t0 = time.perf_counter()
+        g = EntityGraph()
+        conn = connect()
+        try:
+            rows = g.refresh(conn)
+        finally:
+            conn.close()
+        g.save()
+        print(f"Built entity graph with {len(g)} nodes from {rows} rows in {time.perf_counter() - t0:.1f}s "
+              f"-> {ENTITY_GRAPH_SNAPSHOT}")
+    elif sys.argv[1:2] == ["show"] and len(sys.argv) == 3:
+        g = EntityGraph.load()
+        if g is None:
+            print(f"No snapshot at {ENTITY_GRAPH_SNAPSHOT}; run rebuild first.")
+            sys.exit(1)
+        print(g.ring(sys.argv[2]) or "unknown user")
+    else:
+        print("usage: python -m features.entity_graph rebuild | show USER_ID")
+        sys.exit(2)
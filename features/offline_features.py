@@ -0,0 +1,332 @@
+# features/offline_features.py
+"""
+Point-in-time feature engine for training.
+
+transaction_features is written by the realtime/batch paths, and the batch
+rates (merchant_fraud_rate, category_fraud_rate, device_user_count) look at the
+whole table, future rows and the row's own label included. Here every feature in
+FEATURE_COLUMNS is computed as-of each transaction's timestamp instead:
+
+- velocity, user_avg_amount: the user's transactions with timestamp <= t
+- is_foreign_country: t's country vs. the user's most frequent country up to t
+  (ties broken alphabetically, as in database/home_country.sql)
+- device_user_count: distinct users seen on the device up to t
+- merchant/category fraud rate: labels of transactions strictly before t - label_delay,
+  over all the group's transactions up to t, this one included (as realtime_features
+  counts it: inserted, not yet labelled)
+- ring_size / ring_fraud_rate (optional, RING_FEATURE_COLUMNS): the user's
+  component in the entity graph of transactions with timestamp <= t, with the
+  fraud labels that had matured by then
+
+Transactions are loaded once (COPY, parsed in chunks as it streams) into NumPy columns. Every feature is then a
+prefix count or prefix sum over events sorted by (group, timestamp), answered
+for all rows at once with searchsorted.
+
+    python -m features.offline_features            # summary of the matrix
+"""
+from __future__ import annotations
+
+import codecs
+import csv
+import io
+import time
+
+import numpy as np
+
+from common.db import connect
+from features.entity_graph import EntityGraph, RING_FEATURE_COLUMNS
+from features.realtime_features import FEATURE_COLUMNS
+
+# bump when a feature definition changes, so cached training matrices are rebuilt
+OFFLINE_FEATURES_VERSION = 2
+US = 1_000_000
+WINDOWS_US = {
+    "tx_count_5m": 5 * 60 * US,
+    "tx_count_1h": 60 * 60 * US,
+    "tx_count_24h": 24 * 60 * 60 * US,
+}
+
+STRING_COLUMNS = ("user", "device", "merchant", "category", "country", "card")
+NULL = "\\N"  # NULL marker, as written by LOAD_SQL
+
+LOAD_SQL = """
+COPY (
+    SELECT transaction_id, user_id, device_id, merchant, merchant_category, country, card_id,
+           amount::float8, (EXTRACT(EPOCH FROM timestamp) * 1000000)::bigint, is_fraud::int
+    FROM transactions
+) TO STDOUT WITH (FORMAT csv, NULL '\\N')
+"""
+LOAD_COLUMNS = 10
+COPY_CHUNK_BYTES = 8 << 20
+
+
+class _CsvColumns:
+    """
+    File-like target for COPY ... (FORMAT csv): the stream is parsed with the csv
+    module a chunk at a time and appended to per-column lists, so the raw text is
+    never held in full.
+    """
+
+    def __init__(self, ncols: int, chunk_bytes: int = COPY_CHUNK_BYTES):
+        self.columns = [[] for _ in range(ncols)]
+        self._chunk_bytes = chunk_bytes
+        self._decode = codecs.getincrementaldecoder("utf-8")().decode
+        self._pending = []
+        self._size = 0
+        self._quotes = 0
+
+    def write(self, data) -> None:
+        if isinstance(data, bytes):
+            data = self._decode(data)
+        self._pending.append(data)
+        self._size += len(data)
+        self._quotes += data.count('"')
+        # cut only between records: a newline outside quotes ("" escapes come in pairs)
+        if self._size >= self._chunk_bytes and data.endswith("\n") and self._quotes % 2 == 0:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        rows = csv.reader(io.StringIO("".join(self._pending), newline=""))
+        for column, values in zip(self.columns, zip(*rows)):
+            column.extend(values)
+        self._pending, self._size, self._quotes = [], 0, 0
+
+
+def _columns_to_data(transaction_id, strings: dict, amount, ts_us, is_fraud) -> dict:
+    data = {"n": len(transaction_id), "transaction_id": np.asarray(transaction_id, dtype=object)}
+    for name, values in strings.items():
+        uniques, codes = np.unique(np.asarray(values, dtype=object), return_inverse=True)
+        data[name] = codes.astype(np.int64)
+        data[name + "_values"] = uniques
+    data["amount"] = np.asarray(amount, dtype=np.float64)
+    data["ts"] = np.asarray(ts_us, dtype=np.int64)
+    data["is_fraud"] = np.asarray(is_fraud, dtype=np.int64)
+    return data
+
+
+def load_transactions(conn) -> dict:
+    """
+    All transactions as NumPy columns: string columns as integer codes (plus the
+    sorted unique values), ts in epoch microseconds.
+    """
+    out = _CsvColumns(LOAD_COLUMNS)
+    with conn.cursor() as cur:
+        cur.copy_expert(LOAD_SQL, out)
+    conn.rollback()
+    out.flush()
+
+    cols = out.columns
+    if not cols[0]:
+        return {"n": 0}
+    return _columns_to_data(cols[0], dict(zip(STRING_COLUMNS, cols[1:7])), cols[7], cols[8], cols[9])
+
+
+def load_transactions_from_snapshot(root: str = None) -> dict:
+    """
+    Same columns, read from the columnar snapshot (python -m warehouse.snapshot export)
+    instead of the database.
+    """
+    import pyarrow as pa
+    from warehouse.snapshot import SNAPSHOT_DIR, read_table
+
+    sources = ("user_id", "device_id", "merchant", "merchant_category", "country", "card_id")
+    t = read_table("transactions", columns=["transaction_id", *sources, "amount", "timestamp", "is_fraud"],
+                   root=root or SNAPSHOT_DIR)
+    if t.num_rows == 0:
+        return {"n": 0}
+
+    def strings(name):
+        return t[name].cast(pa.string()).fill_null(NULL).to_numpy(zero_copy_only=False)
+
+    return _columns_to_data(
+        t["transaction_id"].to_numpy(zero_copy_only=False),
+        {name: strings(src) for name, src in zip(STRING_COLUMNS, sources)},
+        t["amount"].fill_null(0.0).to_numpy(),
+        t["timestamp"].cast(pa.int64()).to_numpy(),
+        t["is_fraud"].fill_null(False).cast(pa.int64()).to_numpy(),
+    )
+
+
+class _AsOf:
+    """
+    Prefix lookups over events keyed by (group, timestamp).
+
+    Timestamps are mapped to ranks in the sorted set of distinct timestamps, so a
+    (group, rank) pair packs into one int64 key without overflow, and "events of
+    group g before time t" is one searchsorted on the sorted keys.
+    """
+
+    def __init__(self, all_ts: np.ndarray):
+        self._clock = np.unique(all_ts)
+        self._span = len(self._clock) + 1
+
+    def rank(self, ts: np.ndarray, inclusive: bool) -> np.ndarray:
+        # events with rank < rank(t) are exactly those with ts <= t (inclusive) or ts < t
+        return np.searchsorted(self._clock, ts, side="right" if inclusive else "left")
+
+    def index(self, group: np.ndarray, ts: np.ndarray):
+        """Sort events; returns (order, sorted keys)."""
+        keys = group * self._span + self.rank(ts, inclusive=False)
+        order = np.argsort(keys, kind="stable")
+        return order, keys[order]
+
+    def bounds(self, sorted_keys, group, lo_ts=None, hi_ts=None, hi_inclusive=True):
+        """
+        [start, end) positions in the sorted events for each query: events of
+        `group` with lo_ts <= ts (or from the group's first event) and ts <= hi_ts.
+        """
+        base = group * self._span
+        lo = base if lo_ts is None else base + self.rank(lo_ts, inclusive=False)
+        hi = base + self.rank(hi_ts, inclusive=hi_inclusive)
+        return np.searchsorted(sorted_keys, lo, "left"), np.searchsorted(sorted_keys, hi, "left")
+
+
+def _prefix_sum(values_sorted: np.ndarray) -> np.ndarray:
+    out = np.zeros(len(values_sorted) + 1, dtype=np.float64)
+    np.cumsum(values_sorted, out=out[1:])
+    return out
+
+
+def _group_running_max(values: np.ndarray, group: np.ndarray) -> np.ndarray:
+    """Running max within contiguous groups (values >= 0, rows sorted by group)."""
+    offset = (values.max() + 1) if len(values) else 1
+    return np.maximum.accumulate(values + group * offset) - group * offset
+
+
+def compute_point_in_time_features(data: dict, label_delay_s: float = 0.0) -> np.ndarray:
+    """
+    (n, len(FEATURE_COLUMNS)) float matrix, rows in the order of `data`.
+    """
+    n = data["n"]
+    X = np.zeros((n, len(FEATURE_COLUMNS)), dtype=np.float64)
+    if n == 0:
+        return X
+    col = {c: i for i, c in enumerate(FEATURE_COLUMNS)}
+    ts, user, amount = data["ts"], data["user"], data["amount"]
+    asof = _AsOf(ts)
+
+    # velocity and running average: the user's events with ts in [t - w, t]
+    order, keys = asof.index(user, ts)
+    for name, w in WINDOWS_US.items():
+        start, end = asof.bounds(keys, user, lo_ts=ts - w, hi_ts=ts)
+        X[:, col[name]] = end - start
+    start, end = asof.bounds(keys, user, hi_ts=ts)
+    sums = _prefix_sum(amount[order])
+    avg = (sums[end] - sums[start]) / (end - start)
+    X[:, col["user_avg_amount"]] = avg
+    X[:, col["amount_vs_user_avg"]] = np.divide(amount, avg, out=np.zeros(n), where=avg > 0)
+
+    # home country as of t: best (count, -alphabetical rank) over the user's countries.
+    # A (user, country) pair's count at its own rows is its count as of then, so the
+    # running max of those scores in (user, ts) order is the best pair as of t.
+    n_countries = len(data["country_values"])
+    country = data["country"]
+    pair = user * n_countries + country
+    _, p_keys = asof.index(pair, ts)
+    p_start, p_end = asof.bounds(p_keys, pair, hi_ts=ts)
+    score = (p_end - p_start) * n_countries + (n_countries - 1 - country)
+    running = _group_running_max(score[order], user[order])
+    # ties at t: the row that closes the user's tie block sees every score as of t
+    best_as_of = running[end - 1]
+    home = n_countries - 1 - best_as_of % n_countries
+    X[:, col["is_foreign_country"]] = (country != home).astype(np.float64)
+
+    # device reuse: a user counts from their first transaction on the device
+    device = data["device"]
+    dev_pair = device * (user.max() + 1) + user
+    by_pair = np.lexsort((ts, dev_pair))
+    first = by_pair[np.r_[True, np.diff(dev_pair[by_pair]) != 0]]
+    _, d_keys = asof.index(device[first], ts[first])
+    d_start, d_end = asof.bounds(d_keys, device, hi_ts=ts)
+    X[:, col["device_user_count"]] = d_end - d_start
+
+    # fraud rates: labels that had matured before t, over every transaction up to t
+    # (the row itself included, like the realtime denominator)
+    label_cutoff = ts - int(label_delay_s * US)
+    fraud = data["is_fraud"].astype(np.float64)
+    for name, group in (("merchant_fraud_rate", data["merchant"]), ("category_fraud_rate", data["category"])):
+        g_order, g_keys = asof.index(group, ts)
+        l_start, l_end = asof.bounds(g_keys, group, hi_ts=label_cutoff, hi_inclusive=False)
+        g_start, g_end = asof.bounds(g_keys, group, hi_ts=ts)
+        frauds = _prefix_sum(fraud[g_order])
+        seen = g_end - g_start
+        X[:, col[name]] = np.divide(frauds[l_end] - frauds[l_start], seen, out=np.zeros(n), where=seen > 0)
+
+    return X
+
+
+def compute_ring_features(data: dict, label_delay_s: float = 0.0) -> np.ndarray:
+    """
+    (n, len(RING_FEATURE_COLUMNS)) float matrix. Union-find has no prefix form,
+    so this replays transactions through an EntityGraph in timestamp order: all
+    edges with ts <= t, and labels with ts < t - label_delay, before reading t.
+    """
+    n = data["n"]
+    R = np.zeros((n, len(RING_FEATURE_COLUMNS)), dtype=np.float64)
+    if n == 0:
+        return R
+
+    def value(name, i):
+        v = data[name + "_values"][data[name][i]]
+        return None if v == NULL else v
+
+    ts, is_fraud = data["ts"], data["is_fraud"]
+    order = np.argsort(ts, kind="stable")
+    delay_us = int(label_delay_s * US)
+    graph = EntityGraph()
+    labeled = 0
+    start = 0
+    while start < n:
+        t = ts[order[start]]
+        end = start
+        while end < n and ts[order[end]] == t:
+            end += 1
+        while labeled < n and ts[order[labeled]] + delay_us < t:
+            i = order[labeled]
+            if is_fraud[i] and value("user", i) is not None:
+                graph.record_fraud_label(value("user", i))
+            labeled += 1
+        for i in order[start:end]:
+            graph.add_transaction(value("user", i), value("device", i), value("card", i))
+        for i in order[start:end]:
+            f = graph.ring_features(value("user", i))
+            R[i] = f["ring_size"], f["ring_fraud_rate"]
+        start = end
+    return R
+
+
+def build_training_matrix(conn=None, label_delay_s: float = 0.0, snapshot: bool = False, ring: bool = False):
+    """
+    Returns (X, y, transaction_ids) with X columns in FEATURE_COLUMNS order
+    (followed by RING_FEATURE_COLUMNS when ring=True).
+    snapshot=True reads transactions from the columnar snapshot instead of Postgres.
+    """
+    if snapshot:
+        data = load_transactions_from_snapshot()
+    else:
+        own = conn is None
+        conn = conn or connect()
+        try:
+            data = load_transactions(conn)
+        finally:
+            if own:
+                conn.close()
+    width = len(FEATURE_COLUMNS) + (len(RING_FEATURE_COLUMNS) if ring else 0)
+    if data["n"] == 0:
+        return np.zeros((0, width)), np.zeros(0, dtype=int), np.zeros(0, dtype=object)
+    X = compute_point_in_time_features(data, label_delay_s=label_delay_s)
+    if ring:
+        X = np.hstack([X, compute_ring_features(data, label_delay_s=label_delay_s)])
+    return X, data["is_fraud"].astype(int), data["transaction_id"]
+
+
+if __name__ == "__main__":
+    t0 = time.perf_counter()
+    X, y, ids = build_training_matrix()
+    print(f"Built {X.shape[0]} x {X.shape[1]} point-in-time matrix in {time.perf_counter() - t0:.2f}s "
+          f"({int(y.sum())} fraud).")
+    for i, c in enumerate(FEATURE_COLUMNS):
+        if len(X):
+            print(f"  {c:<22} mean={X[:, i].mean():.4f} max={X[:, i].max():.4f}")
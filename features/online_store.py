@@ -0,0 +1,713 @@
+# features/online_store.py
+"""
+Embedded online feature store shared by every API worker on a host.
+
+A single memory-mapped file holds four fixed-size open-addressing hash tables:
+
+  users       count, amount sum, max timestamp, last RING timestamps, top countries
+  devices     up to DEVICE_USERS distinct user hashes
+  merchants   transaction count, fraud count
+  categories  transaction count, fraud count
+
+Workers map the same file, writes take an exclusive flock and reads a shared
+one, so a lookup is a couple of syscalls plus struct unpacking.
+
+The file is only trusted once `rebuild` has loaded it from PostgreSQL; until
+then features_for() returns None. After that, transactions reach it two ways:
+the API records its own rows as soon as they are written, and a background poll
+reads transactions and review actions past the tx_pk / review id watermarks in
+the header, like features/entity_graph.py, so rows from ingestion,
+build_features or other hosts arrive within ONLINE_STORE_REFRESH_S. One process
+per host polls at a time. Identity values commit out of order, so ids the poll
+skipped are kept in the file as gaps (up to ONLINE_STORE_GAP_SLOTS, for
+ONLINE_STORE_GAP_TTL_S) and re-read by id until they show up; a table of
+recently applied transaction ids (two generations of ONLINE_STORE_RECENT keys)
+makes every row and label count once whichever way it arrives.
+
+When the last catch-up is older than ONLINE_STORE_MAX_LAG_S (PostgreSQL down,
+say) features_for() still answers but flags the features as stale; the caller
+decides whether to use them. It returns None when the stored aggregates can't give the SQL
+feature definitions (e.g. a velocity-window timestamp was evicted from the ring,
+the device has more than DEVICE_USERS users), and the caller falls back to
+PostgreSQL. When it does answer, rows committed elsewhere in the last refresh
+interval may be missing. home_country is the user's most frequent transaction
+country (ties -> alphabetical), the same rule build_features applies.
+
+Rebuild from PostgreSQL (writes a new file from one snapshot, atomically swaps
+it in and catches up past the snapshot; running workers pick it up within a
+second):
+
+    python -m features.online_store rebuild
+"""
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from common.metrics import Counter
+
+ONLINE_FEATURE_STORE = os.getenv("ONLINE_FEATURE_STORE", "0") == "1"
+ONLINE_STORE_PATH = os.getenv("ONLINE_STORE_PATH", "/dev/shm/fraud_online_store.bin")
+ONLINE_STORE_USERS = int(os.getenv("ONLINE_STORE_USERS", str(1 << 18)))
+ONLINE_STORE_DEVICES = int(os.getenv("ONLINE_STORE_DEVICES", str(1 << 18)))
+ONLINE_STORE_MERCHANTS = int(os.getenv("ONLINE_STORE_MERCHANTS", str(1 << 16)))
+ONLINE_STORE_CATEGORIES = int(os.getenv("ONLINE_STORE_CATEGORIES", str(1 << 10)))
+ONLINE_STORE_RECENT = int(os.getenv("ONLINE_STORE_RECENT", str(1 << 20)))
+ONLINE_STORE_REFRESH_S = float(os.getenv("ONLINE_STORE_REFRESH_S", "1"))
+ONLINE_STORE_MAX_LAG_S = float(os.getenv("ONLINE_STORE_MAX_LAG_S", "30"))
+# skipped identity values re-read until they commit (or this many seconds pass)
+ONLINE_STORE_GAP_SLOTS = int(os.getenv("ONLINE_STORE_GAP_SLOTS", "4096"))
+ONLINE_STORE_GAP_TTL_S = float(os.getenv("ONLINE_STORE_GAP_TTL_S", "60"))
+
+MAGIC = b"FRDOFS03"
+# magic, table capacities (users, devices, merchants, categories, recent, gap slots)
+HEADER_FMT = "<8sQQQQQQ"
+# built, tx_pk watermark, review_actions.id watermark, last catch-up (unix us),
+# current recent-ids generation, keys in it
+STATE_FMT = "<Qqqqqq"
+STATE_OFFSET = struct.calcsize(HEADER_FMT)
+HEADER_SIZE = 128
+
+RING = 32
+COUNTRY_SLOTS = 4
+DEVICE_USERS = 8
+MAX_PROBE = 64
+
+USER_FMT = "<QqQdqII" + f"{RING}q" + "4s" * COUNTRY_SLOTS + f"{COUNTRY_SLOTS}I" + "B7x"
+DEVICE_FMT = "<QIB3x" + f"{DEVICE_USERS}Q"
+RATE_FMT = "<QQQ"
+
+USER_SIZE = struct.calcsize(USER_FMT)
+DEVICE_SIZE = struct.calcsize(DEVICE_FMT)
+RATE_SIZE = struct.calcsize(RATE_FMT)
+
+REFRESH_BATCH = 500  # rows applied per exclusive lock hold
+
+INT64_MIN = -(1 << 63)
+EPOCH = datetime(1970, 1, 1)
+US_5M = 5 * 60 * 1_000_000
+US_1H = 60 * 60 * 1_000_000
+US_24H = 24 * 60 * 60 * 1_000_000
+
+LOOKUPS = Counter(
+    "fraud_online_store_lookups_total",
+    "Online feature store lookups by result (hit, hit_stale, or the reason for falling back to SQL).",
+    labels=("result",),
+)
+
+GAPS_DROPPED = Counter(
+    "fraud_online_store_gaps_dropped_total",
+    "Skipped ids no longer re-read by the catch-up poll, by reason (expired, overflow).",
+    labels=("reason",),
+)
+
+REFRESHES = Counter(
+    "fraud_online_store_refresh_rows_total",
+    "Rows applied to the online feature store by the catch-up poll, by kind (transaction, label).",
+    labels=("kind",),
+)
+
+log = logging.getLogger("fraud.online_store")
+
+
+def _key(kind: str, value: str) -> int:
+    k = int.from_bytes(hashlib.blake2b(f"{kind}:{value}".encode(), digest_size=8).digest(), "little")
+    return k or 1  # 0 marks an empty slot
+
+
+def _to_us(ts: datetime) -> int:
+    return (ts - EPOCH) // timedelta(microseconds=1)
+
+
+def advance_watermark(mark: int, gaps: dict, ids, now_us: int, ttl_us: int, slots: int,
+                      dropped: Counter = GAPS_DROPPED) -> tuple[int, dict]:
+    """
+    New (watermark, gaps) after a poll that read `ids` (ascending; those at or
+    below the watermark are gaps that have since committed). gaps maps each id
+    skipped over to when it was first missed; ids missing for ttl_us, and the
+    oldest beyond `slots`, are given up on and counted in `dropped`.
+    """
+    gaps = dict(gaps)
+    for i in ids:
+        if i <= mark:
+            gaps.pop(i, None)
+            continue
+        for missing in range(max(mark + 1, i - slots), i):
+            gaps[missing] = now_us
+        if i - mark - 1 > slots:
+            dropped.inc(i - mark - 1 - slots, reason="overflow")
+        mark = i
+    expired = [i for i, seen in gaps.items() if now_us - seen >= ttl_us]
+    for i in expired:
+        del gaps[i]
+    if expired:
+        dropped.inc(len(expired), reason="expired")
+    if len(gaps) > slots:
+        excess = len(gaps) - slots
+        for i in sorted(gaps)[:excess]:
+            del gaps[i]
+        dropped.inc(excess, reason="overflow")
+    return mark, gaps
+
+
+class _Table:
+    def __init__(self, offset: int, capacity: int, fmt: str, size: int):
+        self.offset = offset
+        self.capacity = capacity
+        self.fmt = fmt
+        self.size = size
+
+    @property
+    def nbytes(self) -> int:
+        return self.capacity * self.size
+
+
+class OnlineFeatureStore:
+    def __init__(
+        self,
+        path: str = ONLINE_STORE_PATH,
+        users: int = ONLINE_STORE_USERS,
+        devices: int = ONLINE_STORE_DEVICES,
+        merchants: int = ONLINE_STORE_MERCHANTS,
+        categories: int = ONLINE_STORE_CATEGORIES,
+        recent: int = ONLINE_STORE_RECENT,
+        gap_slots: int = ONLINE_STORE_GAP_SLOTS,
+    ):
+        self.path = path
+        self._caps = (users, devices, merchants, categories, recent, gap_slots)
+        self._lock = threading.RLock()
+        self._open()
+
+    # ---------- file management ----------
+
+    def _layout(self, caps):
+        users, devices, merchants, categories, recent, gap_slots = caps
+        off = HEADER_SIZE
+        # skipped ids per watermark (transactions, review actions): count, then (id, first missed us)
+        self.gap_slots = gap_slots
+        self.gap_offsets = []
+        for _ in range(2):
+            self.gap_offsets.append(off)
+            off += 8 + gap_slots * 16
+        self.users = _Table(off, users, USER_FMT, USER_SIZE)
+        off += self.users.nbytes
+        self.devices = _Table(off, devices, DEVICE_FMT, DEVICE_SIZE)
+        off += self.devices.nbytes
+        self.merchants = _Table(off, merchants, RATE_FMT, RATE_SIZE)
+        off += self.merchants.nbytes
+        self.categories = _Table(off, categories, RATE_FMT, RATE_SIZE)
+        off += self.categories.nbytes
+        self.recent = []
+        for _ in range(2):
+            self.recent.append(_Table(off, recent, "<Q", 8))
+            off += self.recent[-1].nbytes
+        return off
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(fd, HEADER_SIZE, 0)
+            if len(header) >= struct.calcsize(HEADER_FMT) and header[:8] == MAGIC:
+                caps = struct.unpack_from(HEADER_FMT, header)[1:]
+                total = self._layout(caps)
+            else:
+                # new (or older-format) file: zero it, not built until rebuild() has filled it
+                total = self._layout(self._caps)
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, total)  # sparse: pages are only backed once touched
+                os.pwrite(fd, struct.pack(HEADER_FMT, MAGIC, *self._caps).ljust(HEADER_SIZE, b"\0"), 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._mm = mmap.mmap(fd, total)
+        self._inode = os.fstat(fd).st_ino
+        self._checked_at = time.monotonic()
+
+    def _maybe_reopen(self):
+        # a rebuild swaps in a new file; remap it at most once per second
+        now = time.monotonic()
+        if now - self._checked_at < 1.0:
+            return
+        self._checked_at = now
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return
+        if inode != self._inode:
+            old_mm, old_fd = self._mm, self._fd
+            self._open()
+            old_mm.close()
+            os.close(old_fd)
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        with self._lock:
+            self._maybe_reopen()
+            fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        with self._lock:
+            self._mm.close()
+            os.close(self._fd)
+
+    # ---------- header state ----------
+
+    def _state(self) -> list:
+        return list(struct.unpack_from(STATE_FMT, self._mm, STATE_OFFSET))
+
+    def _set_state(self, state: list) -> None:
+        struct.pack_into(STATE_FMT, self._mm, STATE_OFFSET, *state)
+
+    def watermarks(self) -> tuple[bool, int, int]:
+        """(built, tx_pk watermark, review_actions.id watermark)."""
+        with self._locked(exclusive=False):
+            built, tx_mark, label_mark = self._state()[:3]
+        return bool(built), tx_mark, label_mark
+
+    def _gaps(self, which: int) -> dict:
+        off = self.gap_offsets[which]
+        n = struct.unpack_from("<Q", self._mm, off)[0]
+        flat = struct.unpack_from(f"<{2 * n}q", self._mm, off + 8)
+        return dict(zip(flat[::2], flat[1::2]))
+
+    def _set_gaps(self, which: int, gaps: dict) -> None:
+        off = self.gap_offsets[which]
+        flat = [v for item in sorted(gaps.items()) for v in item]
+        struct.pack_into(f"<Q{len(flat)}q", self._mm, off, len(gaps), *flat)
+
+    def _advance(self, which: int, ids) -> None:
+        """Moves watermark `which` (0 transactions, 1 review actions) past a poll's ids."""
+        state = self._state()
+        mark, gaps = advance_watermark(state[1 + which], self._gaps(which), ids, int(time.time() * 1e6),
+                                       int(ONLINE_STORE_GAP_TTL_S * 1e6), self.gap_slots)
+        state[1 + which] = mark
+        self._set_state(state)
+        self._set_gaps(which, gaps)
+
+    # ---------- hash table primitives ----------
+
+    def _slot(self, table: _Table, key: int, create: bool) -> int:
+        """
+        Offset of the slot holding key (or of a fresh slot when create=True); -1 if
+        the key is absent or the probe sequence is exhausted.
+        """
+        idx = key % table.capacity
+        for _ in range(min(MAX_PROBE, table.capacity)):
+            off = table.offset + idx * table.size
+            k = struct.unpack_from("<Q", self._mm, off)[0]
+            if k == key:
+                return off
+            if k == 0:
+                if not create:
+                    return -1
+                struct.pack_into("<Q", self._mm, off, key)
+                return off
+            idx = (idx + 1) % table.capacity
+        return -1
+
+    def _seen(self, key: int) -> bool:
+        return any(self._slot(t, key, create=False) >= 0 for t in self.recent)
+
+    def _remember(self, key: int) -> bool:
+        """
+        Adds key to the recent-ids set; False if it was already there. When the
+        current generation is half full the older one is cleared and reused, so a
+        key is remembered for at least ONLINE_STORE_RECENT / 2 later keys.
+        """
+        if self._seen(key):
+            return False
+        state = self._state()
+        gen, fill = state[4], state[5]
+        table = self.recent[gen]
+        if fill >= table.capacity // 2:
+            gen = 1 - gen
+            table = self.recent[gen]
+            self._mm[table.offset:table.offset + table.nbytes] = bytes(table.nbytes)
+            fill = 0
+        self._slot(table, key, create=True)
+        state[4], state[5] = gen, fill + 1
+        self._set_state(state)
+        return True
+
+    # ---------- writes ----------
+
+    def record_transaction(self, transaction_id, user_id, device_id, merchant, category, amount, country, ts,
+                           is_fraud=False) -> bool:
+        """Applies a transaction unless it has been applied already; returns whether it was."""
+        with self._locked(exclusive=True):
+            return self._apply(transaction_id, user_id, device_id, merchant, category, amount, country, ts, is_fraud)
+
+    def record_fraud_label(self, transaction_id, merchant, category) -> bool:
+        """
+        A transaction was confirmed as fraud (review rejection). Counted once per
+        transaction, whether it arrives here first or through the catch-up poll.
+        """
+        with self._locked(exclusive=True):
+            return self._apply_label(transaction_id, merchant, category)
+
+    def _apply(self, transaction_id, user_id, device_id, merchant, category, amount, country, ts,
+               is_fraud=False, dedupe: bool = True) -> bool:
+        if dedupe and not self._remember(_key("t", transaction_id)):
+            return False
+        if is_fraud:
+            self._remember(_key("f", transaction_id))
+        self._record_user(user_id, float(amount), country, _to_us(ts))
+        self._record_device(device_id, _key("u", user_id))
+        self._record_rate(self.merchants, _key("m", merchant), 1, 1 if is_fraud else 0)
+        self._record_rate(self.categories, _key("c", category), 1, 1 if is_fraud else 0)
+        return True
+
+    def _apply_label(self, transaction_id, merchant, category) -> bool:
+        if not self._remember(_key("f", transaction_id)):
+            return False
+        self._record_rate(self.merchants, _key("m", merchant), 0, 1)
+        self._record_rate(self.categories, _key("c", category), 0, 1)
+        return True
+
+    def _record_user(self, user_id, amount: float, country: str, ts_us: int) -> None:
+        off = self._slot(self.users, _key("u", user_id), create=True)
+        if off < 0:
+            return
+        rec = list(struct.unpack_from(USER_FMT, self._mm, off))
+        key, max_ts, count, total, max_evicted, ring_len, ring_head = rec[:7]
+        ring = rec[7:7 + RING]
+        codes = rec[7 + RING:7 + RING + COUNTRY_SLOTS]
+        counts = rec[7 + RING + COUNTRY_SLOTS:7 + RING + 2 * COUNTRY_SLOTS]
+        overflow = rec[-1]
+
+        if count == 0:
+            max_ts, max_evicted = ts_us, INT64_MIN
+        max_ts = max(max_ts, ts_us)
+        count += 1
+        total += amount
+
+        if ring_len < RING:
+            ring[(ring_head + ring_len) % RING] = ts_us
+            ring_len += 1
+        else:
+            max_evicted = max(max_evicted, ring[ring_head])
+            ring[ring_head] = ts_us
+            ring_head = (ring_head + 1) % RING
+
+        code = (country or "").encode()
+        if len(code) > 4 or not code:
+            overflow = 1
+        elif not overflow:
+            padded = code.ljust(4, b"\0")
+            if padded in codes:
+                counts[codes.index(padded)] += 1
+            elif b"\0\0\0\0" in codes:
+                i = codes.index(b"\0\0\0\0")
+                codes[i], counts[i] = padded, 1
+            else:
+                overflow = 1
+
+        struct.pack_into(
+            USER_FMT, self._mm, off,
+            key, max_ts, count, total, max_evicted, ring_len, ring_head,
+            *ring, *codes, *counts, overflow,
+        )
+
+    def _record_device(self, device_id, user_key: int) -> None:
+        off = self._slot(self.devices, _key("d", device_id), create=True)
+        if off < 0:
+            return
+        rec = list(struct.unpack_from(DEVICE_FMT, self._mm, off))
+        key, n_users, overflow = rec[:3]
+        users = rec[3:]
+        if overflow or user_key in users[:n_users]:
+            return
+        if n_users < DEVICE_USERS:
+            users[n_users] = user_key
+            n_users += 1
+        else:
+            overflow = 1
+        struct.pack_into(DEVICE_FMT, self._mm, off, key, n_users, overflow, *users)
+
+    def _record_rate(self, table: _Table, key: int, count_delta: int, fraud_delta: int) -> None:
+        off = self._slot(table, key, create=True)
+        if off < 0:
+            return
+        _, count, fraud = struct.unpack_from(RATE_FMT, self._mm, off)
+        struct.pack_into(RATE_FMT, self._mm, off, key, count + count_delta, max(0, fraud + fraud_delta))
+
+    # ---------- reads ----------
+
+    def features_for(self, transaction_id, user_id, device_id, merchant, category, amount, country, ts):
+        """
+        (features, stale) for a transaction that has already been recorded:
+        the nine realtime features, or None when the store can't answer exactly,
+        and whether the last catch-up from PostgreSQL is older than
+        ONLINE_STORE_MAX_LAG_S (rows committed elsewhere since may be missing).
+        """
+        ts_us = _to_us(ts)
+        with self._locked(exclusive=False):
+            built, _, _, refreshed_us = self._state()[:4]
+            if not built:
+                LOOKUPS.inc(result="miss_not_built")
+                return None, False
+            stale = time.time() - refreshed_us / 1e6 > ONLINE_STORE_MAX_LAG_S
+            u_off = self._slot(self.users, _key("u", user_id), create=False)
+            d_off = self._slot(self.devices, _key("d", device_id), create=False)
+            m_off = self._slot(self.merchants, _key("m", merchant), create=False)
+            c_off = self._slot(self.categories, _key("c", category), create=False)
+            if min(u_off, d_off, m_off, c_off) < 0:
+                LOOKUPS.inc(result="miss_unknown_key")
+                return None, stale
+            user = struct.unpack_from(USER_FMT, self._mm, u_off)
+            device = struct.unpack_from(DEVICE_FMT, self._mm, d_off)
+            _, m_count, m_fraud = struct.unpack_from(RATE_FMT, self._mm, m_off)
+            _, c_count, c_fraud = struct.unpack_from(RATE_FMT, self._mm, c_off)
+
+        _, max_ts, count, total, max_evicted, ring_len, _ = user[:7]
+        ring = user[7:7 + ring_len]
+        codes = user[7 + RING:7 + RING + COUNTRY_SLOTS]
+        counts = user[7 + RING + COUNTRY_SLOTS:7 + RING + 2 * COUNTRY_SLOTS]
+        overflow = user[-1]
+
+        if max_evicted >= ts_us - US_24H:
+            LOOKUPS.inc(result="miss_velocity_window")
+            return None, stale
+        if max_ts > ts_us:
+            # later transactions are folded into the running average
+            LOOKUPS.inc(result="miss_out_of_order")
+            return None, stale
+        if overflow:
+            LOOKUPS.inc(result="miss_country_overflow")
+            return None, stale
+        if device[2]:
+            LOOKUPS.inc(result="miss_device_overflow")
+            return None, stale
+
+        user_avg = total / count if count else 0.0
+        amount = float(amount)
+        home = min(
+            ((-n, code.rstrip(b"\0").decode()) for code, n in zip(codes, counts) if n),
+            default=(0, None),
+        )[1]
+
+        LOOKUPS.inc(result="hit_stale" if stale else "hit")
+        return {
+            "transaction_id": transaction_id,
+            "tx_count_5m": sum(1 for t in ring if ts_us - US_5M <= t <= ts_us),
+            "tx_count_1h": sum(1 for t in ring if ts_us - US_1H <= t <= ts_us),
+            "tx_count_24h": sum(1 for t in ring if ts_us - US_24H <= t <= ts_us),
+            "user_avg_amount": float(user_avg),
+            "amount_vs_user_avg": float(amount / user_avg) if user_avg > 0 else 0.0,
+            "is_foreign_country": bool(home is not None and country != home),
+            "device_user_count": int(device[1]),
+            "merchant_fraud_rate": float(m_fraud / m_count) if m_count else 0.0,
+            "category_fraud_rate": float(c_fraud / c_count) if c_count else 0.0,
+        }, stale
+
+    # ---------- catch-up from PostgreSQL ----------
+
+    def refresh(self, conn, fetch_size: int = 5000) -> int:
+        """
+        Applies transactions and review rejections past the watermarks, plus any
+        skipped ids that have committed since (nothing until the store is built);
+        returns rows applied. Skips the round when another process on the host is
+        already polling.
+        """
+        lock_fd = os.open(self.path + ".refresh", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+            return self._refresh(conn, fetch_size)
+        finally:
+            os.close(lock_fd)
+
+    def _refresh(self, conn, fetch_size: int) -> int:
+        with self._locked(exclusive=False):
+            built, tx_mark, label_mark = self._state()[:3]
+            tx_gaps, label_gaps = list(self._gaps(0)), list(self._gaps(1))
+        if not built:
+            return 0
+        applied = 0
+        with conn.cursor(name="online_store_refresh") as cur:
+            cur.itersize = fetch_size
+            cur.execute("""
+                SELECT tx_pk, transaction_id, user_id, device_id, merchant, merchant_category,
+                       amount, country, timestamp, is_fraud
+                FROM transactions
+                WHERE tx_pk > %s OR tx_pk = ANY(%s)
+                ORDER BY tx_pk;
+            """, (tx_mark, tx_gaps))
+            while True:
+                rows = cur.fetchmany(REFRESH_BATCH)
+                if not rows:
+                    break
+                with self._locked(exclusive=True):
+                    for tx_pk, tid, user_id, device_id, merchant, category, amount, country, ts, is_fraud in rows:
+                        applied += self._apply(tid, user_id, device_id, merchant, category, amount, country, ts,
+                                               bool(is_fraud))
+                    self._advance(0, [r[0] for r in rows])
+        REFRESHES.inc(applied, kind="transaction")
+
+        with conn.cursor() as cur:
+            # every action moves the watermark; only rejections are labels
+            cur.execute("""
+                SELECT a.id, a.action = 'reject', t.transaction_id, t.merchant, t.merchant_category
+                FROM review_actions a
+                JOIN transactions t ON t.tx_pk = a.tx_pk
+                WHERE a.id > %s OR a.id = ANY(%s)
+                ORDER BY a.id;
+            """, (label_mark, label_gaps))
+            actions = cur.fetchall()
+        conn.rollback()
+        labelled = 0
+        with self._locked(exclusive=True):
+            for _, reject, tid, merchant, category in actions:
+                if reject:
+                    labelled += self._apply_label(tid, merchant, category)
+            self._advance(1, [a[0] for a in actions])
+            state = self._state()
+            state[3] = int(time.time() * 1e6)
+            self._set_state(state)
+        REFRESHES.inc(labelled, kind="label")
+        return applied + labelled
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _refresh_loop(store: OnlineFeatureStore) -> None:
+    from common.db import connect
+
+    conn = None
+    while True:
+        time.sleep(ONLINE_STORE_REFRESH_S)
+        try:
+            conn = conn or connect()
+            store.refresh(conn)
+        except Exception:
+            log.exception("online store refresh failed")
+            if conn is not None:
+                conn.close()
+            conn = None
+
+
+def get_store():
+    """
+    The process-wide store, or None when ONLINE_FEATURE_STORE is off. The first
+    call maps the file and starts the background catch-up.
+    """
+    global _store
+    if not ONLINE_FEATURE_STORE:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = OnlineFeatureStore()
+                threading.Thread(target=_refresh_loop, args=(store,), name="online-store-refresh",
+                                 daemon=True).start()
+                _store = store
+    return _store
+
+
+def record_rows(rows) -> None:
+    """
+    rows: (transaction_id, TransactionCreate, timestamp), right after they are committed.
+    """
+    store = get_store()
+    if store is None:
+        return
+    for transaction_id, tx, ts in rows:
+        store.record_transaction(
+            transaction_id, tx.user_id, tx.device_id, tx.merchant, tx.merchant_category, tx.amount, tx.country, ts,
+        )
+
+
+def rebuild(path: str = ONLINE_STORE_PATH, fetch_size: int = 50000) -> int:
+    """
+    Loads every transaction from one REPEATABLE READ snapshot into a new file,
+    records the snapshot's watermarks and the ids below them the snapshot can't
+    see yet (gaps, re-read by the catch-up), swaps it in and catches up on what
+    committed since.
+    """
+    from common.db import connect
+
+    tmp = f"{path}.rebuild-{os.getpid()}"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    store = OnlineFeatureStore(tmp)
+    conn = connect()
+    n = 0
+    try:
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT (SELECT COALESCE(MAX(tx_pk), 0) FROM transactions),
+                       (SELECT COALESCE(MAX(id), 0) FROM review_actions);
+            """)
+            tx_mark, label_mark = cur.fetchone()
+        with conn.cursor(name="online_store_rebuild") as cur:
+            cur.itersize = fetch_size
+            cur.execute("""
+                SELECT transaction_id, user_id, device_id, merchant, merchant_category, amount, country,
+                       timestamp, is_fraud
+                FROM transactions
+                ORDER BY timestamp ASC;
+            """)
+            # single writer on a private file: one lock for the whole load
+            with store._locked(exclusive=True):
+                for tid, user_id, device_id, merchant, category, amount, country, ts, is_fraud in cur:
+                    store._apply(tid, user_id, device_id, merchant, category, amount, country, ts,
+                                 bool(is_fraud), dedupe=False)
+                    n += 1
+        with conn.cursor() as cur:
+            window = store.gap_slots
+            cur.execute("SELECT tx_pk, transaction_id FROM transactions WHERE tx_pk > %s ORDER BY tx_pk;",
+                        (tx_mark - window,))
+            recent = cur.fetchall()
+            tx_ids = [r[0] for r in recent]
+            cur.execute("SELECT id FROM review_actions WHERE id > %s ORDER BY id;", (label_mark - window,))
+            label_ids = [r[0] for r in cur.fetchall()]
+        with store._locked(exclusive=True):
+            # the API may still record a late commit of its own from the snapshot
+            for _, tid in recent:
+                store._remember(_key("t", tid))
+            state = store._state()
+            state[:4] = [1, max(0, tx_mark - window), max(0, label_mark - window), int(time.time() * 1e6)]
+            store._set_state(state)
+            # ids in the window the snapshot doesn't show become gaps (MAX() ends each list)
+            store._advance(0, tx_ids)
+            store._advance(1, label_ids)
+        conn.rollback()
+    finally:
+        conn.close()
+        store.close()
+    os.replace(tmp, path)
+
+    store = OnlineFeatureStore(path)
+    conn = connect()
+    try:
+        n += store.refresh(conn)
+    finally:
+        conn.close()
+        store.close()
+    return n
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        print("usage: python -m features.online_store rebuild")
+        sys.exit(2)
+    t0 = time.perf_counter()
+    count = rebuild()
+    print(f"Rebuilt {ONLINE_STORE_PATH} from {count} transactions in {time.perf_counter() - t0:.1f}s")
@@ -1,140 +1,429 @@
 # features/realtime_features.py
-from datetime import datetime
-import psycopg2
-from psycopg2.extras import RealDictCursor
 import os
+from datetime import datetime
+from psycopg2.extras import RealDictCursor, execute_values
+
+from common.db import get_conn, execute_prepared
+from common.metrics import STAGE_LATENCY
+from features.entity_graph import get_graph, ring_features_for
+from features.online_store import get_store
+from models.score_cache import score_cache
+
+# 0 falls back to the one-query-per-feature implementation (_compute_features)
+REALTIME_FEATURES_SINGLE_STATEMENT = os.getenv("REALTIME_FEATURES_SINGLE_STATEMENT", "1") == "1"
+
+FEATURE_COLUMNS = (
+    "tx_count_5m", "tx_count_1h", "tx_count_24h",
+    "user_avg_amount", "amount_vs_user_avg",
+    "is_foreign_country", "device_user_count",
+    "merchant_fraud_rate", "category_fraud_rate",
+)
+
+# Columns written to transaction_features, in parameter order. The async API
+# builds its single-row statement from FEATURE_UPSERT_SQL too. tx_pk comes from
+# one join in the statement; for an unknown transaction it stays NULL and the
+# fill_tx_pk trigger raises foreign_key_violation.
+FEATURE_UPSERT_COLUMNS = ("transaction_id", *FEATURE_COLUMNS, "ring_size", "ring_fraud_rate")
+FEATURE_UPSERT_TEMPLATE = ("(%s::text, %s::int, %s::int, %s::int, %s::float8, %s::float8, "
+                           "%s::boolean, %s::int, %s::float8, %s::float8, %s::int, %s::float8)")
+FEATURE_UPSERT_SQL = f"""
+INSERT INTO transaction_features (tx_pk, {", ".join(FEATURE_UPSERT_COLUMNS)})
+SELECT t.tx_pk, {", ".join(f"v.{c}" for c in FEATURE_UPSERT_COLUMNS)}
+FROM (VALUES %s) AS v({", ".join(FEATURE_UPSERT_COLUMNS)})
+LEFT JOIN transactions t ON t.transaction_id = v.transaction_id
+ON CONFLICT (tx_pk) DO UPDATE SET
+    {", ".join(f"{c} = EXCLUDED.{c}" for c in FEATURE_UPSERT_COLUMNS[1:])},
+    created_at = NOW()
+"""
+
+# All nine features for a list of transaction ids, computed and upserted in one
+# statement. Every sub-select is the exact expression used by _compute_features,
+# evaluated against the same snapshot, so results match it bit for bit.
+COMPUTE_AND_UPSERT_SQL = """
+WITH base AS (
+    SELECT t.tx_pk, t.transaction_id, t.user_pk, t.device_pk, t.merchant, t.merchant_category,
+           t.amount, t.country, t.timestamp, t.user_id, t.device_id, t.card_id, ids.ord
+    FROM unnest($1::text[]) WITH ORDINALITY AS ids(transaction_id, ord)
+    JOIN transactions t ON t.transaction_id = ids.transaction_id
+),
+computed AS (
+    SELECT
+        b.tx_pk,
+        b.transaction_id,
+        b.user_id, b.device_id, b.card_id,
+        b.ord,
+        vel.tx_count_5m,
+        vel.tx_count_1h,
+        vel.tx_count_24h,
+        ua.avg_amt AS user_avg_amount,
+        CASE WHEN ua.avg_amt > 0 THEN b.amount::float / ua.avg_amt ELSE 0 END AS amount_vs_user_avg,
+        (u.home_country IS NOT NULL AND b.country IS DISTINCT FROM u.home_country) AS is_foreign_country,
+        dev.cnt AS device_user_count,
+        mr.rate AS merchant_fraud_rate,
+        cr.rate AS category_fraud_rate
+    FROM base b
+    LEFT JOIN users u ON u.user_pk = b.user_pk
+    CROSS JOIN LATERAL (
+        SELECT
+          COUNT(*) FILTER (WHERE timestamp >= b.timestamp - INTERVAL '5 minutes' AND timestamp <= b.timestamp)::int AS tx_count_5m,
+          COUNT(*) FILTER (WHERE timestamp >= b.timestamp - INTERVAL '1 hour' AND timestamp <= b.timestamp)::int AS tx_count_1h,
+          COUNT(*) FILTER (WHERE timestamp >= b.timestamp - INTERVAL '24 hours' AND timestamp <= b.timestamp)::int AS tx_count_24h
+        FROM transactions
+        WHERE user_pk = b.user_pk
+    ) vel
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(AVG(amount), 0)::float AS avg_amt
+        FROM transactions
+        WHERE user_pk = b.user_pk AND timestamp <= b.timestamp
+    ) ua
+    CROSS JOIN LATERAL (
+        SELECT COUNT(DISTINCT user_pk)::int AS cnt
+        FROM transactions
+        WHERE device_pk = b.device_pk
+    ) dev
+    CROSS JOIN LATERAL (
+        SELECT CASE WHEN COUNT(*) = 0 THEN 0
+                    ELSE (SUM(CASE WHEN is_fraud THEN 1 ELSE 0 END)::float / COUNT(*)::float)
+               END AS rate
+        FROM transactions
+        WHERE merchant = b.merchant
+    ) mr
+    CROSS JOIN LATERAL (
+        SELECT CASE WHEN COUNT(*) = 0 THEN 0
+                    ELSE (SUM(CASE WHEN is_fraud THEN 1 ELSE 0 END)::float / COUNT(*)::float)
+               END AS rate
+        FROM transactions
+        WHERE merchant_category = b.merchant_category
+    ) cr
+),
+upserted AS (
+    INSERT INTO transaction_features (
+        tx_pk, transaction_id,
+        tx_count_5m, tx_count_1h, tx_count_24h,
+        user_avg_amount, amount_vs_user_avg,
+        is_foreign_country, device_user_count,
+        merchant_fraud_rate, category_fraud_rate
+    )
+    SELECT
+        tx_pk, transaction_id,
+        tx_count_5m, tx_count_1h, tx_count_24h,
+        user_avg_amount, amount_vs_user_avg,
+        is_foreign_country, device_user_count,
+        merchant_fraud_rate, category_fraud_rate
+    FROM computed
+    ON CONFLICT (tx_pk) DO UPDATE SET
+        tx_count_5m = EXCLUDED.tx_count_5m,
+        tx_count_1h = EXCLUDED.tx_count_1h,
+        tx_count_24h = EXCLUDED.tx_count_24h,
+        user_avg_amount = EXCLUDED.user_avg_amount,
+        amount_vs_user_avg = EXCLUDED.amount_vs_user_avg,
+        is_foreign_country = EXCLUDED.is_foreign_country,
+        device_user_count = EXCLUDED.device_user_count,
+        merchant_fraud_rate = EXCLUDED.merchant_fraud_rate,
+        category_fraud_rate = EXCLUDED.category_fraud_rate,
+        created_at = NOW()
+    RETURNING
+        tx_pk, transaction_id,
+        tx_count_5m, tx_count_1h, tx_count_24h,
+        user_avg_amount, amount_vs_user_avg,
+        is_foreign_country, device_user_count,
+        merchant_fraud_rate, category_fraud_rate
+)
+SELECT u.*, c.user_id, c.device_id, c.card_id
+FROM upserted u
+JOIN computed c ON c.tx_pk = u.tx_pk
+ORDER BY c.ord
+"""
+
+# Ring features come from the in-process entity graph (features/entity_graph.py),
+# so they are written by a second statement in the same transaction.
+RING_UPDATE_SQL = """
+UPDATE transaction_features f
+SET ring_size = v.ring_size, ring_fraud_rate = v.ring_fraud_rate
+FROM unnest($1::bigint[], $2::int[], $3::float8[]) AS v(tx_pk, ring_size, ring_fraud_rate)
+WHERE f.tx_pk = v.tx_pk
+"""
+
+def _compute_features(cur, transaction_id: str) -> dict:
+    # get base tx
+    cur.execute("""
+        SELECT transaction_id, user_pk, device_pk, merchant, merchant_category,
+               amount, country, timestamp, user_id, device_id, card_id
+        FROM transactions
+        WHERE transaction_id = %s;
+    """, (transaction_id,))
+    tx = cur.fetchone()
+    if not tx:
+        raise ValueError("Transaction not found")
+
+    user_pk = tx["user_pk"]
+    device_pk = tx["device_pk"]
+    merchant = tx["merchant"]
+    category = tx["merchant_category"]
+    amount = float(tx["amount"])
+    country = tx["country"]
+    ts = tx["timestamp"]
+
+    # velocity (5m/1h/24h) up to this tx timestamp
+    cur.execute("""
+        SELECT
+          COUNT(*) FILTER (WHERE timestamp >= %s - INTERVAL '5 minutes' AND timestamp <= %s)::int AS tx_count_5m,
+          COUNT(*) FILTER (WHERE timestamp >= %s - INTERVAL '1 hour' AND timestamp <= %s)::int AS tx_count_1h,
+          COUNT(*) FILTER (WHERE timestamp >= %s - INTERVAL '24 hours' AND timestamp <= %s)::int AS tx_count_24h
+        FROM transactions
+        WHERE user_pk = %s;
+    """, (ts, ts, ts, ts, ts, ts, user_pk))
+    vel = cur.fetchone()
+
+    # user avg amount (up to now)
+    cur.execute("""
+        SELECT COALESCE(AVG(amount), 0)::float AS avg_amt
+        FROM transactions
+        WHERE user_pk = %s AND timestamp <= %s;
+    """, (user_pk, ts))
+    user_avg = float(cur.fetchone()["avg_amt"])
+    amount_vs_avg = (amount / user_avg) if user_avg > 0 else 0.0
+
+    # home_country
+    cur.execute("SELECT home_country FROM users WHERE user_pk = %s;", (user_pk,))
+    row = cur.fetchone()
+    home = row["home_country"] if row else None
+    is_foreign = (home is not None) and (country != home)
+
+    # device reuse (# distinct users)
+    cur.execute("""
+        SELECT COUNT(DISTINCT user_pk)::int AS cnt
+        FROM transactions
+        WHERE device_pk = %s;
+    """, (device_pk,))
+    device_user_count = int(cur.fetchone()["cnt"])
+
+    # merchant fraud rate
+    cur.execute("""
+        SELECT CASE WHEN COUNT(*) = 0 THEN 0
+                    ELSE (SUM(CASE WHEN is_fraud THEN 1 ELSE 0 END)::float / COUNT(*)::float)
+               END AS rate
+        FROM transactions
+        WHERE merchant = %s;
+    """, (merchant,))
+    merchant_rate = float(cur.fetchone()["rate"])
+
+    # category fraud rate
+    cur.execute("""
+        SELECT CASE WHEN COUNT(*) = 0 THEN 0
+                    ELSE (SUM(CASE WHEN is_fraud THEN 1 ELSE 0 END)::float / COUNT(*)::float)
+               END AS rate
+        FROM transactions
+        WHERE merchant_category = %s;
+    """, (category,))
+    category_rate = float(cur.fetchone()["rate"])
+
+    return {
+        "transaction_id": transaction_id,
+        "tx_count_5m": int(vel["tx_count_5m"]),
+        "tx_count_1h": int(vel["tx_count_1h"]),
+        "tx_count_24h": int(vel["tx_count_24h"]),
+        "user_avg_amount": float(user_avg),
+        "amount_vs_user_avg": float(amount_vs_avg),
+        "is_foreign_country": bool(is_foreign),
+        "device_user_count": int(device_user_count),
+        "merchant_fraud_rate": float(merchant_rate),
+        "category_fraud_rate": float(category_rate),
+        **ring_features_for(tx["user_id"], tx["device_id"], tx["card_id"]),
+    }
+
+
+def _upsert_features(cur, feature_rows: list[dict]) -> None:
+    # upsert into feature store (one statement for the whole batch)
+    execute_values(cur, FEATURE_UPSERT_SQL, [
+        tuple(f[c] for c in FEATURE_UPSERT_COLUMNS) for f in feature_rows
+    ], template=FEATURE_UPSERT_TEMPLATE)
+
+
+def _coerce(row: dict) -> dict:
+    return {
+        "transaction_id": row["transaction_id"],
+        "tx_count_5m": int(row["tx_count_5m"]),
+        "tx_count_1h": int(row["tx_count_1h"]),
+        "tx_count_24h": int(row["tx_count_24h"]),
+        "user_avg_amount": float(row["user_avg_amount"]),
+        "amount_vs_user_avg": float(row["amount_vs_user_avg"]),
+        "is_foreign_country": bool(row["is_foreign_country"]),
+        "device_user_count": int(row["device_user_count"]),
+        "merchant_fraud_rate": float(row["merchant_fraud_rate"]),
+        "category_fraud_rate": float(row["category_fraud_rate"]),
+        "ring_size": None if row.get("ring_size") is None else int(row["ring_size"]),
+        "ring_fraud_rate": None if row.get("ring_fraud_rate") is None else float(row["ring_fraud_rate"]),
+    }
+
+
+def attach_ring_features(rows) -> tuple | None:
+    """
+    Set ring_size / ring_fraud_rate on rows returned by COMPUTE_AND_UPSERT_SQL;
+    returns the RING_UPDATE_SQL arguments, or None when the entity graph is off.
+    """
+    if get_graph() is None:
+        return None
+    for r in rows:
+        r.update(ring_features_for(r["user_id"], r["device_id"], r["card_id"]))
+    return [r["tx_pk"] for r in rows], [r["ring_size"] for r in rows], [r["ring_fraud_rate"] for r in rows]
+
 
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST", "localhost"),
-    "database": os.getenv("DB_NAME", "frauddb"),
-    "user": os.getenv("DB_USER", "frauduser"),
-    "password": os.getenv("DB_PASSWORD", "fraudpass"),
-    "port": int(os.getenv("DB_PORT", "5432")),
-}
+def compute_and_upsert_in_transaction(cur, transaction_ids: list[str]) -> list[dict]:
+    """
+    COMPUTE_AND_UPSERT_SQL (plus the ring-feature update) on the caller's
+    RealDictCursor, inside the caller's transaction; the caller commits. Returns
+    the features in the order of transaction_ids; raises ValueError if one is
+    missing.
+    """
+    ids = list(dict.fromkeys(transaction_ids))  # upsert can't touch a row twice
+    execute_prepared(cur, "realtime_features_upsert", COMPUTE_AND_UPSERT_SQL, (ids,))
+    rows = cur.fetchall()
+    ring_args = attach_ring_features(rows)
+    if ring_args is not None:
+        execute_prepared(cur, "ring_features_update", RING_UPDATE_SQL, ring_args)
+    by_id = {r["transaction_id"]: _coerce(r) for r in rows}
+    if len(by_id) != len(ids):
+        raise ValueError("Transaction not found")
+    return [by_id[tx_id] for tx_id in transaction_ids]
 
-def get_conn():
-    return psycopg2.connect(**DB_CONFIG)
 
-def compute_and_upsert_features(transaction_id: str) -> dict:
+def _store_lookup(transaction_id: str, tx, ts) -> tuple[dict | None, bool]:
+    """(features, stale) from the online store; features is None on a miss."""
+    store = get_store()
+    if store is None or tx is None or ts is None:
+        return None, False
+    feats, stale = store.features_for(
+        transaction_id, tx.user_id, tx.device_id, tx.merchant, tx.merchant_category,
+        tx.amount, tx.country, ts,
+    )
+    if feats is not None:
+        feats.update(ring_features_for(tx.user_id, tx.device_id, tx.card_id))
+    return feats, stale
+
+
+def _features_from_store(transaction_id: str, tx, ts):
+    """
+    Online-store features for the normal scoring path. A stale store is not
+    trusted here: PostgreSQL is available, so the caller computes from SQL.
+    """
+    feats, stale = _store_lookup(transaction_id, tx, ts)
+    return None if stale else feats
+
+
+def _request_features(transaction_id: str, tx) -> dict:
+    """
+    What can be said about a transaction without any history: it is the only one in
+    its velocity windows, at the user's average amount, on a device with one user.
+    """
+    return {
+        "transaction_id": transaction_id,
+        "tx_count_5m": 1,
+        "tx_count_1h": 1,
+        "tx_count_24h": 1,
+        "user_avg_amount": float(tx.amount),
+        "amount_vs_user_avg": 1.0,
+        "is_foreign_country": False,
+        "device_user_count": 1,
+        "merchant_fraud_rate": 0.0,
+        "category_fraud_rate": 0.0,
+    }
+
+
+def features_from_memory(transaction_id: str, tx, ts) -> tuple[dict, str]:
+    """
+    Features without a database round trip, for degraded scoring: the online store
+    when it can answer, else _request_features(). Returns (features, source); the
+    source is "online_store_stale" when the store's catch-up is lagging, which
+    still beats request-only features while PostgreSQL is overloaded.
+    """
+    with STAGE_LATENCY.time(stage="feature_store_read"):
+        feats, stale = _store_lookup(transaction_id, tx, ts)
+    if feats is not None:
+        return feats, "online_store_stale" if stale else "online_store"
+    feats = _request_features(transaction_id, tx)
+    feats.update(ring_features_for(tx.user_id, tx.device_id, tx.card_id))
+    return feats, "request"
+
+
+def compute_and_upsert_features(transaction_id: str, tx=None, ts=None) -> dict:
+    """
+    tx/ts (the TransactionCreate and its timestamp) are optional; when given and
+    the online feature store is enabled, features are read from the store and
+    only the upsert goes to PostgreSQL.
+    """
+    if score_cache is not None:
+        score_cache.invalidate([transaction_id])
+    with STAGE_LATENCY.time(stage="feature_store_read"):
+        cached = _features_from_store(transaction_id, tx, ts)
+
     conn = get_conn()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # get base tx
-            cur.execute("""
-                SELECT transaction_id, user_id, device_id, merchant, merchant_category,
-                       amount, country, timestamp
-                FROM transactions
-                WHERE transaction_id = %s;
-            """, (transaction_id,))
-            tx = cur.fetchone()
-            if not tx:
-                raise ValueError("Transaction not found")
-
-            user_id = tx["user_id"]
-            device_id = tx["device_id"]
-            merchant = tx["merchant"]
-            category = tx["merchant_category"]
-            amount = float(tx["amount"])
-            country = tx["country"]
-            ts = tx["timestamp"]
-
-            # velocity (5m/1h/24h) up to this tx timestamp
-            cur.execute("""
-                SELECT
-                  COUNT(*) FILTER (WHERE timestamp >= %s - INTERVAL '5 minutes' AND timestamp <= %s)::int AS tx_count_5m,
-                  COUNT(*) FILTER (WHERE timestamp >= %s - INTERVAL '1 hour' AND timestamp <= %s)::int AS tx_count_1h,
-                  COUNT(*) FILTER (WHERE timestamp >= %s - INTERVAL '24 hours' AND timestamp <= %s)::int AS tx_count_24h
-                FROM transactions
-                WHERE user_id = %s;
-            """, (ts, ts, ts, ts, ts, ts, user_id))
-            vel = cur.fetchone()
-
-            # user avg amount (up to now)
-            cur.execute("""
-                SELECT COALESCE(AVG(amount), 0)::float AS avg_amt
-                FROM transactions
-                WHERE user_id = %s AND timestamp <= %s;
-            """, (user_id, ts))
-            user_avg = float(cur.fetchone()["avg_amt"])
-            amount_vs_avg = (amount / user_avg) if user_avg > 0 else 0.0
-
-            # home_country
-            cur.execute("SELECT home_country FROM users WHERE user_id = %s;", (user_id,))
-            row = cur.fetchone()
-            home = row["home_country"] if row else None
-            is_foreign = (home is not None) and (country != home)
-
-            # device reuse (# distinct users)
-            cur.execute("""
-                SELECT COUNT(DISTINCT user_id)::int AS cnt
-                FROM transactions
-                WHERE device_id = %s;
-            """, (device_id,))
-            device_user_count = int(cur.fetchone()["cnt"])
-
-            # merchant fraud rate
-            cur.execute("""
-                SELECT CASE WHEN COUNT(*) = 0 THEN 0
-                            ELSE (SUM(CASE WHEN is_fraud THEN 1 ELSE 0 END)::float / COUNT(*)::float)
-                       END AS rate
-                FROM transactions
-                WHERE merchant = %s;
-            """, (merchant,))
-            merchant_rate = float(cur.fetchone()["rate"])
-
-            # category fraud rate
-            cur.execute("""
-                SELECT CASE WHEN COUNT(*) = 0 THEN 0
-                            ELSE (SUM(CASE WHEN is_fraud THEN 1 ELSE 0 END)::float / COUNT(*)::float)
-                       END AS rate
-                FROM transactions
-                WHERE merchant_category = %s;
-            """, (category,))
-            category_rate = float(cur.fetchone()["rate"])
-
-            feats = {
-                "transaction_id": transaction_id,
-                "tx_count_5m": int(vel["tx_count_5m"]),
-                "tx_count_1h": int(vel["tx_count_1h"]),
-                "tx_count_24h": int(vel["tx_count_24h"]),
-                "user_avg_amount": float(user_avg),
-                "amount_vs_user_avg": float(amount_vs_avg),
-                "is_foreign_country": bool(is_foreign),
-                "device_user_count": int(device_user_count),
-                "merchant_fraud_rate": float(merchant_rate),
-                "category_fraud_rate": float(category_rate),
-            }
-
-            # upsert into feature store
-            cur.execute("""
-                INSERT INTO transaction_features (
-                    transaction_id,
-                    tx_count_5m, tx_count_1h, tx_count_24h,
-                    user_avg_amount, amount_vs_user_avg,
-                    is_foreign_country, device_user_count,
-                    merchant_fraud_rate, category_fraud_rate
-                ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-                ON CONFLICT (transaction_id) DO UPDATE SET
-                    tx_count_5m = EXCLUDED.tx_count_5m,
-                    tx_count_1h = EXCLUDED.tx_count_1h,
-                    tx_count_24h = EXCLUDED.tx_count_24h,
-                    user_avg_amount = EXCLUDED.user_avg_amount,
-                    amount_vs_user_avg = EXCLUDED.amount_vs_user_avg,
-                    is_foreign_country = EXCLUDED.is_foreign_country,
-                    device_user_count = EXCLUDED.device_user_count,
-                    merchant_fraud_rate = EXCLUDED.merchant_fraud_rate,
-                    category_fraud_rate = EXCLUDED.category_fraud_rate,
-                    created_at = NOW();
-            """, (
-                transaction_id,
-                feats["tx_count_5m"], feats["tx_count_1h"], feats["tx_count_24h"],
-                feats["user_avg_amount"], feats["amount_vs_user_avg"],
-                feats["is_foreign_country"], feats["device_user_count"],
-                feats["merchant_fraud_rate"], feats["category_fraud_rate"],
-            ))
-
-        conn.commit()
+            if cached is not None:
+                with STAGE_LATENCY.time(stage="feature_upsert"):
+                    _upsert_features(cur, [cached])
+                    conn.commit()
+                return cached
+
+            if REALTIME_FEATURES_SINGLE_STATEMENT:
+                with STAGE_LATENCY.time(stage="feature_queries"):
+                    feats = compute_and_upsert_in_transaction(cur, [transaction_id])[0]
+                    conn.commit()
+                return feats
+
+            with STAGE_LATENCY.time(stage="feature_queries"):
+                feats = _compute_features(cur, transaction_id)
+            with STAGE_LATENCY.time(stage="feature_upsert"):
+                _upsert_features(cur, [feats])
+                conn.commit()
+
         return feats
 
     finally:
         conn.close()
+
+
+def compute_and_upsert_features_batch(transaction_ids: list[str], rows=None) -> list[dict]:
+    """
+    Same features as compute_and_upsert_features, for many transactions at once:
+    one statement (or one multi-row upsert) and one commit for the whole batch.
+    rows, when given, are the (transaction_id, tx, timestamp) tuples just inserted
+    and let the online store answer for them. Results are returned in the order
+    of transaction_ids.
+    """
+    if not transaction_ids:
+        return []
+    if score_cache is not None:
+        score_cache.invalidate(transaction_ids)
+
+    known = {}
+    if rows is not None:
+        with STAGE_LATENCY.time(stage="feature_store_read"):
+            for tid, tx, ts in rows:
+                f = _features_from_store(tid, tx, ts)
+                if f is not None:
+                    known[tid] = f
+
+    conn = get_conn()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            if known:
+                with STAGE_LATENCY.time(stage="feature_upsert"):
+                    _upsert_features(cur, list(known.values()))
+            missing = [tid for tid in transaction_ids if tid not in known]
+            if missing:
+                with STAGE_LATENCY.time(stage="feature_queries"):
+                    if REALTIME_FEATURES_SINGLE_STATEMENT:
+                        computed = compute_and_upsert_in_transaction(cur, missing)
+                    else:
+                        computed = [_compute_features(cur, tx_id) for tx_id in missing]
+                        _upsert_features(cur, computed)
+                for f in computed:
+                    known[f["transaction_id"]] = f
+            conn.commit()
+
+        return [known[tid] for tid in transaction_ids]
+
+    finally:
+        conn.close()
@@ -1,18 +1,10 @@
 # ingestion/ingest_transactions.py
 
 import json
-import psycopg2
 from datetime import datetime
 
-DB_CONFIG = {
-    "host": "localhost",
-    "database": "frauddb",
-    "user": "frauduser",
-    "password": "fraudpass"
-}
-
-def connect():
-    return psycopg2.connect(**DB_CONFIG)
+from api.persistence import TRANSACTION_ROW_INSERT_SQL
+from common.db import connect
 
 def ingest(transactions_file):
     conn = connect()
@@ -72,15 +64,7 @@ def ingest(transactions_file):
 
     # Insert transactions
     for tx in transactions:
-        cur.execute("""
-            INSERT INTO transactions (
-                transaction_id, user_id, card_id, device_id, amount, currency,
-                merchant, merchant_category, country, timestamp,
-                is_fraud, fraud_reason
-            )
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (transaction_id) DO NOTHING;
-        """, (
+        cur.execute(TRANSACTION_ROW_INSERT_SQL + "\nON CONFLICT (transaction_id) DO NOTHING;", (
             tx["transaction_id"],
             tx["user_id"],
             tx["card_id"],
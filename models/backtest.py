@@ -0,0 +1,257 @@
+# models/backtest.py
+"""
+Offline replay and threshold backtest.
+
+Replays a date range in memory: point-in-time features (features.offline_features,
+the same engine training uses) for every transaction up to --end, the current
+model on the rows inside [--start, --end), then a sweep over candidate decision
+thresholds. Nothing goes through the API or touches the database beyond loading.
+
+    python -m models.backtest --start 2024-05-01 --end 2024-06-01
+    python -m models.backtest --start 2024-05-01 --block 80:98:2 --review 40:80:5 --csv sweep.csv
+    python -m models.backtest --snapshot --max-review-per-day 200
+
+Labels: the latest review outcome where an analyst has looked at the transaction
+(reject = fraud, approve = legitimate), is_fraud otherwise.
+
+The sweep is one histogram of risk scores (0-100) per label, turned into suffix
+sums, so every (block, review) pair is a couple of array lookups whatever the
+number of transactions. For each pair:
+
+  block_rate        share of transactions blocked
+  review_per_day    manual_review volume per day of the range
+  precision         fraud share among blocked / among flagged (blocked + reviewed)
+  recall            fraud blocked / fraud flagged, as a share of all fraud
+  fraud_amount      amount of fraud flagged
+
+The live thresholds are SCORE_BLOCK_THRESHOLD / SCORE_REVIEW_THRESHOLD (models/scoring.py).
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import time
+from datetime import datetime, timedelta
+
+import joblib
+import numpy as np
+
+from common.db import connect
+from features.entity_graph import RING_FEATURE_COLUMNS
+from features.offline_features import (
+    compute_point_in_time_features, compute_ring_features, load_transactions,
+    load_transactions_from_snapshot,
+)
+from features.realtime_features import FEATURE_COLUMNS
+from models.scoring import MODEL_PATH, BLOCK_THRESHOLD, REVIEW_THRESHOLD
+
+EPOCH = datetime(1970, 1, 1)
+
+LATEST_REVIEWS_SQL = """
+    SELECT t.transaction_id, a.action
+    FROM review_actions a
+    JOIN transactions t ON t.tx_pk = a.tx_pk
+    ORDER BY a.created_at, a.id;
+"""
+
+
+def _to_us(dt: datetime) -> int:
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def _select(data: dict, mask: np.ndarray) -> dict:
+    """Rows of `data` where mask is set; the *_values lookup arrays are shared."""
+    out = {"n": int(mask.sum())}
+    for k, v in data.items():
+        if k == "n" or k.endswith("_values"):
+            out.setdefault(k, v)
+        else:
+            out[k] = v[mask]
+    return out
+
+
+def load_review_outcomes(snapshot: bool = False) -> dict:
+    """{transaction_id: latest review action}."""
+    if snapshot:
+        from warehouse.snapshot import read_table
+
+        t = read_table("review_actions", columns=["id", "transaction_id", "action", "created_at"])
+        t = t.sort_by([("created_at", "ascending"), ("id", "ascending")])
+        return dict(zip(t["transaction_id"].to_pylist(), t["action"].to_pylist()))
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(LATEST_REVIEWS_SQL)
+            return dict(cur.fetchall())  # ordered by time, so the last action wins
+    finally:
+        conn.close()
+
+
+def replay(data: dict, start_us: int, bundle: dict, label_delay_s: float = 0.0):
+    """
+    Scores every transaction with ts >= start_us; features see all of `data`.
+    Returns (risk_scores, row index into data).
+    """
+    X = compute_point_in_time_features(data, label_delay_s=label_delay_s)
+    columns = list(FEATURE_COLUMNS)
+    if any(c in RING_FEATURE_COLUMNS for c in bundle["feature_cols"]):
+        X = np.hstack([X, compute_ring_features(data, label_delay_s=label_delay_s)])
+        columns += RING_FEATURE_COLUMNS
+    rows = np.flatnonzero(data["ts"] >= start_us)
+    X = X[rows][:, [columns.index(c) for c in bundle["feature_cols"]]]
+    probs = bundle["model"].predict_proba(X)[:, 1] if len(rows) else np.zeros(0)
+    # np.rint rounds half to even, like round() in the API
+    return np.rint(probs * 100).astype(np.int64), rows
+
+
+def _at_least(scores: np.ndarray, weights=None) -> np.ndarray:
+    """[k] = total weight of scores >= k, for k in 0..101."""
+    hist = np.bincount(scores, weights=weights, minlength=101)[:101]
+    return np.concatenate([np.cumsum(hist[::-1])[::-1], [0]])
+
+
+def sweep(scores, labels, amounts, block_thresholds, review_thresholds, days: float) -> list[dict]:
+    """Every (block, review) pair with review <= block, as report rows."""
+    fraud = labels.astype(bool)
+    n, n_fraud = len(scores), int(fraud.sum())
+    every = _at_least(scores)
+    frauds = _at_least(scores[fraud])
+    fraud_amount = _at_least(scores[fraud], amounts[fraud])
+
+    B = np.asarray(block_thresholds)[:, None]
+    R = np.asarray(review_thresholds)[None, :]
+    B, R = np.broadcast_arrays(B, R)
+    keep = R <= B
+    B, R = B[keep], R[keep]
+
+    blocked, flagged = every[B], every[R]
+    fraud_blocked, fraud_flagged = frauds[B], frauds[R]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = {
+            "block": B,
+            "review": R,
+            "block_rate": blocked / max(n, 1),
+            "review_per_day": (flagged - blocked) / max(days, 1e-9),
+            "block_precision": fraud_blocked / blocked,
+            "flag_precision": fraud_flagged / flagged,
+            "block_recall": fraud_blocked / max(n_fraud, 1),
+            "flag_recall": fraud_flagged / max(n_fraud, 1),
+            "fraud_caught": fraud_flagged,
+            "fraud_amount": fraud_amount[R],
+        }
+    return [
+        {k: (int(v[i]) if k in ("block", "review", "fraud_caught") else float(v[i])) for k, v in result.items()}
+        for i in range(len(B))
+    ]
+
+
+def _thresholds(spec: str) -> list[int]:
+    """"80,85,90" or "start:stop:step" (stop inclusive)."""
+    if ":" in spec:
+        start, stop, *step = (int(p) for p in spec.split(":"))
+        values = list(range(start, stop + 1, step[0] if step else 1))
+    else:
+        values = [int(p) for p in spec.split(",")]
+    if not values or min(values) < 0 or max(values) > 100:
+        raise argparse.ArgumentTypeError(f"thresholds must be risk scores in 0..100: {spec!r}")
+    return values
+
+
+def _fmt(v: float, pct: bool = True) -> str:
+    if v != v:  # NaN: nothing in that bucket
+        return "-"
+    return f"{100 * v:.1f}%" if pct else f"{v:.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay history through the model and sweep decision thresholds.")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="first day scored (default: all history)")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="exclusive end (default: all history)")
+    parser.add_argument("--snapshot", action="store_true", help="read from the columnar snapshot, not Postgres")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--label-delay-hours", type=float, default=0.0,
+                        help="labels count towards fraud-rate features this long after the transaction")
+    parser.add_argument("--block", type=_thresholds, default=_thresholds("70:98:2"))
+    parser.add_argument("--review", type=_thresholds, default=_thresholds("30:90:5"))
+    parser.add_argument("--max-review-per-day", type=float, help="only show pairs within this review volume")
+    parser.add_argument("--min-block-precision", type=float, help="only show pairs at least this precise (0-1)")
+    parser.add_argument("--top", type=int, default=25, help="rows to print, by fraud caught")
+    parser.add_argument("--csv", help="write every swept pair to this file")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.snapshot:
+        data = load_transactions_from_snapshot()
+    else:
+        conn = connect()
+        try:
+            data = load_transactions(conn)
+        finally:
+            conn.close()
+    outcomes = load_review_outcomes(snapshot=args.snapshot)
+    if data["n"] and args.end is not None:
+        data = _select(data, data["ts"] < _to_us(args.end))
+    t_load = time.perf_counter() - t0
+    if not data["n"]:
+        print("No transactions in range.")
+        return
+
+    bundle = joblib.load(args.model)
+    start_us = _to_us(args.start) if args.start else int(data["ts"].min())
+    scores, rows = replay(data, start_us, bundle, label_delay_s=args.label_delay_hours * 3600.0)
+    t_replay = time.perf_counter() - t0 - t_load
+    if not len(rows):
+        print("No transactions in range.")
+        return
+
+    ids = data["transaction_id"][rows]
+    labels = data["is_fraud"][rows].copy()
+    reviewed = 0
+    for i, tid in enumerate(ids):
+        action = outcomes.get(tid)
+        if action is not None:
+            labels[i] = 1 if action == "reject" else 0
+            reviewed += 1
+    amounts = data["amount"][rows]
+    ts = data["ts"][rows]
+    days = max((int(ts.max()) - start_us) / 86_400e6, 1.0)
+
+    t1 = time.perf_counter()
+    results = sweep(scores, labels, amounts, args.block, args.review, days)
+    t_sweep = time.perf_counter() - t1
+
+    print(f"Replayed {len(rows)} transactions over {days:.1f} days "
+          f"({int(labels.sum())} fraud, {reviewed} with a review outcome); "
+          f"load {t_load:.1f}s, features+model {t_replay:.1f}s, sweep of {len(results)} pairs {t_sweep * 1000:.1f} ms")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+
+    current = next((r for r in results if (r["block"], r["review"]) == (BLOCK_THRESHOLD, REVIEW_THRESHOLD)), None)
+    shown = [
+        r for r in results
+        if (args.max_review_per_day is None or r["review_per_day"] <= args.max_review_per_day)
+        and (args.min_block_precision is None or r["block_precision"] >= args.min_block_precision)
+    ]
+    shown.sort(key=lambda r: (-r["fraud_caught"], r["review_per_day"], r["block_rate"]))
+    shown = shown[:args.top]
+    if current is not None and current not in shown:
+        shown.append(current)
+
+    print(f"  {'block':>5} {'review':>6} {'block%':>7} {'review/day':>10} {'prec(blk)':>9} {'prec(flag)':>10} "
+          f"{'rec(blk)':>8} {'rec(flag)':>9} {'caught':>7} {'fraud amount':>13}")
+    for r in shown:
+        mark = "*" if r is current else " "
+        print(f"{mark} {r['block']:>5} {r['review']:>6} {_fmt(r['block_rate']):>7} "
+              f"{_fmt(r['review_per_day'], pct=False):>10} {_fmt(r['block_precision']):>9} "
+              f"{_fmt(r['flag_precision']):>10} {_fmt(r['block_recall']):>8} {_fmt(r['flag_recall']):>9} "
+              f"{r['fraud_caught']:>7} {r['fraud_amount']:>13.2f}")
+    if current is not None:
+        print("* current thresholds (SCORE_BLOCK_THRESHOLD / SCORE_REVIEW_THRESHOLD)")
+
+
+if __name__ == "__main__":
+    main()
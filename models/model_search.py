@@ -0,0 +1,185 @@
+# models/model_search.py
+"""
+Cross-validated model search for train_model --search.
+
+The feature matrix is cached under TRAINING_CACHE_DIR, keyed by the source,
+label delay and feature set plus a fingerprint of the data (transaction and
+review counts / high-water marks, or the snapshot state), so repeated searches
+skip the COPY + point-in-time pass until new data arrives.
+
+Every (candidate, fold) pair is an independent task run with joblib across all
+cores; estimators are single-threaded inside a task so the pool doesn't
+oversubscribe. The same seed drives the holdout split, the fold assignment and
+every estimator's random_state, so a rerun on the same cache reproduces the
+leaderboard exactly (timings aside).
+
+    python -m models.train_model --search
+    python -m models.train_model --search --families logreg,hgb --folds 3 --jobs 8
+"""
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import average_precision_score, roc_auc_score
+from sklearn.model_selection import StratifiedKFold
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+from features.offline_features import OFFLINE_FEATURES_VERSION
+
+TRAINING_CACHE_DIR = os.getenv("TRAINING_CACHE_DIR", "data/training_cache")
+
+METRICS = {"average_precision": average_precision_score, "roc_auc": roc_auc_score}
+
+
+def candidates(seed: int, families=None) -> list[dict]:
+    """{family, params, estimator} for every point of the search grid."""
+    grid = []
+    for c in (0.01, 0.1, 1.0, 10.0):
+        grid.append(("logreg", {"C": c}, Pipeline([
+            ("scaler", StandardScaler()),
+            ("clf", LogisticRegression(C=c, max_iter=2000, class_weight="balanced", random_state=seed)),
+        ])))
+    for depth in (8, 16, None):
+        for leaf in (1, 5):
+            grid.append(("random_forest", {"max_depth": depth, "min_samples_leaf": leaf}, RandomForestClassifier(
+                n_estimators=300, max_depth=depth, min_samples_leaf=leaf,
+                class_weight="balanced_subsample", n_jobs=1, random_state=seed,
+            )))
+    for lr in (0.05, 0.1):
+        for leaves in (15, 31, 63):
+            grid.append(("hist_gradient_boosting", {"learning_rate": lr, "max_leaf_nodes": leaves},
+                         HistGradientBoostingClassifier(
+                             learning_rate=lr, max_leaf_nodes=leaves, max_iter=300, early_stopping=True,
+                             class_weight="balanced", random_state=seed,
+                         )))
+    aliases = {"logreg": "logreg", "rf": "random_forest", "hgb": "hist_gradient_boosting"}
+    wanted = None if not families else {aliases.get(f, f) for f in families}
+    return [
+        {"family": family, "params": params, "estimator": est}
+        for family, params, est in grid
+        if wanted is None or family in wanted
+    ]
+
+
+# ---------- feature matrix cache ----------
+
+def _fingerprint(source: str) -> dict:
+    if source == "snapshot":
+        from warehouse.snapshot import SNAPSHOT_DIR
+
+        fp = {}
+        for table in ("transactions", "review_actions"):
+            try:
+                with open(os.path.join(SNAPSHOT_DIR, table, "_state.json")) as f:
+                    fp[table] = json.load(f)
+            except FileNotFoundError:
+                fp[table] = None
+        return fp
+
+    from common.db import connect
+
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            # rejections flip is_fraud and always add a review_actions row; every
+            # feature upsert (recomputes and backfills included) sets created_at
+            cur.execute("""
+                SELECT (SELECT COUNT(*) FROM transactions), (SELECT MAX(tx_pk) FROM transactions),
+                       (SELECT COUNT(*) FROM review_actions), (SELECT MAX(id) FROM review_actions),
+                       (SELECT COUNT(*) FROM transaction_features), (SELECT MAX(created_at) FROM transaction_features);
+            """)
+            tx_count, tx_max, review_count, review_max, feat_count, feat_max = cur.fetchone()
+        conn.rollback()
+    finally:
+        conn.close()
+    return {
+        "transactions": [tx_count, tx_max],
+        "review_actions": [review_count, review_max],
+        "transaction_features": [feat_count, feat_max],
+    }
+
+
+def cached_matrix(load, source: str, label_delay_s: float, feature_cols, refresh: bool = False):
+    """
+    (X, y, cache path, hit): load() -> (X, y) runs only when no cache file matches
+    the current data.
+    """
+    key = json.dumps({
+        "source": source,
+        "label_delay_s": label_delay_s,
+        "feature_cols": list(feature_cols),
+        "definitions": None if source == "table" else OFFLINE_FEATURES_VERSION,
+        "data": _fingerprint(source),
+    }, sort_keys=True, default=str)
+    path = os.path.join(TRAINING_CACHE_DIR, hashlib.sha1(key.encode()).hexdigest()[:16] + ".npz")
+    if not refresh and os.path.exists(path):
+        with np.load(path) as f:
+            return f["X"], f["y"], path, True
+
+    X, y = load()
+    os.makedirs(TRAINING_CACHE_DIR, exist_ok=True)
+    tmp = f"{path}.tmp-{os.getpid()}.npz"
+    np.savez(tmp, X=X, y=y)
+    os.replace(tmp, path)
+    return X, y, path, False
+
+
+# ---------- search ----------
+
+def _fit_fold(i: int, estimator, X, y, train_idx, test_idx) -> dict:
+    started = time.time()
+    t0 = time.perf_counter()
+    model = clone(estimator).fit(X[train_idx], y[train_idx])
+    fit_s = time.perf_counter() - t0
+    probs = model.predict_proba(X[test_idx])[:, 1]
+    return {
+        "candidate": i,
+        "fit_seconds": fit_s,
+        "started": started,
+        "finished": time.time(),
+        **{name: float(fn(y[test_idx], probs)) for name, fn in METRICS.items()},
+    }
+
+
+def search(X, y, cands: list[dict], folds: int = 5, seed: int = 42, n_jobs: int = -1,
+           metric: str = "average_precision") -> list[dict]:
+    """Leaderboard rows, best first by the mean of `metric` over the folds."""
+    splits = list(StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed).split(X, y))
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_fold)(i, c["estimator"], X, y, tr, te)
+        for i, c in enumerate(cands)
+        for tr, te in splits
+    )
+
+    board = []
+    for i, c in enumerate(cands):
+        runs = [r for r in results if r["candidate"] == i]
+        row = {"candidate": i, "family": c["family"], "params": c["params"]}
+        for name in METRICS:
+            scores = np.array([r[name] for r in runs])
+            row[f"cv_{name}_mean"] = float(scores.mean())
+            row[f"cv_{name}_std"] = float(scores.std())
+        row["fit_seconds"] = float(sum(r["fit_seconds"] for r in runs))
+        # first fold start to last fold end, with the other candidates sharing the pool
+        row["wall_seconds"] = float(max(r["finished"] for r in runs) - min(r["started"] for r in runs))
+        board.append(row)
+    board.sort(key=lambda r: -r[f"cv_{metric}_mean"])
+    for rank, row in enumerate(board, 1):
+        row["rank"] = rank
+    return board
+
+
+def print_leaderboard(board: list[dict], metric: str, limit: int = 20) -> None:
+    print(f"{'#':>3} {'family':<24} {'params':<42} {metric + ' (cv)':>26} {'fit s':>8} {'wall s':>8}")
+    for row in board[:limit]:
+        params = ", ".join(f"{k}={v}" for k, v in row["params"].items())
+        score = f"{row[f'cv_{metric}_mean']:.4f} ± {row[f'cv_{metric}_std']:.4f}"
+        print(f"{row['rank']:>3} {row['family']:<24} {params:<42} {score:>26} "
+              f"{row['fit_seconds']:>8.1f} {row['wall_seconds']:>8.1f}")
@@ -0,0 +1,158 @@
+# models/score_cache.py
+import logging
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from common.metrics import Counter
+
+SCORE_CACHE_SIZE = int(os.getenv("SCORE_CACHE_SIZE", "100000"))
+SCORE_CACHE_TTL_S = float(os.getenv("SCORE_CACHE_TTL_S", "300"))
+# LISTEN for assessment changes made by other processes (database/score_cache.sql)
+SCORE_CACHE_LISTEN = os.getenv("SCORE_CACHE_LISTEN", "1") == "1"
+SCORE_CACHE_CHANNEL = "score_cache_invalidate"
+
+log = logging.getLogger("fraud.score_cache")
+
+LOOKUPS = Counter(
+    "fraud_score_cache_lookups_total",
+    "Score cache lookups by endpoint kind and result.",
+    labels=("kind", "result"),
+)
+
+
+class ScoreCache:
+    """
+    In-process LRU/TTL cache of scoring results, one entry per transaction.
+
+    An entry remembers the model version and the transaction_features.created_at
+    it was computed from; a lookup only hits when both still match, so recomputed
+    features or a new model artifact can never be served from a stale entry.
+    Entries written alongside a risk_assessments row (persisted=True) also answer
+    assessment lookups, including ones still waiting in the write-behind queue.
+
+    Recomputing features and review actions invalidate() explicitly. Changes
+    made by other processes arrive through listen(): a trigger on risk_assessments
+    NOTIFYs the ids of updated rows. While the listener is disconnected, the TTL
+    bounds how long such a change can go unnoticed, and the cache is cleared
+    when it reconnects.
+    """
+
+    def __init__(self, capacity: int = SCORE_CACHE_SIZE, ttl_s: float = SCORE_CACHE_TTL_S):
+        self._capacity = capacity
+        self._ttl_s = ttl_s
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def _get(self, transaction_id: str, kind: str, match) -> dict | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(transaction_id)
+            if entry is not None and (now > entry["expires"] or not match(entry)):
+                if now > entry["expires"]:
+                    del self._entries[transaction_id]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(transaction_id)
+        LOOKUPS.inc(kind=kind, result="hit" if entry is not None else "miss")
+        return entry
+
+    def get_score(self, transaction_id: str, model_version: str, features_created_at) -> dict | None:
+        return self._get(
+            transaction_id, "score",
+            lambda e: e["model_version"] == model_version and e["features_created_at"] == features_created_at,
+        )
+
+    def get_assessment(self, transaction_id: str, model_version: str) -> dict | None:
+        return self._get(
+            transaction_id, "assessment",
+            lambda e: e["persisted"] and e["model_version"] == model_version,
+        )
+
+    def put(self, transaction_id: str, prob: float, risk_score: int, decision: str, reasons,
+            model_version: str, features_created_at=None, persisted: bool = False) -> None:
+        entry = {
+            "transaction_id": transaction_id,
+            "fraud_probability": float(prob),
+            "risk_score": int(risk_score),
+            "decision": decision,
+            "reasons": reasons,
+            "created_at": datetime.utcnow(),
+            "model_version": model_version,
+            "features_created_at": features_created_at,
+            "persisted": persisted,
+            "expires": time.monotonic() + self._ttl_s,
+        }
+        with self._lock:
+            self._entries[transaction_id] = entry
+            self._entries.move_to_end(transaction_id)
+            while len(self._entries) > self._capacity:
+                self._entries.popitem(last=False)
+
+    def put_assessments(self, assessments, model_version: str) -> None:
+        """(transaction_id, prob, risk_score, decision, reasons) rows just written or queued."""
+        for a in assessments:
+            self.put(*a, model_version=model_version, persisted=True)
+
+    def invalidate(self, transaction_ids) -> None:
+        with self._lock:
+            for tid in transaction_ids:
+                self._entries.pop(tid, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def listen(self, connect) -> None:
+        """Start the invalidation listener (once per process); connect() opens a psycopg2 connection."""
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(target=self._listen_loop, args=(connect,),
+                                              name="score-cache-listener", daemon=True)
+        self._listener.start()
+
+    def _listen_loop(self, connect) -> None:
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        delay = 1.0
+        while True:
+            conn = None
+            try:
+                conn = connect()
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {SCORE_CACHE_CHANNEL};")
+                # changes made while nobody was listening are unknown
+                self.clear()
+                delay = 1.0
+                while True:
+                    if select.select([conn], [], [], 60.0) != ([], [], []):
+                        conn.poll()
+                        for n in conn.notifies:
+                            self.invalidate(n.payload.split(","))
+                        conn.notifies.clear()
+            except Exception as exc:
+                log.warning("score cache listener disconnected (%s); retrying in %.0fs", exc, delay)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+            time.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# Shared by the API endpoints, the batcher and the bulk loader; None when disabled
+score_cache = ScoreCache() if SCORE_CACHE_SIZE > 0 else None
+
+
+def assessment_view(entry: dict) -> dict:
+    """A cache entry in the shape of a risk_assessments row."""
+    return {k: entry[k] for k in
+            ("transaction_id", "fraud_probability", "risk_score", "decision", "reasons", "created_at")}
@@ -1,27 +1,77 @@
 # models/scoring.py
 import math
+import os
 import joblib
 import numpy as np
 
+from common.metrics import STAGE_LATENCY
+from models.shadow import shadow_scorer
+
 MODEL_PATH = "models/artifacts/fraud_model.joblib"
 _model_bundle = None
+_model_version = None
+
+# risk_score cut-offs; python -m models.backtest sweeps candidates against history
+BLOCK_THRESHOLD = int(os.getenv("SCORE_BLOCK_THRESHOLD", "90"))
+REVIEW_THRESHOLD = int(os.getenv("SCORE_REVIEW_THRESHOLD", "60"))
+
+def bundle_version(bundle: dict, path: str) -> str:
+    # artifacts from older train_model runs carry no version; fall back to the file's identity
+    st = os.stat(path)
+    return str(bundle.get("version") or f"{st.st_mtime_ns}-{st.st_size}")
 
 def load_bundle():
-    global _model_bundle
+    global _model_bundle, _model_version
     if _model_bundle is None:
         _model_bundle = joblib.load(MODEL_PATH)
+        _model_version = bundle_version(_model_bundle, MODEL_PATH)
     return _model_bundle
 
+def model_version() -> str:
+    load_bundle()
+    return _model_version
+
 def _vectorize(feature_row: dict, cols: list[str]) -> np.ndarray:
     x = []
     for c in cols:
         v = feature_row[c]
+        if v is None:
+            # e.g. ring_size from a model trained with --ring-features while ENTITY_GRAPH is off
+            raise ValueError(f"model feature {c!r} was not computed for this transaction")
         if c == "is_foreign_country":
             x.append(1.0 if v else 0.0)
         else:
             x.append(float(v))
     return np.array(x, dtype=float)
 
+def _linear_parts(model):
+    """(scaler, clf) for Pipeline(StandardScaler -> linear classifier), else None."""
+    steps = getattr(model, "named_steps", None)
+    if steps is None or "scaler" not in steps or not hasattr(steps.get("clf"), "coef_"):
+        return None
+    return steps["scaler"], steps["clf"]
+
+def _logit(p: np.ndarray) -> np.ndarray:
+    p = np.clip(p, 1e-9, 1.0 - 1e-9)
+    return np.log(p / (1.0 - p))
+
+def _occlusion(bundle: dict, X: np.ndarray):
+    """
+    Contributions for models without coefficients (tree ensembles from
+    train_model --search): the log-odds change when a feature is replaced by its
+    training mean, all rows x features in one predict_proba call.
+    Returns (probs, contributions).
+    """
+    n, f = X.shape
+    baseline = np.asarray(bundle.get("baseline", np.zeros(f)), dtype=float)
+    occluded = np.repeat(X[:, None, :], f, axis=1)  # (n, f, f)
+    idx = np.arange(f)
+    occluded[:, idx, idx] = baseline
+    probs = bundle["model"].predict_proba(np.vstack([X, occluded.reshape(n * f, f)]))[:, 1]
+    base = _logit(probs[:n])
+    contributions = base[:, None] - _logit(probs[n:]).reshape(n, f)
+    return probs[:n], contributions
+
 def score_from_features(feature_row: dict) -> float:
     """
     Returns probability of fraud (0..1)
@@ -29,20 +79,29 @@ def score_from_features(feature_row: dict) -> float:
     bundle = load_bundle()
     model = bundle["model"]
     cols = bundle["feature_cols"]
-    X = np.array([_vectorize(feature_row, cols)], dtype=float)
-    return float(model.predict_proba(X)[0, 1])
+    with STAGE_LATENCY.time(stage="inference"):
+        X = np.array([_vectorize(feature_row, cols)], dtype=float)
+        return float(model.predict_proba(X)[0, 1])
 
 def score_with_reasons(feature_row: dict, top_k: int = 3):
+    with STAGE_LATENCY.time(stage="inference"):
+        prob, reasons = _score_with_reasons(feature_row, top_k)
+    if shadow_scorer is not None:
+        shadow_scorer.submit([feature_row], [prob])
+    return prob, reasons
+
+def _score_with_reasons(feature_row: dict, top_k: int = 3):
     """
     Explainability for LogisticRegression inside Pipeline(StandardScaler -> LogisticRegression).
     Produces top contributing features (approx) using scaled-feature linear contributions.
+    Any other model is explained by occlusion (_occlusion).
     """
     bundle = load_bundle()
-    pipe = bundle["model"]
     cols = bundle["feature_cols"]
-
-    scaler = pipe.named_steps["scaler"]
-    clf = pipe.named_steps["clf"]
+    linear = _linear_parts(bundle["model"])
+    if linear is None:
+        return _score_batch_with_reasons([feature_row], top_k)[0]
+    scaler, clf = linear
 
     x = _vectorize(feature_row, cols)
     z = (x - scaler.mean_) / scaler.scale_  # scaled features
@@ -65,3 +124,54 @@ def score_with_reasons(feature_row: dict, top_k: int = 3):
         })
 
     return prob, reasons
+
+def score_batch_with_reasons(feature_rows: list[dict], top_k: int = 3):
+    with STAGE_LATENCY.time(stage="inference"):
+        results = _score_batch_with_reasons(feature_rows, top_k)
+    if shadow_scorer is not None:
+        shadow_scorer.submit(feature_rows, [prob for prob, _ in results])
+    return results
+
+def _score_batch_with_reasons(feature_rows: list[dict], top_k: int = 3):
+    """
+    Vectorized score_with_reasons: one matrix pass for many feature rows.
+    Returns a list of (prob, reasons) tuples in the order of feature_rows.
+    """
+    if not feature_rows:
+        return []
+
+    bundle = load_bundle()
+    cols = bundle["feature_cols"]
+
+    X = np.array([_vectorize(r, cols) for r in feature_rows], dtype=float)
+    linear = _linear_parts(bundle["model"])
+    if linear is None:
+        probs, contributions = _occlusion(bundle, X)
+    else:
+        scaler, clf = linear
+        Z = (X - scaler.mean_) / scaler.scale_
+
+        contributions = Z * clf.coef_[0]  # shape (n_rows, n_features)
+        logits = float(clf.intercept_[0]) + contributions.sum(axis=1)
+        probs = 1.0 / (1.0 + np.exp(-logits))
+
+    top = np.argsort(np.abs(contributions), axis=1)[:, ::-1][:, :top_k]
+    results = []
+    for row, idxs in enumerate(top):
+        reasons = [{
+            "feature": cols[int(i)],
+            "value": float(X[row, int(i)]),
+            "contribution": float(contributions[row, int(i)]),
+        } for i in idxs]
+        results.append((float(probs[row]), reasons))
+
+    return results
+
+def decide(risk_score: int) -> str:
+    if risk_score >= BLOCK_THRESHOLD:
+        decision = "block"
+    elif risk_score >= REVIEW_THRESHOLD:
+        decision = "manual_review"
+    else:
+        decision = "approve"
+    return decision
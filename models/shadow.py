@@ -0,0 +1,240 @@
+# models/shadow.py
+"""
+Shadow (challenger) scoring.
+
+Challenger bundles listed in SHADOW_MODELS score the same feature rows as the
+champion, on a background thread: the scoring path only does a hash-based
+sampling check and a non-blocking queue put, and when the queue is full the row
+is dropped from the shadow sample rather than waiting. The thread batches rows,
+runs one predict_proba per challenger per batch and writes shadow_scores
+(database/shadow_scores.sql):
+
+    tx_pk, model_id -> champion_score, challenger_score, challenger_prob
+
+Sampling hashes the transaction id, so every worker (and the batch, bulk and
+queue paths) agrees on which transactions are in the sample. The thread is
+started on the first submit in each process, so forked workers (uvicorn
+--workers, the scoring worker pool) get their own instead of a queue nobody
+drains. Rows whose
+transaction isn't committed yet (degraded-mode scoring) are skipped.
+
+    SHADOW_MODELS="lr_c01=models/artifacts/lr_c01.joblib,gbt=models/artifacts/gbt.joblib"
+
+GET /monitoring/shadow reports agreement and lift per challenger.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+
+import joblib
+import numpy as np
+from psycopg2.extras import execute_values
+
+from common.metrics import DB_ERRORS, Counter, CallbackMetric
+
+SHADOW_MODELS = os.getenv("SHADOW_MODELS", "")
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "1.0"))
+SHADOW_QUEUE_MAX = int(os.getenv("SHADOW_QUEUE_MAX", "20000"))
+SHADOW_FLUSH_SIZE = int(os.getenv("SHADOW_FLUSH_SIZE", "500"))
+SHADOW_FLUSH_INTERVAL_MS = float(os.getenv("SHADOW_FLUSH_INTERVAL_MS", "200"))
+
+log = logging.getLogger("fraud.shadow")
+
+SHADOW_ROWS = Counter(
+    "fraud_shadow_rows_total",
+    "Rows offered to shadow scoring, by outcome (queued, dropped, scored, failed).",
+    labels=("outcome",),
+)
+
+REGISTER_MODEL_SQL = """
+    INSERT INTO shadow_models (name, version) VALUES (%s, %s)
+    ON CONFLICT (name, version) DO UPDATE SET name = EXCLUDED.name
+    RETURNING id;
+"""
+
+INSERT_SCORES_SQL = """
+    INSERT INTO shadow_scores (tx_pk, model_id, champion_score, challenger_score, challenger_prob)
+    SELECT t.tx_pk, s.model_id, s.champion_score, s.challenger_score, s.challenger_prob
+    FROM (VALUES %s) AS s(transaction_id, model_id, champion_score, challenger_score, challenger_prob)
+    JOIN transactions t ON t.transaction_id = s.transaction_id
+    ON CONFLICT (tx_pk, model_id) DO UPDATE SET
+        champion_score = EXCLUDED.champion_score,
+        challenger_score = EXCLUDED.challenger_score,
+        challenger_prob = EXCLUDED.challenger_prob,
+        created_at = NOW();
+"""
+
+
+def parse_models(spec: str) -> dict:
+    """"name=path,..." (a bare path is named after its file) -> {name: path}."""
+    models = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        name, sep, path = item.partition("=")
+        if not sep:
+            name, path = os.path.splitext(os.path.basename(item))[0], item
+        models[name.strip()] = path.strip()
+    return models
+
+
+def in_sample(transaction_id: str, rate: float) -> bool:
+    if rate >= 1.0:
+        return True
+    return zlib.crc32(transaction_id.encode()) < rate * 0x1_0000_0000
+
+
+class ShadowScorer:
+    def __init__(
+        self,
+        get_conn,
+        models: dict,
+        sample_rate: float = SHADOW_SAMPLE_RATE,
+        max_queue: int = SHADOW_QUEUE_MAX,
+        flush_size: int = SHADOW_FLUSH_SIZE,
+        flush_interval_ms: float = SHADOW_FLUSH_INTERVAL_MS,
+    ):
+        self._get_conn = get_conn
+        self._paths = models
+        self._sample_rate = sample_rate
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._flush_size = flush_size
+        self._flush_interval_s = flush_interval_ms / 1000.0
+        self._challengers = None  # [(model_id, name, bundle)], loaded by the thread
+        self._closed = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        # the parent's thread didn't come along; neither should its queue or locks
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._thread = threading.Thread(target=self._run, name="shadow-scorer", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def submit(self, feature_rows, probs) -> None:
+        """Called by the champion right after scoring; never blocks."""
+        self._ensure_thread()
+        for row, prob in zip(feature_rows, probs):
+            tid = row.get("transaction_id")
+            if tid is None or not in_sample(tid, self._sample_rate):
+                continue
+            try:
+                self._queue.put_nowait((tid, row, int(round(prob * 100))))
+                SHADOW_ROWS.inc(outcome="queued")
+            except queue.Full:
+                SHADOW_ROWS.inc(outcome="dropped")
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def close(self, timeout: float = 5.0) -> None:
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def _load(self) -> list:
+        from models.scoring import bundle_version
+
+        challengers = []
+        conn = self._get_conn()
+        try:
+            with conn.cursor() as cur:
+                for name, path in self._paths.items():
+                    bundle = joblib.load(path)
+                    cur.execute(REGISTER_MODEL_SQL, (name, bundle_version(bundle, path)))
+                    challengers.append((cur.fetchone()[0], name, bundle))
+            conn.commit()
+        finally:
+            conn.close()
+        log.info("shadow scoring with %s", ", ".join(name for _, name, _ in challengers))
+        return challengers
+
+    def _drain(self) -> list:
+        items = []
+        deadline = time.monotonic() + self._flush_interval_s
+        while len(items) < self._flush_size:
+            remaining = deadline - time.monotonic()
+            try:
+                items.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while not (self._closed.is_set() and self._queue.empty()):
+            items = self._drain()
+            if not items:
+                continue
+            try:
+                if self._challengers is None:
+                    self._challengers = self._load()
+                self._flush(items)
+                SHADOW_ROWS.inc(len(items), outcome="scored")
+            except Exception as exc:
+                DB_ERRORS.inc(kind=f"shadow_flush:{type(exc).__name__}")
+                SHADOW_ROWS.inc(len(items), outcome="failed")
+                log.exception("shadow scoring failed for %d rows", len(items))
+                time.sleep(min(5.0, self._flush_interval_s * 10))
+
+    def _flush(self, items) -> None:
+        from models.scoring import _vectorize
+
+        # one upsert can't touch a row twice; the latest rescoring wins
+        items = list({tid: (tid, feats, score) for tid, feats, score in items}.values())
+        values = []
+        for model_id, name, bundle in self._challengers:
+            cols = bundle["feature_cols"]
+            rows, X = [], []
+            for tid, feats, champion_score in items:
+                try:
+                    X.append(_vectorize(feats, cols))
+                    rows.append((tid, champion_score))
+                except (KeyError, ValueError):
+                    continue  # feature the challenger needs wasn't computed for this row
+            if not rows:
+                continue
+            probs = bundle["model"].predict_proba(np.array(X, dtype=float))[:, 1]
+            values.extend(
+                (tid, model_id, champion_score, int(round(p * 100)), float(p))
+                for (tid, champion_score), p in zip(rows, probs)
+            )
+        if not values:
+            return
+        conn = self._get_conn()
+        try:
+            with conn.cursor() as cur:
+                execute_values(cur, INSERT_SCORES_SQL, values)
+            conn.commit()
+        finally:
+            conn.close()
+
+
+def _make_scorer():
+    models = parse_models(SHADOW_MODELS)
+    if not models:
+        return None
+    from common.db import get_conn
+
+    return ShadowScorer(get_conn, models)
+
+
+shadow_scorer = _make_scorer()
+
+CallbackMetric(
+    "fraud_shadow_queue_depth",
+    "Feature rows waiting for challenger scoring.",
+    lambda: shadow_scorer.depth() if shadow_scorer else None,
+)
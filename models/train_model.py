@@ -1,23 +1,24 @@
 # models/train_model.py
+import argparse
+import json
 import os
+import time
+from datetime import datetime
 import joblib
 import numpy as np
-import psycopg2
 from psycopg2.extras import RealDictCursor
 
+from sklearn.base import clone
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import classification_report, roc_auc_score
+from sklearn.metrics import classification_report, roc_auc_score, average_precision_score
 from sklearn.linear_model import LogisticRegression
 from sklearn.preprocessing import StandardScaler
 from sklearn.pipeline import Pipeline
 
-DB_CONFIG = {
-    "host": "localhost",
-    "database": "frauddb",
-    "user": "frauduser",
-    "password": "fraudpass",
-    "port": 5432,
-}
+from common.db import connect
+from features.entity_graph import RING_FEATURE_COLUMNS
+from features.offline_features import build_training_matrix
+from models.model_search import METRICS, candidates, cached_matrix, search, print_leaderboard
 
 FEATURE_COLS = [
     "tx_count_5m",
@@ -31,24 +32,25 @@ FEATURE_COLS = [
     "category_fraud_rate",
 ]
 
-def fetch_training_data():
-    conn = psycopg2.connect(**DB_CONFIG)
+def fetch_training_data(feature_cols=FEATURE_COLS):
+    conn = connect()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(f"""
                 SELECT
                     f.transaction_id,
-                    {", ".join("f."+c for c in FEATURE_COLS)},
+                    {", ".join("f."+c for c in feature_cols)},
                     t.is_fraud::int AS label
                 FROM transaction_features f
-                JOIN transactions t ON t.transaction_id = f.transaction_id;
+                JOIN transactions t ON t.tx_pk = f.tx_pk
+                {"WHERE f.ring_size IS NOT NULL" if "ring_size" in feature_cols else ""};
             """)
             rows = cur.fetchall()
 
         X = []
         y = []
         for r in rows:
-            X.append([float(r[c]) if c != "is_foreign_country" else (1.0 if r[c] else 0.0) for c in FEATURE_COLS])
+            X.append([float(r[c]) if c != "is_foreign_country" else (1.0 if r[c] else 0.0) for c in feature_cols])
             y.append(int(r["label"]))
 
         return np.array(X, dtype=float), np.array(y, dtype=int)
@@ -57,16 +59,65 @@ def fetch_training_data():
         conn.close()
 
 def main():
-    X, y = fetch_training_data()
+    parser = argparse.ArgumentParser(description="Train the fraud model.")
+    parser.add_argument("--source", choices=("pit", "snapshot", "table"), default="table",
+                        help="table: rows already in transaction_features (default); "
+                             "pit: point-in-time features computed in memory (features.offline_features); "
+                             "snapshot: the same, from the columnar export (warehouse.snapshot)")
+    parser.add_argument("--label-delay-hours", type=float, default=0.0,
+                        help="pit/snapshot only: labels count towards fraud rates this long after the transaction")
+    parser.add_argument("--ring-features", action="store_true",
+                        help="also train on ring_size / ring_fraud_rate (serving then needs ENTITY_GRAPH=1)")
+    parser.add_argument("--search", action="store_true",
+                        help="cross-validated search over model families and hyperparameters "
+                             "(models.model_search) on a cached feature matrix")
+    parser.add_argument("--families", type=lambda s: s.split(","),
+                        help="search only: comma list of logreg, rf, hgb (default: all)")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--jobs", type=int, default=-1, help="search only: parallel fits (-1 = all cores)")
+    parser.add_argument("--metric", choices=sorted(METRICS), default="average_precision",
+                        help="search only: leaderboard ranking")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--refresh-cache", action="store_true", help="search only: rebuild the cached matrix")
+    args = parser.parse_args()
+    feature_cols = FEATURE_COLS + (list(RING_FEATURE_COLUMNS) if args.ring_features else [])
+    label_delay_s = args.label_delay_hours * 3600.0
+
+    def load():
+        if args.source in ("pit", "snapshot"):
+            # FEATURE_COLUMNS in realtime_features has the same order as FEATURE_COLS
+            X, y, _ = build_training_matrix(label_delay_s=label_delay_s,
+                                            snapshot=args.source == "snapshot", ring=args.ring_features)
+            return X, y
+        return fetch_training_data(feature_cols)
+
+    if args.search:
+        t0 = time.perf_counter()
+        X, y, cache_path, hit = cached_matrix(load, args.source, label_delay_s, feature_cols,
+                                              refresh=args.refresh_cache)
+        print(f"Feature matrix {X.shape[0]} x {X.shape[1]} ({'cached' if hit else 'built'}, "
+              f"{time.perf_counter() - t0:.1f}s): {cache_path}")
+    else:
+        X, y = load()
 
     X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42, stratify=y
+        X, y, test_size=0.2, random_state=args.seed, stratify=y
     )
 
-    model = Pipeline([
-        ("scaler", StandardScaler()),
-        ("clf", LogisticRegression(max_iter=2000, class_weight="balanced")),
-    ])
+    board = None
+    if args.search:
+        cands = candidates(args.seed, args.families)
+        t0 = time.perf_counter()
+        board = search(X_train, y_train, cands, folds=args.folds, seed=args.seed, n_jobs=args.jobs,
+                       metric=args.metric)
+        print(f"Searched {len(cands)} candidates x {args.folds} folds in {time.perf_counter() - t0:.1f}s")
+        print_leaderboard(board, args.metric)
+        model = clone(cands[board[0]["candidate"]]["estimator"])
+    else:
+        model = Pipeline([
+            ("scaler", StandardScaler()),
+            ("clf", LogisticRegression(max_iter=2000, class_weight="balanced")),
+        ])
 
     model.fit(X_train, y_train)
 
@@ -74,16 +125,41 @@ def main():
     preds = (probs >= 0.5).astype(int)
 
     auc = roc_auc_score(y_test, probs)
+    ap = average_precision_score(y_test, probs)
     print("ROC AUC:", round(float(auc), 4))
+    print("Average precision:", round(float(ap), 4))
     print(classification_report(y_test, preds, digits=4))
 
+    version = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    bundle = {
+        "model": model,
+        "feature_cols": feature_cols,
+        "version": version,
+        # reference point for explaining non-linear models (models.scoring)
+        "baseline": X_train.mean(axis=0),
+    }
+    if board is not None:
+        bundle["search"] = {k: board[0][k] for k in ("family", "params", f"cv_{args.metric}_mean")}
+
     os.makedirs("models/artifacts", exist_ok=True)
-    joblib.dump(
-        {"model": model, "feature_cols": FEATURE_COLS},
-        "models/artifacts/fraud_model.joblib"
-    )
+    joblib.dump(bundle, "models/artifacts/fraud_model.joblib")
     print("Saved model to models/artifacts/fraud_model.joblib")
 
+    if board is not None:
+        with open("models/artifacts/leaderboard.json", "w") as f:
+            json.dump({
+                "version": version,
+                "seed": args.seed,
+                "folds": args.folds,
+                "metric": args.metric,
+                "rows": int(len(y_train)),
+                "fraud": int(y_train.sum()),
+                "feature_cols": feature_cols,
+                "holdout": {"roc_auc": float(auc), "average_precision": float(ap)},
+                "candidates": board,
+            }, f, indent=2)
+        print("Saved leaderboard to models/artifacts/leaderboard.json")
+
 if __name__ == "__main__":
     main()
 
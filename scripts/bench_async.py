@@ -0,0 +1,127 @@
+# scripts/bench_async.py
+"""
+Closed-loop HTTP load test: N concurrent keep-alive connections, each sending its
+next request as soon as the previous response arrives.
+
+    python -m scripts.bench_async --url http://localhost:8000 --url http://localhost:8001 \
+        --concurrency 1000 --duration 30
+
+With two --url values (e.g. `make run` on 8000 and `make run-async` on 8001) the
+servers are measured one after the other with the same load. The default request
+is POST /transactions/score with a random transaction; --method GET --path ...
+benchmarks a read endpoint instead.
+
+The client is a bare asyncio HTTP/1.1 implementation so that 1000 connections
+don't make the load generator the bottleneck.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+
+def _transaction_body() -> bytes:
+    return json.dumps({
+        "user_id": f"user_{random.randint(1, 5000)}",
+        "card_id": f"card_{random.randint(1, 8000)}",
+        "device_id": f"device_{random.randint(1, 6000)}",
+        "amount": round(random.uniform(1, 2000), 2),
+        "currency": "USD",
+        "merchant": random.choice(["amazon", "walmart", "target", "bestbuy", "uber"]),
+        "merchant_category": random.choice(["electronics", "grocery", "travel", "fashion"]),
+        "country": random.choice(["US", "US", "US", "GB", "DE", "NG"]),
+    }).encode()
+
+
+async def _read_response(reader) -> int:
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    status = int(status_line.split(b" ", 2)[1])
+    length, chunked = 0, False
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.partition(b":")
+        name = name.strip().lower()
+        if name == b"content-length":
+            length = int(value)
+        elif name == b"transfer-encoding" and b"chunked" in value.lower():
+            chunked = True
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif length:
+        await reader.readexactly(length)
+    return status
+
+
+async def _client(host, port, method, path, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            body = _transaction_body() if method == "POST" else b""
+            head = (f"{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n")
+            t0 = time.perf_counter()
+            writer.write(head.encode() + body)
+            status = await _read_response(reader)
+            latencies.append(time.perf_counter() - t0)
+            if status >= 400:
+                errors.append(status)
+    except (ConnectionError, asyncio.IncompleteReadError) as exc:
+        errors.append(type(exc).__name__)
+    finally:
+        writer.close()
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def run(url, method, path, concurrency, duration) -> dict:
+    parts = urlsplit(url)
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    t0 = time.perf_counter()
+    await asyncio.gather(*(
+        _client(parts.hostname, parts.port or 80, method, path, deadline, latencies, errors)
+        for _ in range(concurrency)
+    ))
+    elapsed = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "url": url,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "req_per_s": len(latencies) / elapsed,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Closed-loop HTTP benchmark for the sync and async APIs.")
+    parser.add_argument("--url", action="append", help="base URL; repeat to compare servers")
+    parser.add_argument("--method", default="POST", choices=["GET", "POST"])
+    parser.add_argument("--path", default="/transactions/score")
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per server")
+    args = parser.parse_args()
+
+    for url in args.url or ["http://localhost:8000"]:
+        r = asyncio.run(run(url, args.method, args.path, args.concurrency, args.duration))
+        print(f"{r['url']}: {r['requests']} requests, {r['errors']} errors, "
+              f"{r['req_per_s']:.0f} req/s, p50 {r['p50_ms']:.1f} ms, p99 {r['p99_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
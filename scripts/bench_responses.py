@@ -0,0 +1,119 @@
+# scripts/bench_responses.py
+"""
+CPU per response and bytes on the wire for the large read endpoints, default
+FastAPI serialization vs api/responses.py.
+
+    python -m scripts.bench_responses --iterations 200
+
+Payloads are real rows, fetched once with the endpoints' own queries:
+
+  transactions   GET /transactions?limit=500
+  review_queue   GET /review/queue?limit=500&embed=50
+  review_case    GET /review/case/{id}
+
+"default" is what FastAPI does with a returned dict/list: response_model
+validation and serialization where the route declares a model, jsonable_encoder
+otherwise, then JSONResponse's json.dumps. "fast" is FastJSONResponse. Both are
+timed with process CPU time, so the numbers are per-request CPU, not latency.
+Compression is timed separately at the configured gzip level / brotli quality.
+"""
+import argparse
+import json
+import time
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from psycopg2.extras import RealDictCursor
+from pydantic import TypeAdapter
+
+from api.main import TransactionOut, REVIEW_CASES_SQL
+from api.responses import dumps, compress, ENCODINGS
+from common.db import connect
+
+TRANSACTIONS_SQL = """
+    SELECT transaction_id, user_id, card_id, device_id, amount, currency,
+           merchant, merchant_category, country, timestamp, is_fraud, fraud_reason
+    FROM transactions
+    ORDER BY timestamp DESC
+    LIMIT 500;
+"""
+
+REVIEW_QUEUE_SQL = """
+    SELECT ra.transaction_id, ra.risk_score, ra.fraud_probability, ra.decision, ra.created_at,
+           t.user_id, t.amount, t.merchant, t.country, t.timestamp
+    FROM risk_assessments ra
+    JOIN transactions t ON t.tx_pk = ra.tx_pk
+    WHERE ra.decision = 'manual_review'
+    ORDER BY ra.created_at DESC
+    LIMIT 500;
+"""
+
+
+def _cases(cur, ids) -> dict:
+    cur.execute(REVIEW_CASES_SQL, (ids,))
+    cases = {}
+    for row in cur.fetchall():
+        case = dict(row)
+        cases[case.pop("transaction_id")] = case
+    return cases
+
+
+def load_payloads() -> dict:
+    conn = connect()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(TRANSACTIONS_SQL)
+            transactions = cur.fetchall()
+            cur.execute(REVIEW_QUEUE_SQL)
+            queue = cur.fetchall()
+            cases = _cases(cur, [r["transaction_id"] for r in queue[:50]])
+            for r in queue[:50]:
+                r["case"] = cases.get(r["transaction_id"])
+        conn.rollback()
+    finally:
+        conn.close()
+    payloads = {"transactions": (transactions, List[TransactionOut]), "review_queue": (queue, None)}
+    if queue and queue[0].get("case") is not None:
+        payloads["review_case"] = (queue[0]["case"], None)
+    return payloads
+
+
+def default_render(content, model) -> bytes:
+    if model is not None:
+        adapter = TypeAdapter(model)
+        content = adapter.dump_python(adapter.validate_python(content), mode="json")
+    else:
+        content = jsonable_encoder(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def cpu_ms(fn, iterations: int) -> float:
+    fn()  # warm up
+    t0 = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - t0) * 1000 / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark response serialization and compression.")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    for name, (content, model) in load_payloads().items():
+        default_ms = cpu_ms(lambda: default_render(content, model), args.iterations)
+        fast_ms = cpu_ms(lambda: dumps(content), args.iterations)
+        body = dumps(content)
+        print(f"{name} ({len(body) / 1024:.1f} KiB JSON)")
+        print(f"  {'default':<10} {default_ms:8.3f} ms CPU")
+        print(f"  {'fast':<10} {fast_ms:8.3f} ms CPU  ({default_ms / fast_ms:.1f}x less)")
+        for enc in ENCODINGS:
+            enc_ms = cpu_ms(lambda: compress(body, enc), args.iterations)
+            size = len(compress(body, enc))
+            print(f"  {enc:<10} {enc_ms:8.3f} ms CPU  {size / 1024:8.1f} KiB  "
+                  f"({100.0 * (1 - size / len(body)):.0f}% smaller)")
+
+
+if __name__ == "__main__":
+    main()
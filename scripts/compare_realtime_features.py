@@ -0,0 +1,45 @@
+# scripts/compare_realtime_features.py
+"""
+Check that the single-statement realtime feature query returns exactly what the
+per-feature query path returns, for the most recent N transactions.
+
+    python -m scripts.compare_realtime_features 500
+
+Both paths run inside one transaction that is rolled back, so transaction_features
+is left untouched.
+"""
+import sys
+
+from psycopg2.extras import RealDictCursor
+
+from common.db import connect
+from features.realtime_features import _compute_features, compute_and_upsert_in_transaction
+
+
+def main(n: int = 500) -> int:
+    conn = connect()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("SELECT transaction_id FROM transactions ORDER BY timestamp DESC LIMIT %s;", (n,))
+            ids = [r["transaction_id"] for r in cur.fetchall()]
+
+            legacy = [_compute_features(cur, tx_id) for tx_id in ids]
+            single = compute_and_upsert_in_transaction(cur, ids)
+
+        mismatches = 0
+        for a, b in zip(legacy, single):
+            if repr(a) != repr(b):
+                mismatches += 1
+                print("MISMATCH", a["transaction_id"])
+                print("  legacy:", a)
+                print("  single:", b)
+
+        print(f"Compared {len(ids)} transactions, {mismatches} mismatches.")
+        return 1 if mismatches else 0
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,127 @@
+# scripts/measure_surrogate_keys.py
+"""
+Index sizes and join timings for database/surrogate_keys.sql.
+
+    python -m scripts.measure_surrogate_keys --save before.json   # before migrating
+    # apply database/surrogate_keys.sql
+    python -m scripts.measure_surrogate_keys --compare before.json
+
+Sizes cover every index on the tables the migration touches. Join timings are
+server-side EXPLAIN ANALYZE execution times (median of --runs) so that result
+transfer doesn't mask the difference. After the migration the child tables still
+carry transaction_id, so each join is also timed on the old TEXT key against the
+same data.
+"""
+import argparse
+import json
+import statistics
+
+from psycopg2.extras import RealDictCursor
+
+from common.db import connect
+
+TABLES = ("users", "cards", "devices", "transactions",
+          "transaction_features", "risk_assessments", "review_actions", "scoring_jobs")
+
+# {key} / {child_key}: the join columns on transactions and on the child table
+JOINS = {
+    "training_matrix": """
+        SELECT f.tx_count_24h, t.is_fraud FROM transaction_features f
+        JOIN transactions t ON t.{key} = f.{child_key}
+    """,
+    "assessments_by_merchant": """
+        SELECT t.merchant, AVG(ra.risk_score) FROM risk_assessments ra
+        JOIN transactions t ON t.{key} = ra.{child_key}
+        GROUP BY t.merchant
+    """,
+    "review_history": """
+        SELECT t.merchant, COUNT(*) FROM review_actions a
+        JOIN transactions t ON t.{key} = a.{child_key}
+        GROUP BY t.merchant
+    """,
+}
+
+
+def index_sizes(cur) -> dict:
+    cur.execute("""
+        SELECT c.relname AS table_name, i.relname AS index_name, pg_relation_size(i.oid) AS bytes
+        FROM pg_index x
+        JOIN pg_class c ON c.oid = x.indrelid
+        JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE c.relname = ANY(%s)
+        ORDER BY c.relname, i.relname;
+    """, (list(TABLES),))
+    return {f"{r['table_name']}.{r['index_name']}": r["bytes"] for r in cur.fetchall()}
+
+
+def _execution_ms(cur, sql: str) -> float:
+    cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + sql)
+    return cur.fetchone()["QUERY PLAN"][0]["Execution Time"]
+
+
+def join_timings(cur, runs: int) -> dict:
+    cur.execute("""
+        SELECT EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_name = 'transactions' AND column_name = 'tx_pk') AS migrated;
+    """)
+    keys = {"text": ("transaction_id", "transaction_id")}
+    if cur.fetchone()["migrated"]:
+        keys["bigint"] = ("tx_pk", "tx_pk")
+
+    timings = {}
+    for name, sql in JOINS.items():
+        for label, (key, child_key) in keys.items():
+            q = sql.format(key=key, child_key=child_key)
+            _execution_ms(cur, q)  # warm the cache
+            timings[f"{name}[{label}]"] = statistics.median(_execution_ms(cur, q) for _ in range(runs))
+    return timings
+
+
+def _mb(n: int) -> str:
+    return f"{n / (1 << 20):8.2f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure index sizes and join speed around the surrogate key migration.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--save", help="write the measurements to this JSON file")
+    parser.add_argument("--compare", help="print deltas against a file written with --save")
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            result = {"indexes": index_sizes(cur), "joins_ms": join_timings(cur, args.runs)}
+        conn.rollback()
+    finally:
+        conn.close()
+
+    before = None
+    if args.compare:
+        with open(args.compare) as f:
+            before = json.load(f)
+
+    print("Indexes")
+    for name, size in result["indexes"].items():
+        print(f"  {name:<60} {_mb(size)}")
+    total = sum(result["indexes"].values())
+    line = f"  {'total':<60} {_mb(total)}"
+    if before:
+        old = sum(before["indexes"].values())
+        line += f"  (was {_mb(old).strip()}, {100.0 * (total - old) / old:+.1f}%)" if old else ""
+    print(line)
+
+    print("Joins (median execution time)")
+    for name, ms in result["joins_ms"].items():
+        line = f"  {name:<60} {ms:8.1f} ms"
+        if before and name in before["joins_ms"]:
+            line += f"  (was {before['joins_ms'][name]:.1f} ms)"
+        print(line)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import contextlib
+import os
+
+import psycopg2
+import pytest
+
+from api import assessment_writer
+from api.assessment_writer import AssessmentWriter
+
+
+class FakeConn:
+    def cursor(self):
+        return contextlib.nullcontext(None)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDB:
+    """Stands in for get_conn and upsert_assessments; `down` and `bad` inject failures."""
+
+    def __init__(self):
+        self.down = False
+        self.bad = set()
+        self.calls = []
+        self.written = []
+
+    def connect(self):
+        if self.down:
+            raise psycopg2.OperationalError("database is away")
+        return FakeConn()
+
+    def upsert(self, cur, rows, skip_existing=False):
+        self.calls.append((len(rows), skip_existing))
+        if any(row[0] in self.bad for row in rows):
+            raise psycopg2.DataError("bad row")
+        self.written.extend(row[0] for row in rows)
+        return [row[3] for row in rows]
+
+
+def _row(tid):
+    return (tid, 0.5, 50, "approve", [])
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDB()
+    monkeypatch.setattr(assessment_writer, "upsert_assessments", db.upsert)
+    return db
+
+
+@pytest.fixture
+def writer(db, tmp_path):
+    w = AssessmentWriter(
+        db.connect, flush_size=2, flush_interval_ms=1,
+        spill_path=str(tmp_path / "spill.jsonl"), max_attempts=2,
+        dead_letter_path=str(tmp_path / "dead.jsonl"),
+    )
+    w.close()  # stop the flusher; the tests drive replays themselves
+    return w
+
+
+def _spilled(path):
+    return AssessmentWriter._read_spill(path) if os.path.exists(path) else []
+
+
+def test_replay_writes_the_spill_in_chunks(writer, db):
+    writer._spill([_row(f"t{i}") for i in range(5)])
+    assert writer._replay_spill()
+    assert db.calls == [(2, True), (2, True), (1, True)]
+    assert db.written == ["t0", "t1", "t2", "t3", "t4"]
+    assert not os.path.exists(writer._spill_path)
+    assert not os.path.exists(writer._spill_path + ".replaying")
+    assert not writer._spill_pending
+
+
+def test_replay_resumes_a_replay_cut_short(writer, db):
+    AssessmentWriter._append(writer._spill_path + ".replaying", [[*_row("old"), 0]])
+    writer._spill([_row("new")])
+    assert writer._replay_spill()
+    assert db.written == ["old"]
+    assert writer._spill_pending  # the spill file is still waiting
+    assert writer._replay_spill()
+    assert db.written == ["old", "new"]
+
+
+def test_replay_keeps_rows_while_the_database_is_away(writer, db):
+    writer._spill([_row(f"t{i}") for i in range(3)])
+    db.down = True
+    assert not writer._replay_spill()
+    assert _spilled(writer._spill_path) == [(_row(f"t{i}"), 0) for i in range(3)]
+    assert not os.path.exists(writer._spill_path + ".replaying")
+    assert writer._spill_pending
+    db.down = False
+    assert writer._replay_spill()
+    assert db.written == ["t0", "t1", "t2"]
+
+
+def test_replay_sets_a_failing_row_aside(writer, db, tmp_path):
+    writer._spill([_row("t1"), _row("t2"), _row("t3")])
+    db.bad = {"t2"}
+    assert not writer._replay_spill()
+    # the rest of the failing chunk still goes through
+    assert db.written == ["t1", "t3"]
+    assert _spilled(writer._spill_path) == [(_row("t2"), 1)]
+    # second failure reaches max_attempts
+    assert writer._replay_spill()
+    assert not _spilled(writer._spill_path)
+    dead = _spilled(str(tmp_path / "dead.jsonl"))
+    assert [row[0] for row, _ in dead] == ["t2"]
+
+
+def test_replay_without_a_spill_file(writer, db):
+    assert writer._replay_spill()
+    assert db.calls == []
@@ -0,0 +1,79 @@
+import argparse
+
+import numpy as np
+import pytest
+
+from models.backtest import _thresholds, sweep
+
+
+def test_thresholds_list():
+    assert _thresholds("80,85,90") == [80, 85, 90]
+
+
+def test_thresholds_range_includes_stop():
+    assert _thresholds("70:80:5") == [70, 75, 80]
+    assert _thresholds("1:3") == [1, 2, 3]
+
+
+@pytest.mark.parametrize("spec", ["101", "-1,50", "90:80", "0:101:1"])
+def test_thresholds_rejects_out_of_range(spec):
+    with pytest.raises(argparse.ArgumentTypeError):
+        _thresholds(spec)
+
+
+def _brute_force(scores, labels, amounts, block, review, days):
+    fraud = labels.astype(bool)
+    blocked = scores >= block
+    flagged = scores >= review
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "block_rate": blocked.sum() / len(scores),
+            "review_per_day": (flagged.sum() - blocked.sum()) / days,
+            "block_precision": np.float64((blocked & fraud).sum()) / blocked.sum(),
+            "flag_precision": np.float64((flagged & fraud).sum()) / flagged.sum(),
+            "block_recall": (blocked & fraud).sum() / max(fraud.sum(), 1),
+            "flag_recall": (flagged & fraud).sum() / max(fraud.sum(), 1),
+            "fraud_caught": int((flagged & fraud).sum()),
+            "fraud_amount": amounts[flagged & fraud].sum(),
+        }
+
+
+def test_sweep_small_example():
+    scores = np.array([10, 50, 90, 95])
+    labels = np.array([0, 1, 1, 0])
+    amounts = np.array([1.0, 2.0, 3.0, 4.0])
+    rows = sweep(scores, labels, amounts, [90], [50, 95], days=1.0)
+    # review 95 is above block 90, so only one pair is kept
+    assert rows == [{
+        "block": 90,
+        "review": 50,
+        "block_rate": 0.5,
+        "review_per_day": 1.0,
+        "block_precision": 0.5,
+        "flag_precision": pytest.approx(2 / 3),
+        "block_recall": 0.5,
+        "flag_recall": 1.0,
+        "fraud_caught": 2,
+        "fraud_amount": 5.0,
+    }]
+
+
+def test_sweep_empty_bucket_is_nan():
+    rows = sweep(np.array([10, 20]), np.array([0, 1]), np.array([1.0, 1.0]), [100], [100], days=1.0)
+    assert np.isnan(rows[0]["block_precision"])
+    assert np.isnan(rows[0]["flag_precision"])
+    assert rows[0]["fraud_caught"] == 0
+
+
+def test_sweep_matches_brute_force():
+    rng = np.random.default_rng(7)
+    scores = rng.integers(0, 101, size=2000)
+    labels = (rng.random(2000) < scores / 150).astype(np.int64)
+    amounts = rng.uniform(1, 500, size=2000)
+    block, review = _thresholds("60:100:10"), _thresholds("0:100:25")
+    rows = sweep(scores, labels, amounts, block, review, days=7.0)
+    assert [(r["block"], r["review"]) for r in rows] == [(b, r) for b in block for r in review if r <= b]
+    for row in rows:
+        expected = _brute_force(scores, labels, amounts, row["block"], row["review"], 7.0)
+        for key, value in expected.items():
+            assert row[key] == pytest.approx(value, nan_ok=True), (row["block"], row["review"], key)
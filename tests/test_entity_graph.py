@@ -0,0 +1,96 @@
+from features.entity_graph import EntityGraph
+
+
+def _ring_graph() -> EntityGraph:
+    g = EntityGraph()
+    g.add_transaction("u1", "d1", None)
+    g.add_transaction("u2", "d1", "c1")
+    g.add_transaction("u3", None, "c1")
+    g.add_transaction("u4", "d9", "c9")
+    return g
+
+
+def test_find_halves_paths():
+    g = EntityGraph()
+    nodes = [g._node(f"d:{i}", False) for i in range(5)]
+    for child, parent in zip(nodes[1:], nodes):
+        g._parent[child] = parent  # a chain 4 -> 3 -> 2 -> 1 -> 0
+    assert g._find(nodes[4]) == nodes[0]
+    assert g._parent[nodes[4]] == nodes[2]
+    assert g._parent[nodes[2]] == nodes[0]
+
+
+def test_union_keeps_counts_at_the_larger_root():
+    g = EntityGraph()
+    u1, d1, d2 = g._node("u:1", True), g._node("d:1", False), g._node("d:2", False)
+    g._union(u1, d1)
+    g._union(d2, u1)
+    root = g._find(u1)
+    assert root == u1
+    assert g._find(d2) == root
+    assert (g._size[root], g._users[root]) == (3, 1)
+    g._union(d1, d2)  # already joined
+    assert (g._size[root], g._users[root]) == (3, 1)
+
+
+def test_node_is_created_once():
+    g = EntityGraph()
+    assert g._node("u:1", True) == g._node("u:1", True)
+    assert len(g) == 1
+
+
+def test_ring_joins_users_through_shared_devices_and_cards():
+    g = _ring_graph()
+    ring = g.ring("u1")
+    assert ring == {"ring_id": g.ring("u3")["ring_id"], "users": 3, "devices_and_cards": 2, "fraud_users": 0}
+    assert g.ring("u4")["ring_id"] != ring["ring_id"]
+    assert g.ring("u4")["users"] == 1
+
+
+def test_ring_features():
+    g = _ring_graph()
+    g.record_fraud_label("u3")
+    assert g.ring_features("u1") == {"ring_size": 3, "ring_fraud_rate": 1 / 3}
+    assert g.ring_features("u4") == {"ring_size": 1, "ring_fraud_rate": 0.0}
+    assert g.ring_features("nobody") == {"ring_size": 0, "ring_fraud_rate": 0.0}
+    assert g.ring("nobody") is None
+    assert g.ring(None) is None
+
+
+def test_fraud_label_follows_later_merges():
+    g = EntityGraph()
+    g.add_transaction("u1", "d1", None, is_fraud=True)
+    g.add_transaction("u2", "d2", None)
+    g.add_transaction("u2", "d1", None)
+    assert g.ring_features("u2") == {"ring_size": 2, "ring_fraud_rate": 0.5}
+
+
+def test_replaying_transactions_and_labels_changes_nothing():
+    g = _ring_graph()
+    g.record_fraud_label("u2")
+    before = g.ring("u1")
+    g.add_transaction("u2", "d1", "c1", is_fraud=True)
+    g.record_fraud_label("u2")
+    assert g.ring("u1") == before
+    assert before["fraud_users"] == 1
+
+
+def test_transaction_without_user_is_ignored():
+    g = EntityGraph()
+    g.add_transaction(None, "d1", "c1")
+    assert len(g) == 0
+
+
+def test_snapshot_round_trip(tmp_path):
+    g = _ring_graph()
+    g.record_fraud_label("u1")
+    g.tx_watermark, g.tx_gaps = 42, {40: 1}
+    path = str(tmp_path / "graph.pkl")
+    g.save(path)
+    loaded = EntityGraph.load(path)
+    assert loaded.ring("u3") == g.ring("u3")
+    assert loaded.ring_features("u4") == g.ring_features("u4")
+    assert (loaded.tx_watermark, loaded.tx_gaps) == (42, {40: 1})
+    loaded.add_transaction("u4", "d1", None)
+    assert loaded.ring_features("u1")["ring_size"] == 4
+    assert EntityGraph.load(str(tmp_path / "missing.pkl")) is None
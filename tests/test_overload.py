@@ -0,0 +1,186 @@
+import contextlib
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from api.overload import DeferredWriter, OverloadController
+
+
+class Stages:
+    """Cumulative (total seconds, count) per database stage, like STAGE_LATENCY.totals()."""
+
+    def __init__(self):
+        self.totals = {}
+
+    def observe(self, stage, seconds, n=1):
+        total, count = self.totals.get(stage, (0.0, 0))
+        self.totals[stage] = (total + seconds * n, count + n)
+
+    def __call__(self):
+        return dict(self.totals)
+
+
+@pytest.fixture
+def stages():
+    return Stages()
+
+
+def _controller(stages, **kwargs):
+    # the check thread sleeps for good; the tests call check() themselves
+    options = dict(max_in_flight=4, latency_ms=250, recover_ms=100, recover_s=0, check_ms=1e9, probe_rate=0)
+    ctl = OverloadController(**{**options, **kwargs})
+    ctl._stage_totals = stages
+    ctl._last_totals = {}
+    return ctl
+
+
+def _degraded(stages, **kwargs):
+    ctl = _controller(stages, **kwargs)
+    stages.observe("insert", 0.5)
+    ctl.check()
+    assert ctl.degraded
+    return ctl
+
+
+def test_trips_on_slow_database_stages(stages):
+    ctl = _controller(stages)
+    stages.observe("insert", 0.3)
+    ctl.check()
+    assert ctl.degraded
+    assert ctl.last_latency_s == pytest.approx(0.3)
+
+
+def test_stays_normal_when_fast_or_idle(stages):
+    ctl = _controller(stages)
+    ctl.check()
+    assert not ctl.degraded
+    stages.observe("insert", 0.05, n=10)
+    ctl.check()
+    assert not ctl.degraded
+
+
+def test_latency_is_the_worst_stage_over_the_last_window(stages):
+    ctl = _controller(stages)
+    stages.observe("insert", 0.01, n=100)
+    ctl.check()
+    stages.observe("insert", 0.5)
+    stages.observe("feature_queries", 0.01, n=100)
+    ctl.check()
+    assert ctl.degraded
+    assert ctl.last_latency_s == pytest.approx(0.5)
+
+
+def test_trips_on_requests_in_flight(stages):
+    ctl = _controller(stages)
+    with contextlib.ExitStack() as stack:
+        for _ in range(4):
+            stack.enter_context(ctl.track())
+        assert not ctl.degraded
+        stack.enter_context(ctl.track())
+        assert ctl.degraded
+        assert ctl.in_flight == 5
+    assert ctl.in_flight == 0
+
+
+def test_recovers_after_calm_checks(stages):
+    ctl = _degraded(stages)
+    stages.observe("insert", 0.01)
+    ctl.check()  # calm starts here
+    assert ctl.degraded
+    ctl.check()  # no samples counts as calm
+    assert not ctl.degraded
+
+
+def test_a_slow_window_restarts_recovery(stages):
+    ctl = _degraded(stages)
+    ctl.check()
+    stages.observe("insert", 0.15)  # under the trip threshold, over the recovery one
+    ctl.check()
+    assert ctl.degraded
+    ctl.check()
+    assert ctl.degraded
+    ctl.check()
+    assert not ctl.degraded
+
+
+def test_recovery_needs_in_flight_under_half_the_limit(stages):
+    ctl = _degraded(stages)
+    ctl._in_flight = 3
+    ctl.check()
+    ctl.check()
+    assert ctl.degraded
+    ctl._in_flight = 2
+    ctl.check()
+    ctl.check()
+    assert not ctl.degraded
+
+
+def test_recovery_waits_recover_s(stages):
+    ctl = _degraded(stages, recover_s=60)
+    ctl.check()
+    ctl.check()
+    assert ctl.degraded
+
+
+def test_should_degrade_lets_probes_through(stages):
+    ctl = _controller(stages)
+    assert not ctl.should_degrade()
+    ctl = _degraded(stages)
+    assert ctl.should_degrade()
+    ctl = _degraded(stages, probe_rate=1.0)
+    assert not ctl.should_degrade()
+
+
+# ---------- deferred writer spill ----------
+
+def _row(tid):
+    tx = SimpleNamespace(user_id="u1", card_id="c1", device_id="d1", amount=12.5, currency="EUR",
+                         merchant="shop", merchant_category="retail", country="FR")
+    return (tid, tx, datetime(2024, 5, 1, 12, 0), 0.9, 90, "block", [])
+
+
+@pytest.fixture
+def writer(tmp_path):
+    w = DeferredWriter(
+        None, max_queue=3, spill_path=str(tmp_path / "spill.jsonl"),
+        dead_letter_path=str(tmp_path / "dead.jsonl"),
+    )
+    w.close()  # stop the flusher; the tests drive replays themselves
+    return w
+
+
+def _queued(writer):
+    items = []
+    while not writer._queue.empty():
+        items.append(writer._queue.get_nowait())
+    return [(row[0], step) for row, step in items]
+
+
+def test_replay_requeues_rows_with_their_step(writer):
+    writer._spill([_row("t1"), _row("t2")], step=0)
+    writer._spill([_row("t3")], step=2)
+    assert writer._replay_spill()
+    assert not writer._spill_pending
+    row, step = writer._queue.queue[0]
+    assert row == _row("t1") and step == 0
+    assert _queued(writer) == [("t1", 0), ("t2", 0), ("t3", 2)]
+    with open(writer._spill_path) as f:
+        assert f.read() == ""
+
+
+def test_replay_drains_a_backlog_bigger_than_the_queue(writer):
+    writer._spill([_row(f"t{i}") for i in range(5)])
+    assert writer._replay_spill()
+    assert writer._spill_pending
+    assert not writer._replay_spill()  # queue is full
+    assert _queued(writer) == [(f"t{i}", 0) for i in range(3)]
+    assert writer._replay_spill()
+    assert not writer._spill_pending
+    assert _queued(writer) == [("t3", 0), ("t4", 0)]
+
+
+def test_replay_without_a_spill_file(writer):
+    writer._spill_pending = True
+    assert writer._replay_spill()
+    assert not writer._spill_pending
@@ -0,0 +1,285 @@
+# warehouse/snapshot.py
+"""
+Columnar snapshots of the fraud tables for training and offline analysis.
+
+    python -m warehouse.snapshot export                 # incremental, Parquet (zstd)
+    python -m warehouse.snapshot export --full --format arrow
+    python -m warehouse.snapshot show transactions
+
+Layout: <SNAPSHOT_DIR>/<table>/date=YYYY-MM-DD/part-0.<parquet|arrow>, one file per
+day, plus <table>/_state.json. transactions, transaction_features and
+risk_assessments are partitioned by the transaction's date, review_actions by
+its created_at date.
+
+Incremental runs rewrite only the days that changed since the previous export:
+days with transactions inserted (by server-side inserted_at, so late events with
+old timestamps count), or feature rows, assessments or reviews created since then
+(covers is_fraud flips from rejections), plus the newest exported day. Each
+day is read inside one REPEATABLE READ transaction and replaced atomically, so
+readers never see a half-written partition.
+
+Readers go through read_table(): a pyarrow dataset over the memory-mapped
+files, with column projection and date-range partition pruning.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+from common.db import connect
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "data/snapshots")
+SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "parquet")  # parquet | arrow
+SNAPSHOT_FETCH_SIZE = int(os.getenv("SNAPSHOT_FETCH_SIZE", "50000"))
+# rows committed slightly after an export started can carry an older created_at
+SNAPSHOT_OVERLAP = timedelta(minutes=10)
+
+_TS = pa.timestamp("us")
+
+TABLES = {
+    "transactions": {
+        "schema": pa.schema([
+            ("transaction_id", pa.string()), ("user_id", pa.string()), ("card_id", pa.string()),
+            ("device_id", pa.string()), ("amount", pa.float64()), ("currency", pa.string()),
+            ("merchant", pa.string()), ("merchant_category", pa.string()), ("country", pa.string()),
+            ("timestamp", _TS), ("is_fraud", pa.bool_()), ("fraud_reason", pa.string()),
+        ]),
+        "columns": """
+            t.transaction_id, t.user_id, t.card_id, t.device_id, t.amount, t.currency,
+            t.merchant, t.merchant_category, t.country, t.timestamp, t.is_fraud, t.fraud_reason
+        """,
+        "from": "transactions t",
+        "day": "t.timestamp::date",
+        "dictionary": ("user_id", "card_id", "device_id", "currency", "merchant", "merchant_category", "country"),
+    },
+    "transaction_features": {
+        "schema": pa.schema([
+            ("transaction_id", pa.string()),
+            ("tx_count_5m", pa.int32()), ("tx_count_1h", pa.int32()), ("tx_count_24h", pa.int32()),
+            ("user_avg_amount", pa.float64()), ("amount_vs_user_avg", pa.float64()),
+            ("is_foreign_country", pa.bool_()), ("device_user_count", pa.int32()),
+            ("merchant_fraud_rate", pa.float64()), ("category_fraud_rate", pa.float64()),
+            ("created_at", _TS),
+        ]),
+        "columns": """
+            f.transaction_id, f.tx_count_5m, f.tx_count_1h, f.tx_count_24h,
+            f.user_avg_amount, f.amount_vs_user_avg, f.is_foreign_country, f.device_user_count,
+            f.merchant_fraud_rate, f.category_fraud_rate, f.created_at
+        """,
+        "from": "transaction_features f JOIN transactions t ON t.tx_pk = f.tx_pk",
+        "day": "t.timestamp::date",
+        "dictionary": (),
+    },
+    "risk_assessments": {
+        "schema": pa.schema([
+            ("transaction_id", pa.string()), ("fraud_probability", pa.float64()),
+            ("risk_score", pa.int32()), ("decision", pa.string()),
+            ("reasons", pa.string()), ("created_at", _TS),
+        ]),
+        "columns": "r.transaction_id, r.fraud_probability, r.risk_score, r.decision, r.reasons::text, r.created_at",
+        "from": "risk_assessments r JOIN transactions t ON t.tx_pk = r.tx_pk",
+        "day": "t.timestamp::date",
+        "dictionary": ("decision",),
+    },
+    "review_actions": {
+        "schema": pa.schema([
+            ("id", pa.int64()), ("transaction_id", pa.string()), ("action", pa.string()),
+            ("analyst", pa.string()), ("notes", pa.string()), ("created_at", _TS),
+        ]),
+        "columns": "a.id, a.transaction_id, a.action, a.analyst, a.notes, a.created_at",
+        "from": "review_actions a",
+        "day": "a.created_at::date",
+        "dictionary": ("action", "analyst"),
+    },
+}
+
+# days whose partitions may have changed since `since`
+CHANGED_DAYS_SQL = """
+    SELECT t.timestamp::date FROM transaction_features f
+    JOIN transactions t ON t.tx_pk = f.tx_pk WHERE f.created_at > %(since)s
+    UNION
+    SELECT t.timestamp::date FROM risk_assessments r
+    JOIN transactions t ON t.tx_pk = r.tx_pk WHERE r.created_at > %(since)s
+    UNION
+    SELECT t.timestamp::date FROM review_actions a
+    JOIN transactions t ON t.tx_pk = a.tx_pk WHERE a.created_at > %(since)s
+    UNION
+    SELECT t.timestamp::date FROM transactions t WHERE t.inserted_at > %(since)s
+"""
+CHANGED_REVIEW_DAYS_SQL = "SELECT DISTINCT created_at::date FROM review_actions WHERE created_at > %(since)s"
+
+
+def _ext(fmt: str) -> str:
+    return "arrow" if fmt == "arrow" else "parquet"
+
+
+def _state_path(root: str, table: str) -> str:
+    return os.path.join(root, table, "_state.json")
+
+
+def _load_state(root: str, table: str) -> dict:
+    try:
+        with open(_state_path(root, table)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_state(root: str, table: str, state: dict) -> None:
+    path = _state_path(root, table)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _fetch_day(conn, spec: dict, day: date) -> pa.Table:
+    schema = spec["schema"]
+    batches = []
+    # named cursor: rows stream from the server in SNAPSHOT_FETCH_SIZE chunks
+    with conn.cursor(name="snapshot_export") as cur:
+        cur.itersize = SNAPSHOT_FETCH_SIZE
+        cur.execute(f"SELECT {spec['columns']} FROM {spec['from']} WHERE {spec['day']} = %s", (day,))
+        while True:
+            rows = cur.fetchmany(SNAPSHOT_FETCH_SIZE)
+            if not rows:
+                break
+            cols = list(zip(*rows))
+            batches.append(pa.record_batch(
+                [pa.array(c, type=f.type) for c, f in zip(cols, schema)], schema=schema))
+    # one chunk per column, so each dictionary column gets a single dictionary
+    # (the Arrow IPC file format can't replace dictionaries between batches)
+    table = pa.Table.from_batches(batches, schema=schema).combine_chunks()
+    for name in spec["dictionary"]:
+        i = table.schema.get_field_index(name)
+        table = table.set_column(i, name, table.column(i).dictionary_encode())
+    return table
+
+
+def _write_partition(root: str, table_name: str, day: date, table: pa.Table, fmt: str) -> int:
+    part_dir = os.path.join(root, table_name, f"date={day.isoformat()}")
+    os.makedirs(part_dir, exist_ok=True)
+    path = os.path.join(part_dir, f"part-0.{_ext(fmt)}")
+    for stale in os.listdir(part_dir):
+        if stale.startswith("part-") and not stale.endswith(_ext(fmt)):
+            os.remove(os.path.join(part_dir, stale))  # format changed since the last export
+    tmp = path + ".tmp"
+    if fmt == "arrow":
+        feather.write_feather(table, tmp, compression="lz4")
+    else:
+        pq.write_table(table, tmp, compression="zstd", row_group_size=128 * 1024)
+    os.replace(tmp, path)
+    return os.path.getsize(path)
+
+
+def export_table(conn, table_name: str, root: str = SNAPSHOT_DIR, fmt: str = SNAPSHOT_FORMAT,
+                 full: bool = False) -> dict:
+    """
+    Rewrite the changed day partitions of one table. Runs inside the caller's
+    transaction; export_all() makes that one REPEATABLE READ snapshot for all tables.
+    """
+    spec = TABLES[table_name]
+    state = {} if full else _load_state(root, table_name)
+    if state.get("format") != fmt:
+        state = {}  # first export, or switching formats: rewrite everything
+
+    with conn.cursor() as cur:
+        cur.execute("SELECT NOW()::timestamp;")
+        started = cur.fetchone()[0]
+        if not state:
+            cur.execute(f"SELECT DISTINCT {spec['day']} FROM {spec['from']};")
+        else:
+            since = datetime.fromisoformat(state["exported_at"]) - SNAPSHOT_OVERLAP
+            cur.execute(CHANGED_REVIEW_DAYS_SQL if table_name == "review_actions" else CHANGED_DAYS_SQL,
+                        {"since": since})
+        days = {r[0] for r in cur.fetchall() if r[0] is not None}
+    if state.get("last_day"):
+        days.add(date.fromisoformat(state["last_day"]))
+
+    rows = written = 0
+    for day in sorted(days):
+        t = _fetch_day(conn, spec, day)
+        rows += t.num_rows
+        written += _write_partition(root, table_name, day, t, fmt)
+
+    last_day = max(days, default=None)
+    _save_state(root, table_name, {
+        "format": fmt,
+        "exported_at": started.isoformat(),
+        "last_day": last_day.isoformat() if last_day else None,
+    })
+    return {"table": table_name, "partitions": len(days), "rows": rows, "bytes": written}
+
+
+def export_all(root: str = SNAPSHOT_DIR, fmt: str = SNAPSHOT_FORMAT, full: bool = False,
+               tables=tuple(TABLES)) -> list[dict]:
+    conn = connect()
+    try:
+        conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        return [export_table(conn, name, root=root, fmt=fmt, full=full) for name in tables]
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def read_table(table_name: str, columns=None, start: date = None, end: date = None,
+               root: str = SNAPSHOT_DIR) -> pa.Table:
+    """
+    Load a snapshot table. Files are memory-mapped; only `columns` are decoded
+    and only partitions with start <= date <= end are opened.
+    """
+    state = _load_state(root, table_name)
+    fmt = "ipc" if state.get("format") == "arrow" else "parquet"
+    dataset = ds.dataset(
+        os.path.join(root, table_name),
+        format=fmt,
+        partitioning=ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive"),
+        filesystem=pafs.LocalFileSystem(use_mmap=True),
+        exclude_invalid_files=True,
+        ignore_prefixes=["_", "."],
+    )
+    flt = None
+    if start is not None:
+        flt = ds.field("date") >= start.isoformat()
+    if end is not None:
+        upper = ds.field("date") <= end.isoformat()
+        flt = upper if flt is None else flt & upper
+    return dataset.to_table(columns=columns, filter=flt)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar snapshots of the fraud tables.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    exp = sub.add_parser("export")
+    exp.add_argument("--full", action="store_true", help="rewrite every partition")
+    exp.add_argument("--format", choices=("parquet", "arrow"), default=SNAPSHOT_FORMAT)
+    exp.add_argument("--root", default=SNAPSHOT_DIR)
+    exp.add_argument("--table", action="append", choices=tuple(TABLES))
+    show = sub.add_parser("show")
+    show.add_argument("table", choices=tuple(TABLES))
+    show.add_argument("--root", default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    if args.cmd == "export":
+        t0 = time.perf_counter()
+        for r in export_all(root=args.root, fmt=args.format, full=args.full, tables=args.table or tuple(TABLES)):
+            print(f"{r['table']:<22} {r['partitions']:>5} partitions {r['rows']:>10} rows {r['bytes'] / 1e6:>9.1f} MB")
+        print(f"Exported to {args.root} in {time.perf_counter() - t0:.2f}s.")
+    else:
+        t = read_table(args.table, root=args.root)
+        print(t.schema)
+        print(f"{t.num_rows} rows")
+
+
+if __name__ == "__main__":
+    main()